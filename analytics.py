@@ -0,0 +1,261 @@
+import json
+import sqlite3
+import threading
+import logging
+import datetime as dt
+from typing import Optional, Dict, Any, List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Analítica sobre loans/rets. Los días cerrados se agregan una sola vez en agg_day
+# (día, herramienta, trabajador) y agg_hour (día, hora); los informes leen esos
+# cubos más los días aún abiertos calculados al vuelo con el mismo código.
+# Los préstamos cuentan en el día en que empiezan; devoluciones y horas prestadas
+# en el día de la devolución, así un cubo cerrado no cambia nunca.
+
+DAY = "%Y-%m-%d"
+
+
+class Analytics:
+    def __init__(self, conn: sqlite3.Connection, lock: Optional[threading.RLock] = None):
+        self.conn, self.c = conn, conn.cursor()
+        self.lock = lock or threading.RLock()
+        self._init_db()
+
+    def _init_db(self):
+        with self.lock:
+            self.c.executescript('''
+            CREATE TABLE IF NOT EXISTS agg_worker (
+                id INTEGER PRIMARY KEY,
+                name TEXT UNIQUE
+            );
+            CREATE TABLE IF NOT EXISTS agg_day (
+                day TEXT,
+                h_id INTEGER,
+                w_id INTEGER,
+                loans INTEGER,
+                rets INTEGER,
+                dur_s INTEGER,
+                PRIMARY KEY (day, h_id, w_id)
+            );
+            CREATE TABLE IF NOT EXISTS agg_hour (
+                day TEXT,
+                hour INTEGER,
+                loans INTEGER,
+                PRIMARY KEY (day, hour)
+            );
+            CREATE TABLE IF NOT EXISTS cfg (
+                k TEXT PRIMARY KEY,
+                v TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_loans_date ON loans(date);
+            CREATE INDEX IF NOT EXISTS idx_rets_date ON rets(date);
+            ''')
+            self.conn.commit()
+
+    def _upto(self) -> Optional[str]:
+        # Primer día aún sin cubo
+        self.c.execute('SELECT v FROM cfg WHERE k = "agg_upto"')
+        r = self.c.fetchone()
+        if r:
+            return r[0]
+        self.c.execute('SELECT MIN(substr(date, 1, 10)) FROM loans')
+        return self.c.fetchone()[0]
+
+    def _w_ids(self, names: np.ndarray) -> np.ndarray:
+        # Trabajador -> entero estable, para agregar sin arrays de objetos
+        self.c.executemany('INSERT OR IGNORE INTO agg_worker (name) VALUES (?)', [(n,) for n in names.tolist()])
+        self.conn.commit()  # no dejar una transacción abierta tras report()
+        self.c.execute('SELECT name, id FROM agg_worker')
+        ids = dict(self.c.fetchall())
+        return np.array([ids[n] for n in names.tolist()], dtype=np.int64)
+
+    def _extract(self, lo: str, hi: str) -> Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray]]:
+        # Cubos de [lo, hi) directamente de loans/rets, en columnas NumPy
+        hi_ts = hi + " 00:00:00"
+        lo_ts = lo + " 00:00:00"
+        self.c.execute('''
+            SELECT substr(date, 1, 10), h_id, worker, CAST(substr(date, 12, 2) AS INTEGER)
+            FROM loans WHERE date >= ? AND date < ?
+        ''', (lo_ts, hi_ts))
+        L = self.c.fetchall()
+        self.c.execute('''
+            SELECT substr(date, 1, 10), h_id, worker, i_id, CAST(strftime('%s', date) AS INTEGER)
+            FROM rets WHERE date >= ? AND date < ?
+        ''', (lo_ts, hi_ts))
+        R = self.c.fetchall()
+        # Préstamo de cada devolución: el último de la misma inst anterior a ella
+        self.c.execute('''
+            SELECT i_id, CAST(strftime('%s', date) AS INTEGER) FROM loans
+            WHERE i_id IN (SELECT i_id FROM rets WHERE date >= ? AND date < ?) AND date < ?
+        ''', (lo_ts, hi_ts, hi_ts))
+        P = np.array(self.c.fetchall() or np.empty((0, 2)), dtype=np.int64).reshape(-1, 2)
+
+        dur = np.zeros(len(R), dtype=np.int64)
+        if len(R) and len(P):
+            r_i = np.array([r[3] for r in R], dtype=np.int64)
+            r_t = np.array([r[4] for r in R], dtype=np.int64)
+            key = P[:, 0] * 10**10 + P[:, 1]
+            order = np.argsort(key)
+            key, p_i, p_t = key[order], P[order, 0], P[order, 1]
+            k = np.searchsorted(key, r_i * 10**10 + r_t, side="right") - 1
+            ok = (k >= 0) & (p_i[np.maximum(k, 0)] == r_i)
+            dur[ok] = r_t[ok] - p_t[k[ok]]
+
+        # (día, h_id, worker) -> loans, rets, dur_s
+        days = [r[0] for r in L] + [r[0] for r in R]
+        h_ids = [r[1] for r in L] + [r[1] for r in R]
+        workers = [r[2] or "" for r in L] + [r[2] or "" for r in R]
+        is_ret = np.r_[np.zeros(len(L), dtype=np.int64), np.ones(len(R), dtype=np.int64)]
+        secs = np.r_[np.zeros(len(L), dtype=np.int64), dur]
+        if not days:
+            empty = np.array([], dtype=object)
+            z = np.array([], dtype=np.int64)
+            return ({"day": empty, "h_id": z, "w_id": z, "loans": z, "rets": z, "dur_s": z},
+                    {"day": empty, "hour": z, "loans": z})
+        d_u, d_c = np.unique(np.array(days, dtype=object), return_inverse=True)
+        w_u, w_c = np.unique(np.array(workers, dtype=object), return_inverse=True)
+        w_u = self._w_ids(w_u)
+        h = np.array(h_ids, dtype=np.int64)
+        g_u, g_c = np.unique(np.stack([d_c, h, w_c], axis=1), axis=0, return_inverse=True)
+        g_c = g_c.ravel()
+        day_b = {
+            "day": d_u[g_u[:, 0]],
+            "h_id": g_u[:, 1],
+            "w_id": w_u[g_u[:, 2]],
+            "loans": np.bincount(g_c, weights=1 - is_ret, minlength=len(g_u)).astype(np.int64),
+            "rets": np.bincount(g_c, weights=is_ret, minlength=len(g_u)).astype(np.int64),
+            "dur_s": np.bincount(g_c, weights=secs, minlength=len(g_u)).astype(np.int64),
+        }
+        # (día, hora) -> loans
+        if L:
+            ld = d_c[:len(L)]
+            hh = np.array([r[3] for r in L], dtype=np.int64)
+            cnt = np.bincount(ld * 24 + hh, minlength=len(d_u) * 24).reshape(len(d_u), 24)
+            dd, hr = np.nonzero(cnt)
+            hour_b = {"day": d_u[dd], "hour": hr.astype(np.int64), "loans": cnt[dd, hr].astype(np.int64)}
+        else:
+            hour_b = {"day": np.array([], dtype=object), "hour": np.array([], dtype=np.int64), "loans": np.array([], dtype=np.int64)}
+        return day_b, hour_b
+
+    def refresh(self, today: Optional[str] = None, chunk: int = 31) -> int:
+        # Cierra en cubos los días completos anteriores a hoy, por tramos de `chunk` días
+        # soltando el lock entre tramos; devuelve cuántos días se agregaron
+        today = today or dt.date.today().strftime(DAY)
+        n = 0
+        while True:
+            with self.lock:
+                lo = self._upto()
+                if not lo or lo >= today:
+                    break
+                hi = min(today, (dt.date.fromisoformat(lo) + dt.timedelta(days=chunk)).strftime(DAY))
+                day_b, hour_b = self._extract(lo, hi)
+                self.c.execute('DELETE FROM agg_day WHERE day >= ? AND day < ?', (lo, hi))
+                self.c.execute('DELETE FROM agg_hour WHERE day >= ? AND day < ?', (lo, hi))
+                self.c.executemany('INSERT INTO agg_day VALUES (?, ?, ?, ?, ?, ?)', zip(
+                    day_b["day"].tolist(), day_b["h_id"].tolist(), day_b["w_id"].tolist(),
+                    day_b["loans"].tolist(), day_b["rets"].tolist(), day_b["dur_s"].tolist()))
+                self.c.executemany('INSERT INTO agg_hour VALUES (?, ?, ?)', zip(
+                    hour_b["day"].tolist(), hour_b["hour"].tolist(), hour_b["loans"].tolist()))
+                self.c.execute('INSERT OR REPLACE INTO cfg (k, v) VALUES ("agg_upto", ?)', (hi,))
+                self.conn.commit()
+                n += (dt.date.fromisoformat(hi) - dt.date.fromisoformat(lo)).days
+        if n:
+            logger.info("Analytics: %d days bucketed up to %s", n, today)
+        return n
+
+    def repoint(self, src: List[int], dst: int):
+        # Cubos de herramientas fusionadas en dst (InvApp.merge_tools); sin commit
+        ids_j = json.dumps(src)
+        with self.lock:
+            self.c.execute('''
+                INSERT INTO agg_day (day, h_id, w_id, loans, rets, dur_s)
+                SELECT day, ?, w_id, loans, rets, dur_s FROM agg_day WHERE h_id IN (SELECT value FROM json_each(?)) AND 1
+                ON CONFLICT (day, h_id, w_id) DO UPDATE SET
+                    loans = loans + excluded.loans, rets = rets + excluded.rets, dur_s = dur_s + excluded.dur_s
+            ''', (dst, ids_j))
+            self.c.execute('DELETE FROM agg_day WHERE h_id IN (SELECT value FROM json_each(?))', (ids_j,))
+
+    def _window(self, start: str, end: str) -> Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray]]:
+        # Cubos de [start, end] (días incluidos): agg_* hasta agg_upto y el resto al vuelo
+        hi = (dt.date.fromisoformat(end) + dt.timedelta(days=1)).strftime(DAY)
+        with self.lock:
+            upto = self._upto() or hi
+            mid = min(max(upto, start), hi)
+            self.c.execute('SELECT h_id, w_id, loans, rets, dur_s FROM agg_day WHERE day >= ? AND day < ?', (start, mid))
+            D = np.array(self.c.fetchall(), dtype=np.int64).reshape(-1, 5)
+            self.c.execute('SELECT hour, SUM(loans) FROM agg_hour WHERE day >= ? AND day < ? GROUP BY hour', (start, mid))
+            H = np.array(self.c.fetchall(), dtype=np.int64).reshape(-1, 2)
+            live_d, live_h = self._extract(mid, hi) if mid < hi else (None, None)
+        day_b = {k: D[:, j] for j, k in enumerate(("h_id", "w_id", "loans", "rets", "dur_s"))}
+        hour_b = {"hour": H[:, 0], "loans": H[:, 1]}
+        if live_d is not None:
+            for k in day_b:
+                day_b[k] = np.concatenate([day_b[k], live_d[k]])
+            for k in hour_b:
+                hour_b[k] = np.concatenate([hour_b[k], live_h[k]])
+        return day_b, hour_b
+
+    @staticmethod
+    def _group(keys: np.ndarray, b: Dict[str, np.ndarray]) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        u, c = np.unique(keys, return_inverse=True)
+        c = c.ravel()
+        return u, {k: np.bincount(c, weights=b[k], minlength=len(u)) for k in ("loans", "rets", "dur_s")}
+
+    def report(self, start: str, end: str, top: int = 20) -> Dict[str, Any]:
+        day_b, hour_b = self._window(start, end)
+        hours = ((dt.date.fromisoformat(end) - dt.date.fromisoformat(start)).days + 1) * 24
+        with self.lock:
+            # En reutilizables qty == nº de insts (InvApp._resize lo mantiene)
+            self.c.execute('SELECT id, name, qty FROM tools WHERE is_consumable = 0')
+            tools = {r[0]: (r[1], r[2]) for r in self.c.fetchall()}
+            self.c.execute('SELECT id, name FROM agg_worker')
+            names = dict(self.c.fetchall())
+
+        # Utilización: horas prestadas / (insts * horas de la ventana)
+        h_u, h_s = self._group(day_b["h_id"], day_b)
+        n_inst = np.array([tools.get(int(h), ("", 0))[1] for h in h_u], dtype=np.float64)
+        util = np.divide(h_s["dur_s"] / 3600, n_inst * hours, out=np.zeros(len(h_u)), where=n_inst > 0)
+        order = np.argsort(-util)[:top]
+        per_tool = [{
+            "h_id": int(h_u[k]),
+            "name": tools.get(int(h_u[k]), ("?", 0))[0],
+            "loans": int(h_s["loans"][k]),
+            "util": round(float(util[k]), 4),
+            "mean_h": round(float(h_s["dur_s"][k] / h_s["rets"][k] / 3600), 2) if h_s["rets"][k] else None,
+        } for k in order]
+
+        w_u, w_s = self._group(day_b["w_id"], day_b)
+        order = np.argsort(-w_s["loans"])[:top]
+        per_worker = [{
+            "worker": names.get(int(w_u[k]), "?"),
+            "loans": int(w_s["loans"][k]),
+            "rets": int(w_s["rets"][k]),
+            "hours": round(float(w_s["dur_s"][k] / 3600), 1),
+        } for k in order]
+
+        peak = np.bincount(hour_b["hour"], weights=hour_b["loans"], minlength=24)[:24].astype(np.int64)
+        n_ret = int(day_b["rets"].sum())
+        return {
+            "start": start,
+            "end": end,
+            "loans": int(day_b["loans"].sum()),
+            "rets": n_ret,
+            "mean_h": round(float(day_b["dur_s"].sum() / n_ret / 3600), 2) if n_ret else None,
+            "util": round(float(day_b["dur_s"].sum() / 3600 / max(1, sum(n for _, n in tools.values()) * hours)), 4),
+            "peak_hours": peak.tolist(),
+            "tools": per_tool,
+            "workers": per_worker,
+        }
+
+    def utilization(self, start: str, end: str, top: int = 20) -> List[Dict[str, Any]]:
+        return self.report(start, end, top)["tools"]
+
+    def worker_activity(self, start: str, end: str, top: int = 20) -> List[Dict[str, Any]]:
+        return self.report(start, end, top)["workers"]
+
+    def peak_hours(self, start: str, end: str) -> List[int]:
+        _, hour_b = self._window(start, end)
+        return np.bincount(hour_b["hour"], weights=hour_b["loans"], minlength=24)[:24].astype(np.int64).tolist()
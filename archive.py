@@ -0,0 +1,168 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+import logging
+import datetime as dt
+from typing import Optional, Dict, List
+
+from workers import norm
+
+logger = logging.getLogger(__name__)
+
+# Archivo por años de loans/rets cerrados. Cada año es un fichero inv_<año>.db
+# adjuntado como esquema a<año>; las tablas vivas solo guardan lo reciente y las
+# vistas TEMP loans_all/rets_all unen todo para informes históricos.
+# El traslado va por lotes cortos (INSERT en el archivo + DELETE en main en una
+# transacción) soltando el lock entre lotes.
+
+ARCH_MONTHS = 12  # meses que se quedan en las tablas vivas
+ARCH_RE = re.compile(r"^inv_(\d{4})\.db$")
+COLS = {
+    "loans": "id, h_id, i_id, worker, w_id, date, due, closed",
+    "rets": "id, h_id, i_id, worker, w_id, date, notes",
+}
+
+
+class Archiver:
+    def __init__(self, conn: sqlite3.Connection, arch_dir: str = "archive", lock: Optional[threading.RLock] = None):
+        self.conn, self.c = conn, conn.cursor()
+        self.dir = os.path.abspath(arch_dir)
+        os.makedirs(self.dir, exist_ok=True)
+        self.lock = lock or threading.RLock()
+        self.years: List[str] = []
+        with self.lock:
+            for f in sorted(os.listdir(self.dir)):
+                m = ARCH_RE.match(f)
+                if m:
+                    self._attach(m.group(1), views=False)
+            self._views()
+
+    def _attach(self, year: str, views: bool = True):
+        if year in self.years:
+            return
+        self.conn.commit()  # ATTACH no vale dentro de una transacción
+        self.c.execute('ATTACH DATABASE ? AS ' + f"a{year}", (os.path.join(self.dir, f"inv_{year}.db"),))
+        self.c.executescript(f'''
+        CREATE TABLE IF NOT EXISTS a{year}.loans (
+            id INTEGER PRIMARY KEY, h_id INTEGER, i_id INTEGER, worker TEXT, w_id INTEGER, date TEXT, due TEXT, closed TEXT
+        );
+        CREATE TABLE IF NOT EXISTS a{year}.rets (
+            id INTEGER PRIMARY KEY, h_id INTEGER, i_id INTEGER, worker TEXT, w_id INTEGER, date TEXT, notes TEXT
+        );
+        CREATE INDEX IF NOT EXISTS a{year}.idx_loans_date ON loans(date);
+        CREATE INDEX IF NOT EXISTS a{year}.idx_loans_i_date ON loans(i_id, date);
+        CREATE INDEX IF NOT EXISTS a{year}.idx_rets_date ON rets(date);
+        CREATE INDEX IF NOT EXISTS a{year}.idx_rets_i_date ON rets(i_id, date);
+        DROP INDEX IF EXISTS a{year}.idx_loans_i_id;  -- (i_id, date) las sustituye: historial de inst en orden
+        DROP INDEX IF EXISTS a{year}.idx_rets_i_id;
+        ''')
+        # Ficheros de antes de workers.py: se añade w_id y se enlaza por nombre normalizado
+        for tbl in COLS:
+            cols = [r[1] for r in self.c.execute(f'PRAGMA a{year}.table_info({tbl})').fetchall()]
+            if 'w_id' not in cols:
+                self.c.execute(f'ALTER TABLE a{year}.{tbl} ADD COLUMN w_id INTEGER')
+                self._link(year, tbl)
+        self.c.executescript(f'''
+        CREATE INDEX IF NOT EXISTS a{year}.idx_loans_w ON loans(w_id, date);
+        CREATE INDEX IF NOT EXISTS a{year}.idx_rets_w ON rets(w_id, date);
+        ''')
+        self.conn.commit()
+        self.years.append(year)
+        self.years.sort()
+        if views:
+            self._views()
+
+    def _link(self, year: str, tbl: str):
+        m = []
+        for (w,) in self.c.execute(f'SELECT DISTINCT worker FROM a{year}.{tbl}').fetchall():
+            r = self.c.execute('SELECT id FROM main.workers WHERE norm = ?', (norm(w),)).fetchone()
+            if r:
+                m.append((w, r[0]))
+        self.c.execute('CREATE TEMP TABLE IF NOT EXISTS w_map (worker TEXT PRIMARY KEY, w_id INTEGER)')
+        self.c.execute('DELETE FROM temp.w_map')
+        self.c.executemany('INSERT INTO temp.w_map VALUES (?, ?)', m)
+        self.c.execute(f'''
+            UPDATE a{year}.{tbl} SET w_id = (SELECT w_id FROM temp.w_map m WHERE m.worker = {tbl}.worker)
+            WHERE w_id IS NULL
+        ''')
+        n = self.c.rowcount
+        self.c.execute('DELETE FROM temp.w_map')
+        logger.info("Archive %s.%s: w_id for %d rows", year, tbl, n)
+
+    def _views(self):
+        for tbl, cols in COLS.items():
+            self.c.execute(f'DROP VIEW IF EXISTS temp.{tbl}_all')
+            self.c.execute(f'CREATE TEMP VIEW {tbl}_all AS ' + " UNION ALL ".join(
+                [f'SELECT {cols} FROM main.{tbl}'] + [f'SELECT {cols} FROM a{y}.{tbl}' for y in self.years]))
+
+    def _batch(self, tbl: str, where: str, args: tuple, batch: int) -> int:
+        with self.lock:
+            self.c.execute(f'SELECT id, substr(date, 1, 4) FROM main.{tbl} WHERE {where} ORDER BY id LIMIT ?', (*args, batch))
+            rows = self.c.fetchall()
+            if not rows:
+                return 0
+            by_year: Dict[str, List[int]] = {}
+            for id, y in rows:
+                by_year.setdefault(y, []).append(id)
+            for y in by_year:
+                self._attach(y)
+            try:
+                for y, ids in by_year.items():
+                    marks = ",".join("?" * len(ids))
+                    self.c.execute(f'INSERT OR REPLACE INTO a{y}.{tbl} ({COLS[tbl]}) SELECT {COLS[tbl]} FROM main.{tbl} WHERE id IN ({marks})', ids)
+                    self.c.execute(f'DELETE FROM main.{tbl} WHERE id IN ({marks})', ids)
+                self.conn.commit()
+            except sqlite3.Error:
+                self.conn.rollback()
+                raise
+            return len(rows)
+
+    def run(self, cutoff: str, batch: int = 2000, pause: float = 0.01) -> Dict[str, int]:
+        # Mueve loans cerrados y rets anteriores a `cutoff` (YYYY-MM-DD) hasta vaciar
+        moved = {"loans": 0, "rets": 0}
+        jobs = (
+            ("loans", "closed IS NOT NULL AND closed < ?", (cutoff,)),
+            ("rets", "date < ?", (cutoff,)),
+        )
+        for tbl, where, args in jobs:
+            while True:
+                n = self._batch(tbl, where, args, batch)
+                moved[tbl] += n
+                if n < batch:
+                    break
+                time.sleep(pause)  # deja pasar a la UI entre lotes
+        if moved["loans"] or moved["rets"]:
+            logger.info("Archive < %s: %s", cutoff, moved)
+        return moved
+
+    def archive(self, months: int = ARCH_MONTHS, batch: int = 2000) -> Dict[str, int]:
+        cutoff = (dt.date.today().replace(day=1) - dt.timedelta(days=30 * months)).replace(day=1)
+        with self.lock:
+            # No archivar días que analytics aún no haya cerrado en cubos
+            self.c.execute('SELECT v FROM cfg WHERE k = "agg_upto"')
+            r = self.c.fetchone()
+        cut = cutoff.strftime("%Y-%m-%d")
+        if r and r[0] < cut:
+            cut = r[0]
+        elif not r:
+            return {"loans": 0, "rets": 0}
+        return self.run(cut, batch)
+
+    def repoint(self, src: List[int], dst: int):
+        # Historial archivado de herramientas fusionadas en dst (InvApp.merge_tools); sin commit
+        ids_j = json.dumps(src)
+        with self.lock:
+            for y in self.years:
+                for tbl in COLS:
+                    self.c.execute(f'UPDATE a{y}.{tbl} SET h_id = ? WHERE h_id IN (SELECT value FROM json_each(?))', (dst, ids_j))
+
+    def sizes(self) -> Dict[str, int]:
+        with self.lock:
+            out = {}
+            for y in self.years:
+                self.c.execute(f'SELECT (SELECT COUNT(*) FROM a{y}.loans), (SELECT COUNT(*) FROM a{y}.rets)')
+                out[y] = sum(self.c.fetchone())
+            return out
@@ -0,0 +1,217 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import sqlite3
+import argparse
+import logging
+import datetime as dt
+from typing import Optional, Dict, List, Any
+
+logger = logging.getLogger(__name__)
+
+# Copias en caliente: inv.db y los archivos anuales adjuntos con la API de backup de
+# SQLite (PAGES páginas por paso, así la app sigue atendiendo entre pasos), y los
+# directorios de medios como manifiesto de trozos por hash en un almacén común objs/.
+# Un fichero sin cambios (tamaño + mtime) reutiliza su entrada; uno cambiado solo sube
+# los trozos nuevos, p.ej. la cola añadida de qrs.<gen>.pack.
+#
+#   root/objs/ab/abcd...        trozo de CHUNK bytes, nombre = sha256
+#   root/snaps/<ts>/inv.db      + archive/inv_<año>.db
+#   root/snaps/<ts>/manifest.json
+
+CHUNK = 4 << 20
+PAGES = 256  # ~1 MiB por paso con páginas de 4 KiB
+TS = "%Y%m%d-%H%M%S"
+
+
+def _sha(b: bytes) -> str:
+    return hashlib.sha256(b).hexdigest()
+
+
+def snaps(root: str) -> List[str]:
+    d = os.path.join(root, "snaps")
+    if not os.path.isdir(d):
+        return []
+    return sorted(s for s in os.listdir(d) if os.path.exists(os.path.join(d, s, "manifest.json")))
+
+
+def _manifest(root: str, snap: str) -> Dict[str, Any]:
+    with open(os.path.join(root, "snaps", snap, "manifest.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+class Backup:
+    def __init__(self, conn: sqlite3.Connection, root: str, media: Dict[str, str]):
+        self.conn = conn  # la conexión de la app: sus propias escrituras no reinician la copia
+        self.root = os.path.abspath(root)
+        self.media = media  # nombre en la copia -> directorio, p.ej. {"tool_imgs": ..., "qr_codes": ...}
+        self.objs = os.path.join(self.root, "objs")
+
+    def _dbs(self) -> Dict[str, str]:
+        # main -> inv.db, a<año> -> archive/inv_<año>.db
+        out = {}
+        for _, name, fname in self.conn.execute('PRAGMA database_list').fetchall():
+            if name == "main":
+                out[name] = "inv.db"
+            elif name != "temp" and fname:
+                out[name] = os.path.join("archive", os.path.basename(fname))
+        return out
+
+    def _db(self, name: str, dest: str):
+        tmp = dest + ".part"
+        dst = sqlite3.connect(tmp)
+        try:
+            # Si conn está a mitad de escritura el paso devuelve LOCKED y se reintenta en 5 ms
+            self.conn.backup(dst, pages=PAGES, name=name, sleep=0.005)
+        finally:
+            dst.close()
+        os.replace(tmp, dest)
+
+    def _put(self, data: bytes) -> tuple:
+        h = _sha(data)
+        d = os.path.join(self.objs, h[:2])
+        path = os.path.join(d, h)
+        if os.path.exists(path):
+            return h, 0
+        os.makedirs(d, exist_ok=True)
+        with open(path + ".part", "wb") as f:
+            f.write(data)
+        os.replace(path + ".part", path)
+        return h, len(data)
+
+    def _file(self, path: str) -> tuple:
+        # Lee por trozos; si el fichero cambió mientras se leía (tamaño/mtime), se repite
+        for _ in range(3):
+            st = os.stat(path)
+            chunks, new = [], 0
+            with open(path, "rb") as f:
+                while True:
+                    b = f.read(CHUNK)
+                    if not b:
+                        break
+                    h, n = self._put(b)
+                    chunks.append(h)
+                    new += n
+            st2 = os.stat(path)
+            if (st.st_size, st.st_mtime_ns) == (st2.st_size, st2.st_mtime_ns):
+                break
+        return {"size": st.st_size, "mtime": st.st_mtime_ns, "chunks": chunks}, new
+
+    def snapshot(self) -> Dict[str, Any]:
+        t0 = time.perf_counter()
+        ts = base = dt.datetime.now().strftime(TS)
+        prev = snaps(self.root)
+        old = _manifest(self.root, prev[-1])["files"] if prev else {}
+        n = 0
+        while os.path.exists(os.path.join(self.root, "snaps", ts)):
+            n += 1
+            ts = f"{base}-{n}"
+        d = os.path.join(self.root, "snaps", ts)
+        os.makedirs(os.path.join(d, "archive"), exist_ok=True)
+        # Primero la BD: lo que indexa (imgs, offsets del pack) ya existe en disco
+        dbs = self._dbs()
+        for name, rel in dbs.items():
+            self._db(name, os.path.join(d, rel))
+        t_db = time.perf_counter() - t0
+        files, new, kept = {}, 0, 0
+        for key, mdir in self.media.items():
+            if not os.path.isdir(mdir):
+                continue
+            for f in sorted(os.listdir(mdir)):
+                p = os.path.join(mdir, f)
+                if not os.path.isfile(p):
+                    continue
+                rel = f"{key}/{f}"
+                st = os.stat(p)
+                o = old.get(rel)
+                if o and (o["size"], o["mtime"]) == (st.st_size, st.st_mtime_ns):
+                    files[rel] = o
+                    kept += 1
+                    continue
+                files[rel], n = self._file(p)
+                new += n
+        with open(os.path.join(d, "manifest.json.part"), "w", encoding="utf-8") as f:
+            json.dump({"ts": ts, "dbs": sorted(dbs.values()), "files": files}, f)
+        os.replace(os.path.join(d, "manifest.json.part"), os.path.join(d, "manifest.json"))
+        res = {"snap": ts, "db_s": round(t_db, 3), "s": round(time.perf_counter() - t0, 3),
+               "files": len(files), "kept": kept, "new_bytes": new}
+        logger.info("Backup %s", res)
+        return res
+
+
+def restore(root: str, dest: str, snap: Optional[str] = None, force: bool = False) -> Dict[str, Any]:
+    # Con la app parada: deja inv.db, archive/, tool_imgs/ y qr_codes/ de `snap` en dest
+    root, dest = os.path.abspath(root), os.path.abspath(dest)
+    all_snaps = snaps(root)
+    if not all_snaps:
+        raise FileNotFoundError(f"No snapshots in {root}")
+    snap = snap or all_snaps[-1]
+    m = _manifest(root, snap)
+    if os.path.exists(os.path.join(dest, "inv.db")) and not force:
+        raise FileExistsError(f"{dest}/inv.db exists (use force)")
+    t0 = time.perf_counter()
+    os.makedirs(os.path.join(dest, "archive"), exist_ok=True)
+    for rel in m["dbs"]:
+        src, dst = os.path.join(root, "snaps", snap, rel), os.path.join(dest, rel)
+        shutil.copyfile(src, dst + ".part")
+        os.replace(dst + ".part", dst)
+    for rel, e in m["files"].items():
+        p = os.path.join(dest, *rel.split("/"))
+        os.makedirs(os.path.dirname(p), exist_ok=True)
+        with open(p + ".part", "wb") as f:
+            for h in e["chunks"]:
+                with open(os.path.join(root, "objs", h[:2], h), "rb") as o:
+                    b = o.read()
+                if _sha(b) != h:
+                    raise ValueError(f"Corrupt chunk {h} ({rel})")
+                f.write(b)
+        os.replace(p + ".part", p)
+    return {"snap": snap, "dbs": len(m["dbs"]), "files": len(m["files"]), "s": round(time.perf_counter() - t0, 3)}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    # Uso:
+    #   python backup.py snap bk/ --db inv.db            (BD en uso: vale igual, es en caliente)
+    #   python backup.py ls bk/
+    #   python backup.py restore bk/ --to . [--snap 20250101-120000] [--force]
+    p = argparse.ArgumentParser(prog="backup.py")
+    sp = p.add_subparsers(dest="cmd", required=True)
+    s = sp.add_parser("snap")
+    s.add_argument("root")
+    s.add_argument("--db", default="inv.db")
+    s.add_argument("--img-dir", default="tool_imgs")
+    s.add_argument("--qr-dir", default="qr_codes")
+    s.add_argument("--arch-dir", default="archive")
+    ls = sp.add_parser("ls")
+    ls.add_argument("root")
+    r = sp.add_parser("restore")
+    r.add_argument("root")
+    r.add_argument("--to", default=".")
+    r.add_argument("--snap")
+    r.add_argument("--force", action="store_true")
+    a = p.parse_args(argv)
+
+    if a.cmd == "snap":
+        from archive import Archiver
+        conn = sqlite3.connect(a.db)
+        Archiver(conn, a.arch_dir)  # adjunta los años archivados
+        print(json.dumps(Backup(conn, a.root, {"tool_imgs": a.img_dir, "qr_codes": a.qr_dir}).snapshot()))
+        conn.close()
+    elif a.cmd == "ls":
+        for s in snaps(a.root):
+            m = _manifest(a.root, s)
+            print(f"{s}  dbs={len(m['dbs'])}  files={len(m['files'])}")
+    else:
+        try:
+            print(json.dumps(restore(a.root, a.to, a.snap, a.force)))
+        except (FileNotFoundError, FileExistsError, ValueError) as e:
+            print(f"restore: {e}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1680 @@
+import argparse
+import datetime as dt
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import gc
+import fnmatch
+import functools
+import uuid
+from dataclasses import dataclass
+from typing import Callable, Dict, Any, List, Optional
+
+import qrcode
+
+from inv2log import InvApp, QRData, Tool, ToolInst, SQL, PLAN_OK, MIRROR_MB
+from backup import Backup, restore
+import workers
+import reservations
+import locations
+import timeline
+import dedup
+from overdue import OVERDUE_HRS
+
+# Uso:
+#   python bench.py gen bench.db --tools 2000 --insts 5 --years 2
+#   python bench.py run --db bench.db --out base.json   (trabaja sobre una copia: bench.db no cambia)
+#   python bench.py cmp base.json new.json --threshold 0.2
+#   python bench.py plans --scale large          (sale con 1 si una consulta cae a SCAN/TEMP B-TREE)
+#   python bench.py run --scale mem --only mem_tools_rows mem_tools_slots mem_tools_table mem_insts_rows mem_insts_slots mem_insts_table
+#   python -m pytest tests                       (comprobaciones; bench.py solo mide)
+
+SCALES = {
+    "small": {"tools": 200, "insts": 3, "years": 1, "loans_day": 20},
+    "medium": {"tools": 2000, "insts": 5, "years": 2, "loans_day": 80},
+    "large": {"tools": 20000, "insts": 10, "years": 5, "loans_day": 400},
+    "mem": {"tools": 100000, "insts": 12, "years": 0, "loans_day": 0},  # ~1M instancias
+}
+
+NAMES = ["Taladro", "Llave", "Martillo", "Sierra", "Pulidora", "Multimetro", "Nivel", "Alicate", "Destornillador", "Soldadora"]
+BRANDS = ["Bosch", "Makita", "DeWalt", "Stanley", "Fluke", "Truper", "Milwaukee", "Hilti"]
+WORKERS = [f"Worker {i:03d}" for i in range(150)]
+FMT = "%Y-%m-%d %H:%M:%S"
+
+BENCHES: Dict[str, Callable] = {}
+KINDS: Dict[str, str] = {}
+
+
+def bench(name: str, kind: str = "time"):
+    # kind="mem": run() devuelve el objeto construido y se mide con tracemalloc
+    def deco(func):
+        BENCHES[name] = func
+        KINDS[name] = kind
+        return func
+    return deco
+
+
+def _open(d: str, db: str = "inv.db", mirror_mb: float = MIRROR_MB) -> InvApp:
+    # InvApp sobre d/db con sus medios y archivo en d; con el espejo de la UI salvo que se pida otra cosa
+    return InvApp(db=os.path.join(d, db), img_dir=os.path.join(d, "tool_imgs"), qr_dir=os.path.join(d, "qr_codes"),
+                  arch_dir=os.path.join(d, "archive"), mirror_mb=mirror_mb)
+
+
+def _work_copy(db: str, work: str, media: bool = True) -> str:
+    # Copia de db en work/inv.db; con media, también sus medios. Para `run/plans --db` (los benches escriben
+    # y borran: resize, bulk_*, merge, archivo) y, sin medios, para las copias de _copy
+    src = os.path.dirname(os.path.abspath(db))
+    dst = os.path.join(work, "inv.db")
+    s, d = sqlite3.connect(f"file:{os.path.abspath(db)}?mode=ro", uri=True), sqlite3.connect(dst)
+    try:
+        s.backup(d)
+        if not media:
+            return dst
+        dirs = {}
+        for sub in ("tool_imgs", "qr_codes", "archive"):
+            if os.path.isdir(os.path.join(src, sub)):
+                shutil.copytree(os.path.join(src, sub), os.path.join(work, sub))
+            dirs[os.path.join(src, sub) + os.sep] = os.path.join(work, sub) + os.sep
+        # Las rutas guardadas son absolutas: pasan a la copia; las de fuera se anulan, así
+        # ningún bench borra ficheros del inventario real
+        case = " ".join("WHEN substr(img, 1, ?) = ? THEN ? || substr(img, ?)" for _ in dirs)
+        for tbl in ("tools", "tool_inst", "h_qr"):
+            d.execute(f'UPDATE {tbl} SET img = CASE {case} END WHERE img IS NOT NULL',
+                      [v for a, b in dirs.items() for v in (len(a), a, b, len(a) + 1)])
+        d.commit()
+    finally:
+        s.close()
+        d.close()
+    return dst
+
+
+def _copy(app: InvApp, tmp: str, tag: str) -> InvApp:
+    # Copia nueva de la BD de bench en tmp/<tag>, con los cubos al día (para poder archivar sin tocar el original)
+    app.an.refresh()
+    d = os.path.join(tmp, tag)
+    if os.path.exists(d):
+        shutil.rmtree(d)
+    os.makedirs(d)
+    _work_copy(app.conn.execute('PRAGMA database_list').fetchone()[2], d, media=False)
+    return _open(d)
+
+
+_FIX: Dict[tuple, Any] = {}
+
+
+def fixture(func):
+    # Copia preparada una sola vez por directorio de trabajo y compartida por los benches que la piden
+    @functools.wraps(func)
+    def wrap(app: InvApp, tmp: str):
+        k = (func.__name__, tmp)
+        if k not in _FIX:
+            _FIX[k] = func(app, tmp)
+        return _FIX[k]
+    return wrap
+
+
+def gen_db(path: str, tools: int, insts: int, years: float, loans_day: int, seed: int = 42) -> Dict[str, int]:
+    rnd = random.Random(seed)
+    work = os.path.dirname(os.path.abspath(path))
+    app = _open(work, os.path.basename(path), mirror_mb=0)
+    c = app.conn.cursor()
+    t_rows, i_rows = [], []
+    for h_id in range(1, tools + 1):
+        tool_uuid = str(uuid.UUID(int=rnd.getrandbits(128), version=4))
+        is_consumable = rnd.random() < 0.2
+        qty = rnd.randint(10, 500) if is_consumable else max(1, int(rnd.expovariate(1 / insts)))
+        name = f"{rnd.choice(NAMES)} {rnd.choice(BRANDS)} {h_id}"
+        t_rows.append((h_id, tool_uuid, name, rnd.choice(WORKERS), qty, is_consumable, None, "avail"))
+        if not is_consumable:
+            for i in range(qty):
+                i_rows.append((h_id, tool_uuid, f"{tool_uuid}-{i+1:03d}", "avail",
+                               str(uuid.UUID(int=rnd.getrandbits(128), version=4)), None, i + 1))
+    c.executemany('INSERT INTO tools (id, tool_uuid, name, resp, qty, is_consumable, img, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', t_rows)
+    c.executemany('INSERT INTO tool_inst (h_id, tool_uuid, serial, status, qr_uuid, img, ord) VALUES (?, ?, ?, ?, ?, ?, ?)', i_rows)
+    c.execute('SELECT id, h_id FROM tool_inst')
+    inst_ids = c.fetchall()
+    # Prestamos/devoluciones a lo largo de `years`; ~3% quedan abiertos (algunos vencidos)
+    loans, rets, open_ids = [], [], set()
+    now = dt.datetime.now().replace(microsecond=0)
+    start = now - dt.timedelta(days=int(years * 365))
+    days = int(years * 365)
+    for d in range(days + 1):
+        day = start + dt.timedelta(days=d)
+        for _ in range(loans_day if inst_ids else 0):
+            i_id, h_id = rnd.choice(inst_ids)
+            l_date = day + dt.timedelta(hours=rnd.uniform(6, 18))
+            if l_date > now:
+                continue
+            worker = rnd.choice(WORKERS)
+            r_date = l_date + dt.timedelta(hours=rnd.expovariate(1 / 20))
+            due = (l_date + dt.timedelta(hours=OVERDUE_HRS)).strftime(FMT)
+            if r_date < now and (d < days - 3 or rnd.random() > 0.3):
+                rets.append((h_id, i_id, worker, r_date.strftime(FMT), "" if rnd.random() > 0.1 else "ok"))
+                loans.append((h_id, i_id, worker, l_date.strftime(FMT), due, r_date.strftime(FMT)))
+            else:
+                open_ids.add(i_id)
+                loans.append((h_id, i_id, worker, l_date.strftime(FMT), due, None))
+    c.executemany('INSERT INTO loans (h_id, i_id, worker, date, due, closed) VALUES (?, ?, ?, ?, ?, ?)', loans)
+    c.executemany('INSERT INTO rets (h_id, i_id, worker, date, notes) VALUES (?, ?, ?, ?, ?)', rets)
+    c.executemany('UPDATE tool_inst SET status = "loaned" WHERE id = ?', [(i,) for i in open_ids])
+    app.conn.commit()
+    app.conn.close()
+    return {"tools": len(t_rows), "insts": len(i_rows), "loans": len(loans), "rets": len(rets), "open": len(open_ids)}
+
+
+def _timeit(fn: Callable, repeat: int) -> Dict[str, Any]:
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        r = fn()
+        # run() puede devolver su propio tiempo si incluye preparación que no debe contar
+        times.append(r if isinstance(r, float) else time.perf_counter() - t0)
+    return {
+        "n": repeat,
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.fmean(times),
+    }
+
+
+def _memit(fn: Callable) -> Dict[str, Any]:
+    gc.collect()
+    tracemalloc.start()
+    obj = fn()
+    cur, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del obj
+    return {"n": 1, "bytes": cur, "peak": peak}
+
+
+def _sample_tools(app: InvApp, k: int = 50, reusable: bool = True):
+    app.c.execute('SELECT id, tool_uuid, name FROM tools WHERE is_consumable = ? ORDER BY id LIMIT ?', (0 if reusable else 1, k))
+    return app.c.fetchall()
+
+
+@bench("get_tools")
+def b_get_tools(app: InvApp, tmp: str):
+    def run():
+        app._cache = None
+        app.get_tools()
+    return run
+
+
+@bench("get_insts")
+def b_get_insts(app: InvApp, tmp: str):
+    ids = [r[0] for r in _sample_tools(app)]
+    def run():
+        for h_id in ids:
+            app.get_insts(h_id)
+    return run
+
+
+@bench("upd_tools")
+def b_upd_tools(app: InvApp, tmp: str):
+    # Mismo acceso a datos que upd_tools() en la UI, sin controles Flet
+    # (la tarjeta usa qty como nº de insts; ya no hay un get_insts por herramienta)
+    def run():
+        app._cache = None
+        for t in app.get_tools():
+            t.qty
+    return run
+
+
+@bench("gen_csv")
+def b_gen_csv(app: InvApp, tmp: str):
+    fname = os.path.join(tmp, "bench.csv")
+    def run():
+        app._cache = None
+        app.gen_csv(fname)
+    return run
+
+
+@bench("calc_tot_py")
+def b_calc_tot_py(app: InvApp, tmp: str):
+    # Referencia: el total anterior, sumando qty en Python tras recargar get_tools()
+    def run():
+        app._cache = None
+        app.get_tools().total_qty()
+    return run
+
+
+@bench("rollup")
+def b_rollup(app: InvApp, tmp: str):
+    app._cache = app._rollup = None
+    assert app.get_rollup()["qty"] == app.get_tools().total_qty()
+    def run():
+        app._rollup = None
+        app.get_rollup()
+    return run
+
+
+@bench("rollup_cached")
+def b_rollup_cached(app: InvApp, tmp: str):
+    return app.get_rollup
+
+
+@bench("consume_kiosks")
+def b_consume_kiosks(app: InvApp, tmp: str):
+    # 4 kioscos (InvApp y conexión propios) descontando del mismo consumible a la vez
+    db = app.conn.execute('PRAGMA database_list').fetchone()[2]
+    work = os.path.dirname(db)
+    ok, _ = app.add_tool("Bench consumable", "bench", 0, True)
+    app.c.execute('SELECT MAX(id) FROM tools')
+    h_id = app.c.fetchone()[0]
+    kiosks = [_open(work, os.path.basename(db)) for _ in range(4)]
+    def run():
+        app.c.execute('UPDATE tools SET qty = 1000 WHERE id = ?', (h_id,))
+        app.c.execute('DELETE FROM consumes WHERE h_id = ?', (h_id,))
+        app.conn.commit()
+        def work_k(k):
+            for _ in range(300):
+                k.consume_tool(h_id, 1, "kiosk")
+        ts = [threading.Thread(target=work_k, args=(k,)) for k in kiosks]
+        for t in ts:
+            t.start()
+        for t in ts:
+            t.join()
+        app.c.execute('SELECT qty FROM tools WHERE id = ?', (h_id,))
+        left = app.c.fetchone()[0]
+        app.c.execute('SELECT COUNT(*), SUM(qty) FROM consumes WHERE h_id = ?', (h_id,))
+        n, used = app.c.fetchone()
+        assert left == 0 and n == used == 1000, (left, n, used)
+    return run
+
+
+@bench("consume_batch")
+def b_consume_batch(app: InvApp, tmp: str):
+    app.c.execute('SELECT id FROM tools WHERE is_consumable = 1 ORDER BY id LIMIT 50')
+    ids = [r[0] for r in app.c.fetchall()]
+    def run():
+        app.c.execute(f'UPDATE tools SET qty = qty + 1 WHERE id IN ({",".join("?" * len(ids))})', ids)
+        app.conn.commit()
+        assert app.consume_batch([(i, 1) for i in ids], "bench")[0]
+    return run
+
+
+@bench("low_stock")
+def b_low_stock(app: InvApp, tmp: str):
+    app.c.execute('UPDATE tools SET reorder = 50 WHERE is_consumable = 1 AND reorder = 0')
+    app.conn.commit()
+    app.c.execute('EXPLAIN QUERY PLAN SELECT id FROM tools WHERE is_consumable = 1 AND reorder > 0 AND qty - reorder <= 0')
+    assert any("idx_tools_low" in r[3] for r in app.c.fetchall())
+    return app.low_stock
+
+
+def _an_reset(app: InvApp):
+    app.c.execute('DELETE FROM agg_day')
+    app.c.execute('DELETE FROM agg_hour')
+    app.c.execute('DELETE FROM cfg WHERE k = "agg_upto"')
+    app.conn.commit()
+
+
+def _year() -> tuple:
+    end = dt.date.today()
+    return (end - dt.timedelta(days=364)).isoformat(), end.isoformat()
+
+
+@bench("an_refresh")
+def b_an_refresh(app: InvApp, tmp: str):
+    # Reconstrucción completa de los cubos diarios
+    def run():
+        _an_reset(app)
+        app.an.refresh()
+    return run
+
+
+@bench("an_report_1y_live")
+def b_an_report_1y_live(app: InvApp, tmp: str):
+    # Sin cubos: el año entero se agrega al vuelo desde loans/rets
+    def run():
+        _an_reset(app)
+        t0 = time.perf_counter()
+        app.an.report(*_year())
+        return time.perf_counter() - t0
+    return run
+
+
+@bench("an_report_1y")
+def b_an_report_1y(app: InvApp, tmp: str):
+    # Mismo informe con y sin cubos
+    _an_reset(app)
+    live = app.an.report(*_year())
+    app.an.refresh()
+    assert app.an.report(*_year()) == live
+    return lambda: app.an.report(*_year())
+
+
+@bench("check_overdue")
+def b_check_overdue(app: InvApp, tmp: str):
+    # Lo que lee la UI: la cola persistida
+    app.od.tick()
+    return app.check_overdue
+
+
+@bench("overdue_scan")
+def b_overdue_scan(app: InvApp, tmp: str):
+    # Referencia: el check_overdue anterior, recorriendo loans en cada llamada
+    def run():
+        limit = (dt.datetime.now() - dt.timedelta(days=1)).strftime(FMT)
+        app.c.execute('''
+            SELECT l.id, h.name, ti.serial, l.worker, l.date
+            FROM loans l
+            JOIN tools h ON l.h_id = h.id
+            JOIN tool_inst ti ON l.i_id = ti.id
+            WHERE l.date < ? AND ti.status = "loaned"
+        ''', (limit,))
+        return app.c.fetchall()
+    return run
+
+
+@bench("overdue_tick")
+def b_overdue_tick(app: InvApp, tmp: str):
+    # Tick incremental con 20 préstamos que cruzan el umbral desde el anterior
+    app.od.tick()
+    app.c.execute('SELECT h_id, id FROM tool_inst WHERE status = "avail" ORDER BY id LIMIT 20')
+    rows = app.c.fetchall()
+    def run():
+        t0 = dt.datetime.now() - dt.timedelta(hours=OVERDUE_HRS)
+        for h_id, i_id in rows:
+            app.c.execute('INSERT INTO loans (h_id, i_id, worker, date, due) VALUES (?, ?, "bench", ?, ?)',
+                          (h_id, i_id, t0.strftime(FMT), dt.datetime.now().strftime(FMT)))
+        app.c.execute('UPDATE cfg SET v = ? WHERE k = "od_tick"', ((dt.datetime.now() - dt.timedelta(seconds=5)).strftime(FMT),))
+        app.conn.commit()
+        s = time.perf_counter()
+        batch = app.od.tick()
+        el = time.perf_counter() - s
+        assert len(batch) == len(rows), len(batch)
+        app.c.execute('DELETE FROM loans WHERE worker = "bench" AND closed IS NULL')
+        app.conn.commit()
+        return el
+    return run
+
+
+@bench("get_stats")
+def b_get_stats(app: InvApp, tmp: str):
+    return lambda: app.qr_mgr.get_stats(cache_secs=0)
+
+
+@bench("get_hist")
+def b_get_hist(app: InvApp, tmp: str):
+    return app.get_hist
+
+
+def _counts(app: InvApp, sfx: str = "") -> tuple:
+    app.c.execute(f'SELECT (SELECT COUNT(*) FROM loans{sfx}), (SELECT COUNT(*) FROM rets{sfx})')
+    return app.c.fetchone()
+
+
+@bench("archive")
+def b_archive(app: InvApp, tmp: str):
+    # Archivo completo (> ARCH_MONTHS) sobre una copia nueva en cada repetición
+    total = _counts(app)
+    def run():
+        a = _copy(app, tmp, "arch")
+        t0 = time.perf_counter()
+        a.arch.archive()
+        el = time.perf_counter() - t0
+        assert _counts(a, "_all") == total, (_counts(a, "_all"), total)
+        assert a.an.report(*_year()) == app.an.report(*_year())
+        a.conn.close()
+        return el
+    return run
+
+
+@bench("arch_batch")
+def b_arch_batch(app: InvApp, tmp: str):
+    # Lo que dura un lote (= lo que se retiene el lock de escritura)
+    a = _copy(app, tmp, "batch")
+    cut = a.an._upto()
+    run = lambda: a.arch._batch("loans", "closed IS NOT NULL AND closed < ?", (cut,), 2000)
+    run.close = a.conn.close
+    return run
+
+
+@bench("get_stats_arch")
+def b_get_stats_arch(app: InvApp, tmp: str):
+    a = _copy(app, tmp, "stats")
+    a.arch.archive()
+    run = lambda: a.qr_mgr.get_stats(cache_secs=0)
+    run.close = a.conn.close
+    return run
+
+
+@bench("get_hist_arch")
+def b_get_hist_arch(app: InvApp, tmp: str):
+    a = _copy(app, tmp, "hist")
+    a.arch.archive()
+    assert a.get_hist(all_years=True) == app.get_hist()
+    run = lambda: a.get_hist()
+    run.close = a.conn.close
+    return run
+
+
+def _bk_imgs(app: InvApp, n: int = 200):
+    # Unas cuantas imágenes para que la copia de medios tenga algo que leer
+    rnd = random.Random(7)
+    for i in range(n):
+        p = os.path.join(app.img_dir, f"bench_{i:04d}.jpg")
+        if not os.path.exists(p):
+            with open(p, "wb") as f:
+                f.write(rnd.randbytes(50_000))
+
+
+@bench("backup_snap")
+def b_backup_snap(app: InvApp, tmp: str):
+    # Copia completa en una raíz nueva; un hilo lee mientras tanto para ver la latencia que sufre la app
+    _bk_imgs(app)
+    lat, k = [], [0]
+    def run():
+        k[0] += 1
+        root = os.path.join(tmp, f"bk{k[0]}")
+        stop = threading.Event()
+        def reader():
+            while not stop.is_set():
+                t0 = time.perf_counter()
+                app.get_tool(1)
+                lat.append(time.perf_counter() - t0)
+        th = threading.Thread(target=reader)
+        th.start()
+        res = Backup(app.conn, root, app.bk.media).snapshot()
+        stop.set()
+        th.join()
+        shutil.rmtree(root)
+        return res["s"]
+    run.close = lambda: print(f"{'':<16} reader p99 {sorted(lat)[int(len(lat) * .99)] * 1000:.2f} ms, "
+                              f"max {max(lat) * 1000:.2f} ms over {len(lat)} reads", file=sys.stderr)
+    return run
+
+
+@bench("backup_incr")
+def b_backup_incr(app: InvApp, tmp: str):
+    # Segunda copia con una imagen nueva: los medios sin cambios no se releen ni se copian
+    _bk_imgs(app)
+    bk = Backup(app.conn, os.path.join(tmp, "bk_incr"), app.bk.media)
+    bk.snapshot()
+    k = [0]
+    def run():
+        k[0] += 1
+        with open(os.path.join(app.img_dir, f"bench_new_{k[0]}.jpg"), "wb") as f:
+            f.write(os.urandom(50_000))
+        t0 = time.perf_counter()
+        res = bk.snapshot()
+        el = time.perf_counter() - t0
+        assert res["new_bytes"] == 50_000 and res["kept"] == res["files"] - 1, res
+        return el
+    return run
+
+
+@bench("restore")
+def b_restore(app: InvApp, tmp: str):
+    _bk_imgs(app)
+    root = os.path.join(tmp, "bk_rs")
+    Backup(app.conn, root, app.bk.media).snapshot()
+    dest = os.path.join(tmp, "rs")
+    def run():
+        res = restore(root, dest, force=True)
+        c = sqlite3.connect(os.path.join(dest, "inv.db"))
+        assert c.execute('PRAGMA integrity_check').fetchone()[0] == "ok"
+        assert c.execute('SELECT COUNT(*) FROM loans').fetchone()[0] == _counts(app)[0]
+        c.close()
+        return res["s"]
+    return run
+
+
+@bench("changes_since")
+def b_changes_since(app: InvApp, tmp: str):
+    # Lo que lee un consumidor incremental: los últimos 1000 cambios desde su seq
+    _mk_tools(app, 200)
+    seq = app.cdc.head() - 1000
+    assert len(app.changes_since(seq)) == 1000
+    return lambda: app.changes_since(seq)
+
+
+def _repl_pair(app: InvApp, tmp: str) -> tuple:
+    # Nodo A (copia de la BD de bench) con ~120k cambios nuevos; B sembrado con la copia previa
+    a, b = _copy(app, tmp, "repl_a"), _copy(app, tmp, "repl_b")
+    b.repl.reset_node()
+    h0 = a.cdc.head()
+    _mk_tools(a, 2000)
+    a.c.execute('SELECT id, h_id FROM tool_inst')
+    insts = a.c.fetchall()
+    rnd = random.Random(3)
+    t0 = dt.datetime.now() - dt.timedelta(days=3)
+    for k in range(30000):
+        i_id, h_id = rnd.choice(insts)
+        l = (t0 + dt.timedelta(seconds=k * 7)).strftime(FMT)
+        a.c.execute('INSERT INTO loans (h_id, i_id, worker, date, due) VALUES (?, ?, "repl", ?, ?)', (h_id, i_id, l, l))
+        a.c.execute('UPDATE loans SET closed = ? WHERE id = last_insert_rowid()', (l,))
+        a.c.execute('INSERT INTO rets (h_id, i_id, worker, date, notes) VALUES (?, ?, "repl", ?, "")', (h_id, i_id, l))
+    a.conn.commit()
+    assert a.cdc.head() - h0 >= 100_000
+    b.conn.close()
+    return a, h0
+
+
+@bench("repl_export_100k")
+def b_repl_export_100k(app: InvApp, tmp: str):
+    a, h0 = _repl_pair(app, tmp)
+    def run():
+        t0 = time.perf_counter()
+        a.repl.export(os.path.join(tmp, "a.invcs"), "bench", since=h0)
+        return time.perf_counter() - t0
+    run.close = a.conn.close
+    return run
+
+
+@bench("repl_apply_100k")
+def b_repl_apply_100k(app: InvApp, tmp: str):
+    # Aplica en una copia nueva de B cada vez (que B quede igual que A: tests/test_repl.py)
+    a, h0 = _repl_pair(app, tmp)
+    b_dir = os.path.join(tmp, "repl_b")
+    b_db = os.path.join(b_dir, "inv.db")
+    shutil.copyfile(b_db, b_db + ".seed")
+    cs = os.path.join(tmp, "a.invcs")
+    a.repl.export(cs, "bench", since=h0)
+    def run():
+        shutil.copyfile(b_db + ".seed", b_db)
+        b = _open(b_dir)
+        t0 = time.perf_counter()
+        b.repl.apply(cs)
+        el = time.perf_counter() - t0
+        b.conn.close()
+        return el
+    run.close = a.conn.close
+    return run
+
+
+@bench("read_qr")
+def b_read_qr(app: InvApp, tmp: str):
+    app.c.execute('SELECT tool_uuid, id FROM tool_inst ORDER BY id LIMIT 200')
+    labels = [json.dumps({"tool_uuid": r[0], "i_id": r[1]}) for r in app.c.fetchall()]
+    def run():
+        for lbl in labels:
+            app.qr_mgr.read_qr(lbl)
+    return run
+
+
+def _pt_ids(app: InvApp, k: int = 1000) -> tuple:
+    app.c.execute('SELECT id, h_id, serial FROM tool_inst ORDER BY random() LIMIT ?', (k,))
+    rows = app.c.fetchall()
+    return [r[1] for r in rows], [r[0] for r in rows]
+
+
+def _disk(app: InvApp, run: Callable) -> Callable:
+    # Mismo bench con el espejo apagado (lo que pasa al exceder el presupuesto); close lo recarga
+    app.mirror._off("bench")
+    run.close = app.mirror.load
+    return run
+
+
+def _pt_tool(app: InvApp, disk: bool):
+    h_ids, _ = _pt_ids(app)
+    def run():
+        for h_id in h_ids:
+            app.get_tool(h_id)
+    return _disk(app, run) if disk else run
+
+
+def _pt_inst(app: InvApp, disk: bool):
+    _, i_ids = _pt_ids(app)
+    def run():
+        for i_id in i_ids:
+            app.get_inst(i_id)
+    return _disk(app, run) if disk else run
+
+
+def _big_tool(app: InvApp, n: int = 2000) -> tuple:
+    h_id = _mk_tools(app, 1, n)[0]
+    return h_id, app.get_tool(h_id).tool_uuid
+
+
+@bench("find_insts_2k")
+def b_find_insts_2k(app: InvApp, tmp: str):
+    # Lo que pide el selector: apertura ("") y tres teclas, sobre una herramienta de 2000 insts
+    h_id, _ = _big_tool(app)
+    qs = ["", "1", "12", "123"]
+    def run():
+        for q in qs:
+            app.find_insts(h_id, q, "avail")
+    return run
+
+
+@bench("get_insts_2k")
+def b_get_insts_2k(app: InvApp, tmp: str):
+    # Referencia: lo que cargaba el desplegable al abrir (todas las insts, desde disco)
+    h_id, _ = _big_tool(app)
+    return _disk(app, lambda: app.get_insts(h_id))
+
+
+def _worker(app: InvApp) -> tuple:
+    app.c.execute('SELECT w_id, worker FROM loans WHERE closed IS NULL AND w_id IS NOT NULL LIMIT 1')
+    return app.c.fetchone()
+
+
+@bench("worker_loans")
+def b_worker_loans(app: InvApp, tmp: str):
+    # "Qué tiene ahora y qué se llevó": préstamos abiertos + últimos 50, por w_id
+    w_id, name = _worker(app)
+    assert app.worker_loans(w_id) and len(app.worker_hist(w_id)) == 50
+    assert app.find_workers(" " + name.upper())[0]["id"] == w_id
+    return lambda: (app.worker_loans(w_id), app.worker_hist(w_id))
+
+
+@bench("worker_loans_text")
+def b_worker_loans_text(app: InvApp, tmp: str):
+    # Referencia: lo mismo filtrando por el texto de loans.worker (recorre loans)
+    _, name = _worker(app)
+    def run():
+        app.c.execute('SELECT id, h_id, i_id, date, due FROM loans WHERE worker = ? AND closed IS NULL ORDER BY due', (name,))
+        app.c.fetchall()
+        app.c.execute('SELECT id, date, closed FROM loans WHERE worker = ? ORDER BY date DESC LIMIT 50', (name,))
+        app.c.fetchall()
+    return run
+
+
+RES_N = 100_000
+
+
+@fixture
+def _res_copy(app: InvApp, tmp: str) -> tuple:
+    # Copia con RES_N reservas futuras sin solape por instancia (cadenas de 1-48 h con huecos de 1-72 h)
+    a = _copy(app, tmp, "res")
+    rnd = random.Random(7)
+    a.c.execute("SELECT id, h_id FROM tool_inst WHERE status != 'retired'")
+    insts = a.c.fetchall()
+    base = dt.datetime.now().replace(minute=0, second=0, microsecond=0) + dt.timedelta(days=1)
+    at = {i: base + dt.timedelta(minutes=rnd.randrange(0, 72 * 60)) for i, _ in insts}
+    rows = []
+    while len(rows) < RES_N:
+        for i_id, h_id in insts:
+            s = at[i_id]
+            e = s + dt.timedelta(minutes=rnd.randrange(60, 48 * 60, 15))
+            at[i_id] = e + dt.timedelta(minutes=rnd.randrange(60, 72 * 60, 15))
+            rows.append((h_id, i_id, WORKERS[len(rows) % len(WORKERS)], None, s.strftime(FMT), e.strftime(FMT), ""))
+            if len(rows) == RES_N:
+                break
+    a.c.executemany(reservations.SQL["res_add"], rows)
+    a.conn.commit()
+    end = max(at.values())
+    # Ventanas de consulta al azar dentro del periodo reservado
+    wins = []
+    for _ in range(1000):
+        i_id, h_id = rnd.choice(insts)
+        s = base + dt.timedelta(minutes=rnd.randrange(0, int((end - base).total_seconds() // 60), 15))
+        wins.append((h_id, i_id, s.strftime(FMT), (s + dt.timedelta(hours=rnd.choice((2, 8, 24)))).strftime(FMT)))
+    return a, wins
+
+
+@bench("res_clash_1k")
+def b_res_clash(app: InvApp, tmp: str):
+    # Comprobación de conflicto por el R*Tree; se contrasta con la definición directa sobre la tabla
+    a, wins = _res_copy(app, tmp)
+    def brute(i_id, s, e):
+        a.c.execute('''SELECT id FROM reservations NOT INDEXED
+                       WHERE i_id = ? AND status = 'active' AND start < ? AND "end" > ? ORDER BY start''', (i_id, e, s))
+        return [r[0] for r in a.c.fetchall()]
+    hits = 0
+    for _, i_id, s, e in wins[:200]:
+        got = [r["id"] for r in a.res.clash(i_id, s, e)]
+        assert got == brute(i_id, s, e), (i_id, s, e)
+        hits += bool(got)
+    assert hits, "no window hit a reservation"
+    return lambda: [a.res.clash(i_id, s, e) for _, i_id, s, e in wins]
+
+
+@bench("res_clash_scan")
+def b_res_clash_scan(app: InvApp, tmp: str):
+    # Referencia: la misma pregunta recorriendo todas las reservas (100 ventanas, no 1k)
+    a, wins = _res_copy(app, tmp)
+    def run():
+        for _, i_id, s, e in wins[:100]:
+            a.c.execute('''SELECT id FROM reservations NOT INDEXED
+                           WHERE i_id = ? AND status = 'active' AND start < ? AND "end" > ?''', (i_id, e, s))
+            a.c.fetchall()
+    return run
+
+
+@bench("res_free_1k")
+def b_res_free(app: InvApp, tmp: str):
+    # Disponibilidad de la herramienta entera por ventana; se contrasta con clash() por instancia
+    a, wins = _res_copy(app, tmp)
+    for h_id, _, s, e in wins[:100]:
+        free = {i["id"] for i in a.free_insts(h_id, s, e)}
+        a.c.execute("SELECT id FROM tool_inst WHERE h_id = ? AND status != 'retired' AND id NOT IN "
+                    "(SELECT i_id FROM loans WHERE closed IS NULL)", (h_id,))
+        want = {i for (i,) in a.c.fetchall() if not a.res.clash(i, s, e)}
+        assert free == want, (h_id, s, e)
+    return lambda: [a.free_insts(h_id, s, e) for h_id, _, s, e in wins]
+
+
+@bench("reserve_1k")
+def b_reserve(app: InvApp, tmp: str):
+    # reserve() con commit: comprobación + alta + trigger del R*Tree; se cancelan al cerrar
+    a, wins = _res_copy(app, tmp)
+    def run():
+        top = a.c.execute('SELECT MAX(id) FROM reservations').fetchone()[0]
+        ok = [a.reserve(h_id, i_id, "Bench", s, e)[0] for h_id, i_id, s, e in wins]
+        # Por id: reserve() guarda el nombre con la grafía ya registrada ("bench" si existía)
+        a.c.execute("UPDATE reservations SET status = 'cancelled' WHERE id > ?", (top,))
+        a.conn.commit()
+        assert any(ok) and not all(ok)
+    return run
+
+
+LOCS = 20
+
+
+@fixture
+def _loc_copy(app: InvApp, tmp: str) -> tuple:
+    # Copia con las insts repartidas en LOCS ubicaciones: cada herramienta entera en una, y 1 de cada 10
+    # insts en otra (ids consecutivos -> misma herramienta). Devuelve (app, id de la ubicación medida)
+    a = _copy(app, tmp, "loc")
+    ids = [a.locs.get_or_add(f"Site {k:02d}", "site") for k in range(LOCS)]
+    a.c.execute('CREATE TEMP TABLE lm (k INTEGER PRIMARY KEY, loc INTEGER)')
+    a.c.executemany('INSERT INTO temp.lm VALUES (?, ?)', enumerate(ids))
+    a.c.execute(f'''UPDATE tool_inst SET loc_id = (SELECT loc FROM temp.lm
+                    WHERE k = (tool_inst.h_id + CASE WHEN tool_inst.id % 10 = 0 THEN 1 ELSE 0 END) % {LOCS})''')
+    a.conn.commit()
+    a.mirror.load()
+    return a, ids[0]
+
+
+@bench("get_tools_loc")
+def b_get_tools_loc(app: InvApp, tmp: str):
+    # Lista de un kiosco (1/LOCS de las herramientas + consumibles) sin cache; referencia: get_tools
+    a, loc = _loc_copy(app, tmp)
+    a._cache = None
+    mine = {t.id for t in a.get_tools(loc)}
+    a.c.execute('SELECT id FROM tools WHERE is_consumable = 1 OR id IN (SELECT h_id FROM tool_inst WHERE loc_id = ?)', (loc,))
+    assert mine == {r[0] for r in a.c.fetchall()} and len(mine) < len(a.get_tools())
+    def run():
+        a._cache = None
+        a.get_tools(loc)
+    return run
+
+
+@bench("get_stats_loc")
+def b_get_stats_loc(app: InvApp, tmp: str):
+    a, loc = _loc_copy(app, tmp)
+    s, g = a.qr_mgr.get_stats(0, loc), a.qr_mgr.get_stats(0)
+    assert s["loaned"] <= g["loaned"] and s["loans_today"] <= g["loans_today"]
+    return lambda: a.qr_mgr.get_stats(0, loc)
+
+
+@bench("rollup_loc")
+def b_rollup_loc(app: InvApp, tmp: str):
+    a, loc = _loc_copy(app, tmp)
+    a._rollup_by = {}
+    r = a.get_rollup(loc=loc)
+    a.c.execute('SELECT COUNT(*) FROM tool_inst WHERE loc_id = ?', (loc,))
+    assert r["reusable"] and sum(r["insts"].values()) == a.c.fetchone()[0]
+    def run():
+        a._rollup_by = {}
+        a.get_rollup(loc=loc)
+    return run
+
+
+@bench("transfer_100")
+def b_transfer(app: InvApp, tmp: str):
+    # 100 insts disponibles de ida y vuelta entre dos ubicaciones (2 commits, 200 filas en transfers)
+    a, loc = _loc_copy(app, tmp)
+    a.c.execute("SELECT id FROM tool_inst WHERE loc_id = ? AND status = 'avail' LIMIT 100", (loc,))
+    ids = [r[0] for r in a.c.fetchall()]
+    other = a.locs.get("Site 01")
+    def run():
+        assert a.transfer(ids, other, "Bench") == (True, f"{len(ids)} moved")
+        a.transfer(ids, loc, "Bench")
+    return run
+
+
+TL_N = 2_000_000  # filas de historial añadidas (mitad loans, mitad rets)
+TL_HOT = 20_000  # préstamos + devoluciones de la inst más usada
+
+
+@fixture
+def _tl_copy(app: InvApp, tmp: str) -> tuple:
+    # Copia con TL_N filas más de historial repartidas entre todas las insts y TL_HOT en una sola
+    a = _copy(app, tmp, "tl")
+    a.c.execute('SELECT id, h_id FROM tool_inst ORDER BY id LIMIT 1')
+    hot, h_id = a.c.fetchone()
+    a.c.execute('SELECT MIN(id), MAX(id) FROM tool_inst')
+    lo, hi = a.c.fetchone()
+    a.c.execute('DROP TRIGGER IF EXISTS cdc_loans_i')  # la copia no necesita changes; cdc los rehace al abrir
+    a.c.execute('DROP TRIGGER IF EXISTS cdc_rets_i')
+    for tbl, extra, vals in (("loans", ", due, closed", ", d, d"), ("rets", ", notes", ", ''")):
+        a.c.execute(f'''
+            WITH RECURSIVE n(k) AS (SELECT 0 UNION ALL SELECT k + 1 FROM n WHERE k < ?1 - 1),
+            r AS (SELECT ?2 + k % (?3 - ?2 + 1) AS i, datetime('now', 'localtime', '-' || (k % 1000000 + 1) || ' minutes') AS d FROM n)
+            INSERT INTO {tbl} (h_id, i_id, worker, date{extra}) SELECT ti.h_id, r.i, 'Bench', d{vals} FROM r JOIN tool_inst ti ON ti.id = r.i
+        ''', (TL_N // 2, lo, hi))
+        a.c.execute(f'''
+            WITH RECURSIVE n(k) AS (SELECT 0 UNION ALL SELECT k + 1 FROM n WHERE k < ?1 - 1),
+            r AS (SELECT datetime('now', 'localtime', '-' || (k + 1) || ' hours') AS d FROM n)
+            INSERT INTO {tbl} (h_id, i_id, worker, date{extra}) SELECT ?2, ?3, 'Bench', d{vals} FROM r
+        ''', (TL_HOT // 2, h_id, hot))
+    a.conn.commit()
+    a.c.execute('SELECT id FROM tool_inst ORDER BY random() LIMIT 100')
+    return a, hot, [r[0] for r in a.c.fetchall()]
+
+
+@bench("timeline_100")
+def b_timeline_100(app: InvApp, tmp: str):
+    # Primera página de 100 insts al azar con millones de filas de historial
+    a, _, ids = _tl_copy(app, tmp)
+    return lambda: [a.timeline(i) for i in ids]
+
+
+@bench("timeline_hot_20p")
+def b_timeline_hot(app: InvApp, tmp: str):
+    # 20 páginas seguidas de la inst con TL_HOT filas; comprueba orden y que el cursor no pierde ni repite
+    a, hot, _ = _tl_copy(app, tmp)
+    a.regen_qr(*a.c.execute('SELECT tool_uuid, id, serial FROM tool_inst WHERE id = ?', (hot,)).fetchone())
+    def run():
+        cur, seen = None, []
+        for _ in range(20):
+            rows, cur = a.timeline(hot, cur)
+            seen += [(r["date"], r["id"], r["kind"]) for r in rows]
+        assert cur and len(set(seen)) == 20 * timeline.PAGE and seen == sorted(seen, reverse=True)
+        assert seen[0][2] == "edit"
+    return run
+
+
+@bench("timeline_scan")
+def b_timeline_scan(app: InvApp, tmp: str):
+    # Referencia: la misma primera página sin índices por i_id (recorre loans y rets)
+    a, hot, _ = _tl_copy(app, tmp)
+    def run():
+        a.c.execute('''
+            SELECT date, id, 'loan' FROM loans NOT INDEXED WHERE i_id = ?1
+            UNION ALL SELECT date, id, 'ret' FROM rets NOT INDEXED WHERE i_id = ?1
+            ORDER BY 1 DESC, 2 DESC LIMIT 50
+        ''', (hot,))
+        a.c.fetchall()
+    return run
+
+
+DD_N = 100_000  # herramientas en la copia de dedup
+DD_TYPES = ["Taladro percutor", "Llave de impacto", "Martillo", "Sierra circular", "Amoladora", "Multimetro",
+            "Nivel laser", "Alicate", "Destornillador", "Soldadora", "Lijadora orbital", "Atornillador"]
+DD_SIZES = ["", "18V", "12V", "13mm", "1/2\"", "500W", "115mm", "230V"]
+
+
+def _dd_name(rnd: random.Random) -> str:
+    code = "".join(rnd.choice("ABCDEFGHJKLMNPRSTVWXZ") for _ in range(rnd.randint(2, 3))) + str(rnd.randint(10, 9999))
+    return f"{rnd.choice(DD_TYPES)} {rnd.choice(BRANDS)} {code} {rnd.choice(DD_SIZES)}".strip()
+
+
+def _typo(rnd: random.Random, s: str) -> str:
+    # Una errata: letra cambiada, borrada, duplicada o mayúsculas/acentos/espacios distintos
+    k = rnd.randrange(len(s))
+    return rnd.choice((
+        lambda: s[:k] + rnd.choice("aeiourst") + s[k + 1:],
+        lambda: s[:k] + s[k + 1:],
+        lambda: s[:k] + s[k] + s[k:],
+        lambda: s.upper(),
+        lambda: s.replace("a", "á", 1).replace(" ", "  ", 1),
+    ))()
+
+
+@fixture
+def _dd_copy(app: InvApp, tmp: str) -> tuple:
+    # Copia con DD_N herramientas de nombre tipo+marca+modelo (+medida); devuelve (app, erratas, nuevos, fill_s)
+    a = _copy(app, tmp, "dd")
+    rnd = random.Random(11)
+    a.c.execute('SELECT COALESCE(MAX(id), 0) FROM tools')
+    base = a.c.fetchone()[0]
+    names = [_dd_name(rnd) for _ in range(DD_N)]
+    a.c.executemany('INSERT INTO tools (id, tool_uuid, name, resp, qty, is_consumable, status) VALUES (?, ?, ?, "bench", 0, 1, "avail")',
+                    [(base + k + 1, str(uuid.uuid4()), n) for k, n in enumerate(names)])
+    a.conn.commit()
+    t0 = time.perf_counter()
+    a.dd.fill()
+    fill_s = time.perf_counter() - t0
+    typos = [(base + k + 1, _typo(rnd, names[k])) for k in rnd.sample(range(DD_N), 500)]
+    fresh = [_dd_name(rnd) for _ in range(500)]
+    return a, typos, fresh, fill_s
+
+
+@bench("similar_1k")
+def b_similar_1k(app: InvApp, tmp: str):
+    # 500 nombres con errata de uno existente + 500 nuevos sobre DD_N herramientas; la errata debe encontrar el original
+    a, typos, fresh, fill_s = _dd_copy(app, tmp)
+    t0 = time.perf_counter()
+    a.similar(fresh[0])  # primera búsqueda: monta las listas en memoria
+    print(f"{'':<16} dedup fill {DD_N} tools: {fill_s:.2f} s, lists: {time.perf_counter() - t0:.2f} s", file=sys.stderr)
+    hit = sum(any(d["id"] == h for d in a.similar(n)) for h, n in typos)
+    assert hit >= 0.95 * len(typos), hit
+    def run():
+        for _, n in typos:
+            a.similar(n)
+        for n in fresh:
+            a.similar(n)
+    return run
+
+
+@bench("similar_scan")
+def b_similar_scan(app: InvApp, tmp: str):
+    # Referencia: 10 búsquedas comparando contra todos los nombres normalizados (sin índice)
+    a, typos, _, _ = _dd_copy(app, tmp)
+    def run():
+        for _, n in typos[:10]:
+            q = dedup.tris(dedup.norm(n))
+            out = []
+            for h_id, nm, norm in a.c.execute('SELECT h_id, name, norm FROM tool_norm'):
+                b = dedup.tris(norm)
+                k = len(q & b)
+                if k / (len(q) + len(b) - k) >= dedup.SIM:
+                    out.append(h_id)
+    return run
+
+
+@bench("merge_100")
+def b_merge_100(app: InvApp, tmp: str):
+    # 100 fusiones de 2 herramientas con 5 insts, QR, préstamo y devolución por inst
+    def run():
+        ids = _mk_tools(app, 200)
+        t0 = time.perf_counter()
+        for k in range(0, 200, 2):
+            assert app.merge_tools(ids[k], [ids[k + 1]])[0]
+        el = time.perf_counter() - t0
+        app.c.execute('SELECT COUNT(*), SUM(qty) FROM tools WHERE id IN (SELECT value FROM json_each(?))', (json.dumps(ids),))
+        assert app.c.fetchone() == (100, 1000)
+        app.c.execute('SELECT COUNT(*) FROM loans WHERE h_id IN (SELECT value FROM json_each(?))', (json.dumps(ids[::2]),))
+        assert app.c.fetchone()[0] == 1000
+        app.bulk_del(ids[::2])
+        return el
+    return run
+
+
+@bench("workers_link")
+def b_workers_link(app: InvApp, tmp: str):
+    # Migración de texto libre: copia sin w_id ni workers, con grafías variadas del mismo nombre
+    a = _copy(app, tmp, "wk")
+    def run():
+        a.c.execute('UPDATE loans SET w_id = NULL, worker = CASE id % 3 WHEN 0 THEN upper(worker) '
+                    'WHEN 1 THEN "  " || worker ELSE worker END')
+        a.c.execute('UPDATE rets SET w_id = NULL')
+        a.c.execute('DELETE FROM workers')
+        a.conn.commit()
+        t0 = time.perf_counter()
+        res = a.wk.link()
+        el = time.perf_counter() - t0
+        names = {workers.norm(w) for (w,) in a.c.execute('SELECT worker FROM loans UNION SELECT worker FROM rets')} - {""}
+        a.c.execute('SELECT COUNT(*) FROM workers')
+        assert a.c.fetchone()[0] == len(names) and res["loans"] == a.c.execute('SELECT COUNT(*) FROM loans').fetchone()[0]
+        return el
+    run.close = a.conn.close
+    return run
+
+
+@bench("get_tool_1k")
+def b_get_tool_1k(app: InvApp, tmp: str):
+    return _pt_tool(app, False)
+
+
+@bench("get_tool_1k_disk")
+def b_get_tool_1k_disk(app: InvApp, tmp: str):
+    return _pt_tool(app, True)
+
+
+@bench("get_inst_1k")
+def b_get_inst_1k(app: InvApp, tmp: str):
+    return _pt_inst(app, False)
+
+
+@bench("get_inst_1k_disk")
+def b_get_inst_1k_disk(app: InvApp, tmp: str):
+    return _pt_inst(app, True)
+
+
+@bench("read_qr_disk")
+def b_read_qr_disk(app: InvApp, tmp: str):
+    return _disk(app, b_read_qr(app, tmp))
+
+
+@bench("mirror_load")
+def b_mirror_load(app: InvApp, tmp: str):
+    # Carga en frío + comprobación: espejo == disco, también tras escrituras y con presupuesto corto
+    def check():
+        _, i_ids = _pt_ids(app, 200)
+        for i_id in i_ids:
+            i = app.mirror.inst(i_id)
+            assert i == app._get_inst(i_id) and app.mirror.tool(i.h_id) == app._get_tool(i.h_id)
+            assert app.mirror.inst_by_serial(i.serial) is i and app.mirror.inst_by_qr(i.qr_uuid) is i
+        m = app.mirror
+        assert all(m.tool_by_uuid(m.tool(h).tool_uuid) is m.tool(h) for h in list(m.by_h)[:200])
+    assert app.mirror.load()
+    check()
+    ids = _mk_tools(app, 50)
+    app.bulk_upd(ids[:25], status="maint", resp="bench")
+    app.bulk_del(ids[25:])
+    app.c.execute('SELECT tool_uuid, id, serial FROM tool_inst WHERE h_id = ? LIMIT 1', (ids[0],))
+    app.regen_qr(*app.c.fetchone())
+    check()
+    assert app.get_insts(ids[0]) == app.mirror.insts_of(ids[0]) and not app.mirror.insts_of(ids[-1])
+    assert app.get_tool(ids[0]).status == "maint" and app.get_tool(ids[-1]) is None
+    st = app.mirror.stats()
+    app.mirror.budget = 1 << 10
+    assert not app.mirror.load() and app.get_tool(ids[0]).resp == "bench"
+    app.mirror.budget = st["budget_mb"] << 20
+    print(f"{'':<16} mirror {st}")
+    return app.mirror.load
+
+
+@bench("gen_qr")
+def b_gen_qr(app: InvApp, tmp: str):
+    app.c.execute('SELECT tool_uuid, id FROM tool_inst ORDER BY id DESC LIMIT 20')
+    rows = app.c.fetchall()
+    def run():
+        for tool_uuid, i_id in rows:
+            app.c.execute('SELECT qr_uuid FROM tool_inst WHERE id = ?', (i_id,))
+            app.qr_mgr.pack.drop(app.c.fetchone()[0])
+            app.qr_mgr._png_cache.clear()
+            app.qr_mgr._mat_cache.clear()
+            app.qr_mgr.gen_qr(tool_uuid, i_id, "bench")
+    return run
+
+
+@bench("qr_pack_get")
+def b_qr_pack_get(app: InvApp, tmp: str):
+    datas = _qr_datas(app)
+    for d in datas:
+        app.qr_mgr.gen_qr(d.tool_uuid, d.i_id, d.name)
+    return lambda: [app.qr_mgr.pack.get(d.uuid) for d in datas]
+
+
+@bench("qr_file_get")
+def b_qr_file_get(app: InvApp, tmp: str):
+    # Referencia: un PNG por instancia con os.path.exists + open, como antes
+    paths = []
+    for d in _qr_datas(app):
+        path = os.path.join(tmp, f"qr_{d.tool_uuid}_{d.i_id}_{d.uuid}.png")
+        with open(path, "wb") as f:
+            f.write(app.qr_mgr.qr_png(d.uuid, cache=False))
+        paths.append(path)
+    def run():
+        for path in paths:
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    f.read()
+    return run
+
+
+def _qr_datas(app: InvApp, k: int = 200) -> List[QRData]:
+    app.c.execute('SELECT tool_uuid, id, qr_uuid FROM tool_inst ORDER BY id LIMIT ?', (k,))
+    return [QRData(tool_uuid=r[0], i_id=r[1], name=f"Taladro Bosch {r[1]}", uuid=r[2]) for r in app.c.fetchall()]
+
+
+@bench("qr_encode")
+def b_qr_encode(app: InvApp, tmp: str):
+    datas = _qr_datas(app)
+    return lambda: [d.to_payload(app.qr_mgr.key) for d in datas]
+
+
+@bench("qr_encode_json")
+def b_qr_encode_json(app: InvApp, tmp: str):
+    datas = _qr_datas(app)
+    return lambda: [d.to_json() for d in datas]
+
+
+@bench("qr_decode")
+def b_qr_decode(app: InvApp, tmp: str):
+    payloads = [d.to_payload(app.qr_mgr.key) for d in _qr_datas(app)]
+    return lambda: [app.qr_mgr.decode(p) for p in payloads]
+
+
+@bench("qr_decode_json")
+def b_qr_decode_json(app: InvApp, tmp: str):
+    payloads = [d.to_json() for d in _qr_datas(app)]
+    return lambda: [app.qr_mgr.decode(p) for p in payloads]
+
+
+def _render(payloads: List[str], ec: int):
+    for p in payloads:
+        qr = qrcode.QRCode(version=None, error_correction=ec, box_size=10, border=4)
+        qr.add_data(p)
+        qr.make(fit=True)
+        qr.make_image(fill_color="black", back_color="white")
+
+
+@bench("qr_render")
+def b_qr_render(app: InvApp, tmp: str):
+    payloads = [d.to_payload(app.qr_mgr.key) for d in _qr_datas(app, 20)]
+    return lambda: _render(payloads, app.qr_mgr.ec)
+
+
+@bench("qr_render_json")
+def b_qr_render_json(app: InvApp, tmp: str):
+    payloads = [d.to_json() for d in _qr_datas(app, 20)]
+    return lambda: _render(payloads, app.qr_mgr.ec)
+
+
+@bench("qr_thumb_pil")
+def b_qr_thumb_pil(app: InvApp, tmp: str):
+    # Ruta anterior de show_tool: PIL a box_size=10, PNG, base64
+    import base64
+    import io
+    payloads = [d.to_payload(app.qr_mgr.key) for d in _qr_datas(app, 20)]
+    def run():
+        for p in payloads:
+            qr = qrcode.QRCode(version=None, error_correction=app.qr_mgr.ec, box_size=10, border=4)
+            qr.add_data(p)
+            qr.make(fit=True)
+            buf = io.BytesIO()
+            qr.make_image(fill_color="black", back_color="white").save(buf)
+            base64.b64encode(buf.getvalue())
+    return run
+
+
+@bench("qr_thumb")
+def b_qr_thumb(app: InvApp, tmp: str):
+    uuids = [d.uuid for d in _qr_datas(app, 20)]
+    def run():
+        app.qr_mgr._png_cache.clear()
+        app.qr_mgr._mat_cache.clear()
+        for u in uuids:
+            app.qr_mgr.qr_b64(u, 160)
+    return run
+
+
+@bench("qr_thumb_resize")
+def b_qr_thumb_resize(app: InvApp, tmp: str):
+    # Matriz ya codificada, nuevo tamaño: solo raster NumPy + PNG
+    uuids = [d.uuid for d in _qr_datas(app, 20)]
+    for u in uuids:
+        app.qr_mgr.matrix(u)
+    def run():
+        app.qr_mgr._png_cache.clear()
+        for u in uuids:
+            app.qr_mgr.qr_b64(u, 240)
+    return run
+
+
+@bench("qr_thumb_cached")
+def b_qr_thumb_cached(app: InvApp, tmp: str):
+    uuids = [d.uuid for d in _qr_datas(app, 20)]
+    return lambda: [app.qr_mgr.qr_b64(u, 160) for u in uuids]
+
+
+@bench("exp_qrs")
+def b_exp_qrs(app: InvApp, tmp: str):
+    zip_path = os.path.join(tmp, "qrs.zip")
+    def run():
+        app._cache = None
+        app.exp_qrs(zip_path)
+    return run
+
+
+@bench("loan_ret")
+def b_loan_ret(app: InvApp, tmp: str):
+    from inv2log import RetData
+    app.c.execute('SELECT h_id, id FROM tool_inst WHERE status = "avail" ORDER BY id LIMIT 50')
+    rows = app.c.fetchall()
+    def run():
+        for h_id, i_id in rows:
+            app.reg_loan(h_id, i_id, "bench")
+            app.qr_mgr.reg_ret(RetData(h_id=h_id, i_id=i_id, worker="bench"))
+    return run
+
+
+@bench("add_upd_del")
+def b_add_upd_del(app: InvApp, tmp: str):
+    def run():
+        app.add_tool("Bench tool", "bench", 5, False)
+        app.c.execute('SELECT MAX(id) FROM tools')
+        h_id = app.c.fetchone()[0]
+        app.upd_tool(h_id, "Bench tool", "bench", 8, False)
+        app.upd_tool(h_id, "Bench tool", "bench", 2, False)
+        app.del_tool(h_id)
+    return run
+
+
+@bench("resize_10k")
+def b_resize_10k(app: InvApp, tmp: str):
+    # Crece 0 -> 10k, presta las 10 últimas, reduce a 5k, luego a 10 y borra (comprobación: tests/test_resize.py)
+    def run():
+        ok, _ = app.add_tool("Bench resize", "bench", 0, False)
+        app.c.execute('SELECT MAX(id) FROM tools')
+        h_id = app.c.fetchone()[0]
+        app.upd_tool(h_id, "Bench resize", "bench", 10000, False)
+        app.c.execute('SELECT id FROM tool_inst WHERE h_id = ? ORDER BY ord DESC LIMIT 10', (h_id,))
+        for i_id in [r[0] for r in app.c.fetchall()]:
+            app.reg_loan(h_id, i_id, "bench")
+        app.upd_tool(h_id, "Bench resize", "bench", 5000, False)
+        app.upd_tool(h_id, "Bench resize", "bench", 5, False)  # rechazada: 10 prestadas
+        app.upd_tool(h_id, "Bench resize", "bench", 10, False)
+        app.del_tool(h_id)
+    return run
+
+
+def _mk_tools(app: InvApp, n: int, insts: int = 5) -> List[int]:
+    # n herramientas reutilizables con insts, QR registrado, un préstamo y una devolución por inst
+    c = app.conn.cursor()
+    c.execute('SELECT COALESCE(MAX(id), 0) FROM tools')
+    base = c.fetchone()[0]
+    ids = list(range(base + 1, base + n + 1))
+    now = dt.datetime.now().strftime(FMT)
+    c.executemany('INSERT INTO tools (id, tool_uuid, name, resp, qty, is_consumable, img, status) VALUES (?, ?, ?, ?, ?, 0, NULL, "avail")',
+                  [(h_id, str(uuid.uuid4()), f"Bench bulk {h_id}", "bench", insts) for h_id in ids])
+    c.execute('''
+        WITH RECURSIVE o(v) AS (SELECT 1 UNION ALL SELECT v + 1 FROM o WHERE v < ?)
+        INSERT INTO tool_inst (h_id, tool_uuid, serial, status, qr_uuid, img, ord)
+        SELECT t.id, t.tool_uuid, t.tool_uuid || '-' || printf('%03d', o.v), 'avail', lower(hex(randomblob(16))), NULL, o.v
+        FROM tools t, o WHERE t.id > ?
+    ''', (insts, base))
+    c.execute('INSERT INTO h_qr (tool_uuid, i_id, qr_uuid, date) SELECT tool_uuid, id, qr_uuid, ? FROM tool_inst WHERE h_id > ?', (now, base))
+    for tbl in ("loans", "rets"):
+        c.execute(f'INSERT INTO {tbl} (h_id, i_id, worker, date) SELECT h_id, id, "bench", ? FROM tool_inst WHERE h_id > ?', (now, base))
+    app.conn.commit()
+    app._cache = None
+    app.mirror.sync()  # escritura directa, sin _pub: el espejo se pone al día fuera de lo medido
+    return ids
+
+
+def _orphans(app: InvApp) -> int:
+    app.c.execute('''
+        SELECT (SELECT COUNT(*) FROM tool_inst WHERE h_id NOT IN (SELECT id FROM tools))
+             + (SELECT COUNT(*) FROM loans WHERE i_id NOT IN (SELECT id FROM tool_inst))
+             + (SELECT COUNT(*) FROM rets WHERE i_id NOT IN (SELECT id FROM tool_inst))
+             + (SELECT COUNT(*) FROM h_qr WHERE i_id NOT IN (SELECT id FROM tool_inst))
+    ''')
+    return app.c.fetchone()[0]
+
+
+@bench("del_1k_loop")
+def b_del_1k_loop(app: InvApp, tmp: str):
+    # Referencia: un del_tool (SELECT + DELETE + commit) por herramienta, como el bulk_action anterior
+    def run():
+        ids = _mk_tools(app, 1000)
+        t0 = time.perf_counter()
+        for h_id in ids:
+            app.del_tool(h_id)
+        el = time.perf_counter() - t0
+        assert _orphans(app) == 0
+        return el
+    return run
+
+
+@bench("bulk_del_1k")
+def b_bulk_del_1k(app: InvApp, tmp: str):
+    def run():
+        ids = _mk_tools(app, 1000)
+        t0 = time.perf_counter()
+        assert app.bulk_del(ids)[0]
+        el = time.perf_counter() - t0
+        assert _orphans(app) == 0
+        return el
+    return run
+
+
+@bench("bulk_upd_1k")
+def b_bulk_upd_1k(app: InvApp, tmp: str):
+    # Cambia resp y pasa a consumible (retira las 5k insts) en una transacción
+    def run():
+        ids = _mk_tools(app, 1000)
+        t0 = time.perf_counter()
+        assert app.bulk_upd(ids, resp="bench2", is_consumable=True)[0]
+        el = time.perf_counter() - t0
+        app.c.execute('SELECT COUNT(*) FROM tool_inst WHERE h_id >= ?', (ids[0],))
+        assert app.c.fetchone()[0] == 0
+        app.bulk_del(ids)
+        return el
+    return run
+
+
+@bench("feed_50")
+def b_feed_50(app: InvApp, tmp: str):
+    # 50 sesiones suscritas: 50 préstamos+devoluciones hasta que todas reciben el último delta
+    from inv2log import RetData
+    app.c.execute('SELECT h_id, id FROM tool_inst WHERE status = "avail" ORDER BY id LIMIT 50')
+    rows = app.c.fetchall()
+    seen = [dict() for _ in range(50)]
+    done = threading.Event()
+    last = rows[-1][1]
+    def sub(k):
+        def fn(d):
+            seen[k].update(d.insts)
+            i = seen[k].get(last)
+            if i is not None and i.status == "avail" and all(s.get(last) is i for s in seen):
+                done.set()
+        return fn
+    toks = [app.feed.subscribe(sub(k)) for k in range(50)]
+    def run():
+        done.clear()
+        for s in seen:
+            s.clear()
+        for h_id, i_id in rows:
+            app.reg_loan(h_id, i_id, "bench")
+            app.qr_mgr.reg_ret(RetData(h_id=h_id, i_id=i_id, worker="bench"))
+        assert done.wait(10), "feed delivery timeout"
+        assert all(s[i_id].status == "avail" for s in seen for _, i_id in rows)
+    run.close = lambda: [app.feed.unsubscribe(t) for t in toks]
+    return run
+
+
+@dataclass
+class _DictTool:
+    # Réplica de las filas anteriores (dataclass con __dict__) como referencia de memoria
+    id: int
+    tool_uuid: str
+    name: str
+    resp: str
+    qty: int
+    is_consumable: bool
+    img: Optional[str] = None
+    status: str = "avail"
+
+
+@dataclass
+class _DictInst:
+    id: int
+    h_id: int
+    tool_uuid: str
+    serial: str
+    status: str
+    qr_uuid: str
+    img: Optional[str] = None
+
+
+TOOL_SQL = 'SELECT id, tool_uuid, name, resp, qty, is_consumable, img, status FROM tools ORDER BY name'
+INST_SQL = 'SELECT id, h_id, tool_uuid, serial, status, qr_uuid, img FROM tool_inst'
+
+
+@bench("mem_tools_rows", kind="mem")
+def b_mem_tools_rows(app: InvApp, tmp: str):
+    def run():
+        app.c.execute(TOOL_SQL)
+        return [_DictTool(r[0], r[1], r[2], r[3], r[4], bool(r[5]), r[6], r[7]) for r in app.c]
+    return run
+
+
+@bench("mem_tools_slots", kind="mem")
+def b_mem_tools_slots(app: InvApp, tmp: str):
+    def run():
+        app.c.execute(TOOL_SQL)
+        return [Tool(r[0], r[1], r[2], r[3], r[4], bool(r[5]), r[6], r[7]) for r in app.c]
+    return run
+
+
+@bench("mem_tools_table", kind="mem")
+def b_mem_tools_table(app: InvApp, tmp: str):
+    def run():
+        app._cache = None
+        return app.get_tools()
+    return run
+
+
+@bench("mem_insts_rows", kind="mem")
+def b_mem_insts_rows(app: InvApp, tmp: str):
+    def run():
+        app.c.execute(INST_SQL)
+        return [_DictInst(*r) for r in app.c]
+    return run
+
+
+@bench("mem_insts_slots", kind="mem")
+def b_mem_insts_slots(app: InvApp, tmp: str):
+    def run():
+        app.c.execute(INST_SQL)
+        return [ToolInst(*r) for r in app.c]
+    return run
+
+
+@bench("mem_insts_table", kind="mem")
+def b_mem_insts_table(app: InvApp, tmp: str):
+    return app.get_all_insts
+
+
+def run_benches(db: str, names: Optional[List[str]] = None, repeat: int = 5) -> Dict[str, Any]:
+    work = os.path.dirname(os.path.abspath(db))
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        # Con el espejo que carga la UI (get_app): es lo que se mide
+        app = _open(work, os.path.basename(db))
+        for name in names or list(BENCHES):
+            run = BENCHES[name](app, tmp)
+            if KINDS[name] == "mem":
+                results[name] = _memit(run)
+                print(f"{name:<16} retained {results[name]['bytes'] / 2**20:8.2f} MiB", file=sys.stderr)
+                continue
+            run()  # calentamiento
+            results[name] = _timeit(run, repeat)
+            if hasattr(run, "close"):
+                run.close()
+            print(f"{name:<16} median {results[name]['median'] * 1000:10.2f} ms", file=sys.stderr)
+        app.conn.close()
+    return results
+
+
+# Variantes de las consultas con huecos de formato en SQL
+VARIANTS = {
+    "hist": {"hist": {"src": "rets"}, "hist_all": {"src": "rets_all"}},
+    "bulk_upd": {"bulk_upd": {"sets": "resp = ?"}},
+    **{k: {k: {"loans": "loans", "rets": "rets"}, k + "_all": {"loans": "loans_all", "rets": "rets_all"}}
+       for k in ("tl_keys", "tl_loan", "tl_ret")},
+}
+
+
+def _plan_args(app: InvApp) -> Dict[str, tuple]:
+    # Parámetros reales por consulta (el plan no depende de ellos, la medida sí)
+    c = app.conn.cursor()
+    h_id, tool_uuid = c.execute('SELECT id, tool_uuid FROM tools WHERE is_consumable = 0 ORDER BY id LIMIT 1').fetchone()
+    i_id, qr_uuid = c.execute('SELECT id, qr_uuid FROM tool_inst WHERE h_id = ? ORDER BY ord LIMIT 1', (h_id,)).fetchone()
+    cons = c.execute('SELECT id FROM tools WHERE is_consumable = 1 ORDER BY id LIMIT 1').fetchone()[0]
+    ids_j, i_j = json.dumps(list(range(h_id, h_id + 50))), json.dumps([i_id])
+    today, now, new = dt.date.today().strftime("%Y-%m-%d"), dt.datetime.now().strftime(FMT), str(uuid.uuid4())
+    w_id = c.execute('SELECT w_id FROM loans WHERE w_id IS NOT NULL LIMIT 1').fetchone()[0]
+    loc = app.locs.main
+    return {
+        "qr_key": (), "qr_key_add": ("00",), "inst_qr": (i_id,),
+        "hqr_get": (tool_uuid, i_id), "hqr_add": (tool_uuid, i_id, new, now, None), "hqr_upd": (new, tool_uuid, i_id),
+        "hqr_del": (tool_uuid, i_id), "hqr_queue": (now, h_id, 0), "qr_q_add": (h_id, 0), "qr_q_next": (50,),
+        "qr_q_del": (i_id,), "qr_q_gc": (), "hqr_missing": (now,), "qr_q_missing": (), "read_qr": (qr_uuid,), "read_qr_json": (tool_uuid, i_id),
+        "ret_add": (h_id, i_id, "bench", w_id, now, ""), "ret_inst": (i_id, h_id), "ret_close": (now, i_id), "ret_od": (i_id,),
+        "stats_loaned": (), "stats_loans": (today,), "stats_rets": (today,), "stats_pop": (),
+        "tool_add": (new, "Bench", "bench", 1, 0, None, "avail"), "consume": (1, cons, 1), "consume_chk": (cons,),
+        "consume_add": (cons, 1, 0, "bench", now), "low_stock": (100,), "reorder": (h_id,),
+        "consumes_tool": (cons, 200), "consumes": (200,), "tools": (), "tool": (h_id,), "inst": (i_id,),
+        "insts": (h_id,), "find_insts": (h_id, "avail", tool_uuid + "-1", tool_uuid + "-2", loc, loc, 20),
+        "find_insts_any": (tool_uuid + "-1", tool_uuid + "-2", h_id, loc, loc, 20), "find_insts_ord": (h_id, "avail", 100, 200, loc, loc, 20),
+        "find_insts_ord_any": (h_id, 100, 200, loc, loc, 20), "inst_top": (h_id,), "all_insts": (), "tool_upd": ("Bench", "bench", 1, 0, None, None, h_id), "resize_n": (h_id,),
+        "resize_add": (h_id, tool_uuid, new, "avail", new, None, 999, loc), "resize_pick": (h_id, 1),
+        "resize_del_qr": (i_j,), "resize_del": (i_j,), "tool_del_get": (h_id,), "tool_del": (h_id,),
+        "bulk_imgs": (ids_j,), "bulk_del": (ids_j,), "bulk_flip": (ids_j, 1), "bulk_upd": ("bench", ids_j),
+        "regen_inst": (new, i_id), "loan_hrs": (OVERDUE_HRS, h_id), "loan_add": (h_id, i_id, "bench", w_id, now, now),
+        "loan_inst": (i_id, h_id), "policy_set": (48, h_id), "policy_due": (48, h_id), "policy": (h_id,),
+        "hist": (200,), "hist_all": (200,), "rollup_tools": (), "rollup_insts": (), "csv_counts": (),
+        "w_get": ("worker 001",), "w_add": ("Bench", "bench " + new), "w_find": ("w", "x", 20),
+        "w_loans": (w_id,), "w_hist": (w_id, 50), "w_unlinked": (),
+        "res_add": (h_id, i_id, "bench", w_id, now, now, ""), "res_cancel": (0,), "res_loaned": (i_id,), "res_inst": (i_id, h_id),
+        "res_clash": (i_id, 0, 1, now, now), "res_free": (h_id, 0, 1, now, now), "res_tool": (h_id, now, 100),
+        "stats_loaned_loc": (loc,), "stats_loans_loc": (today, loc), "stats_rets_loc": (today, loc), "stats_pop_loc": (loc,),
+        "tools_loc": (loc,), "insts_at": (loc, h_id), "insts_at_loc": (loc,), "insts_loc": (loc, h_id), "xfer_loaned": (i_j,),
+        "rollup_tools_loc": (loc,), "rollup_insts_loc": (loc,),
+        "loc_add": ("Bench " + new, "van"), "loc_get": ("Main",), "loc_all": (), "loc_insts": (i_j,),
+        "loc_move": (loc, i_j, loc), "xfer_add": (i_id, loc, loc, "bench", now, ""), "xfers_inst": (i_id, 50),
+        "xfers_loc": (loc, 100),
+        "tl_keys": (i_id, *timeline.TOP, timeline.PAGE), "tl_loan": (i_j,), "tl_ret": (i_j,), "tl_keys_all": (i_id, *timeline.TOP, timeline.PAGE),
+        "tl_loan_all": (i_j,), "tl_ret_all": (i_j,), "tl_edit": (i_j,),
+        "tl_move": (i_j,),
+        "merge_get": (ids_j,), "merge_qr": (new, tool_uuid), "merge_insts": (h_id, tool_uuid, 0, None, h_id),
+        "merge_cons": (cons, cons), "merge_dst": (0, None, h_id),
+        "dd_stale": (), "dd_get": (h_id,), "dd_put": dedup._row(h_id, "Bench"), "dd_all": (), "dd_rows": (ids_j,),
+    }
+
+
+def _bad_plan(name: str, lines: List[str]) -> List[str]:
+    ok = {**PLAN_OK, **workers.PLAN_OK, **reservations.PLAN_OK, **locations.PLAN_OK, **timeline.PLAN_OK, **dedup.PLAN_OK}.get(name, ())
+    return [l for l in lines
+            if ((l.startswith("SCAN ") and "VIRTUAL TABLE" not in l and l != "SCAN CONSTANT ROW") or "TEMP B-TREE" in l)
+            and not any(fnmatch.fnmatchcase(l, o) for o in ok)]
+
+
+def check_plans(db: str, repeat: int = 5) -> List[Dict[str, Any]]:
+    # EXPLAIN QUERY PLAN + tiempo de cada consulta registrada; las escrituras se deshacen (SAVEPOINT)
+    work = os.path.dirname(os.path.abspath(db))
+    app = _open(work, os.path.basename(db), mirror_mb=0)
+    args = _plan_args(app)
+    c = app.conn.cursor()
+    rows = []
+    for base, sql in {**SQL, **workers.SQL, **reservations.SQL, **locations.SQL, **timeline.SQL, **dedup.SQL}.items():
+        for name, fmt in VARIANTS.get(base, {base: None}).items():
+            q = sql.format(**fmt) if fmt else sql
+            if name not in args:
+                raise KeyError(f"no bench args for SQL[{name!r}]")
+            lines = [r[3] for r in c.execute('EXPLAIN QUERY PLAN ' + q, args[name]).fetchall()]
+            times, err = [], None
+            for _ in range(repeat):
+                c.execute('SAVEPOINT plan')
+                try:
+                    t0 = time.perf_counter()
+                    c.execute(q, args[name]).fetchall()
+                    times.append(time.perf_counter() - t0)
+                except sqlite3.Error as e:
+                    err = str(e)
+                    break
+                finally:
+                    c.execute('ROLLBACK TO plan')
+                    c.execute('RELEASE plan')
+            rows.append({"name": name, "plan": lines, "bad": _bad_plan(name, lines),
+                         "median": statistics.median(times) if times else None, "err": err})
+    app.conn.close()
+    return rows
+
+
+def _meta(db: str, extra: Dict[str, Any]) -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "commit": commit,
+        "ts": dt.datetime.now().strftime(FMT),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "machine": platform.machine(),
+        "db": os.path.basename(db),
+        **extra,
+    }
+
+
+def compare(base: Dict[str, Any], new: Dict[str, Any], threshold: float = 0.2) -> List[Dict[str, Any]]:
+    rows = []
+    for name, b in base["results"].items():
+        n = new["results"].get(name)
+        if not n:
+            continue
+        key = "median" if "median" in b else "bytes"
+        ratio = n[key] / b[key] if b[key] else float("inf")
+        rows.append({"name": name, "key": key, "base": b[key], "new": n[key], "ratio": ratio,
+                     "regressed": ratio > 1 + threshold})
+    return rows
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    p = argparse.ArgumentParser(description="Inv benchmarks")
+    sp = p.add_subparsers(dest="cmd", required=True)
+    g = sp.add_parser("gen", help="generate a synthetic inv.db")
+    g.add_argument("db")
+    g.add_argument("--scale", choices=SCALES, default="small")
+    g.add_argument("--tools", type=int)
+    g.add_argument("--insts", type=int, help="mean instances per reusable tool")
+    g.add_argument("--years", type=float)
+    g.add_argument("--loans-day", type=int)
+    g.add_argument("--seed", type=int, default=42)
+    r = sp.add_parser("run", help="time InvApp/QRMgr operations")
+    r.add_argument("--db", help="existing db (default: generate one from --scale)")
+    r.add_argument("--scale", choices=SCALES, default="small")
+    r.add_argument("--only", nargs="*", choices=BENCHES)
+    r.add_argument("--repeat", type=int, default=5)
+    r.add_argument("--out", default="bench.json")
+    r.add_argument("--seed", type=int, default=42)
+    pl = sp.add_parser("plans", help="EXPLAIN QUERY PLAN and timing for every registered SQL")
+    pl.add_argument("--db", help="existing db (default: generate one from --scale)")
+    pl.add_argument("--scale", choices=SCALES, default="medium")
+    pl.add_argument("--repeat", type=int, default=5)
+    pl.add_argument("--seed", type=int, default=42)
+    pl.add_argument("-v", "--verbose", action="store_true", help="print every plan")
+    cm = sp.add_parser("cmp", help="regression report between two result files")
+    cm.add_argument("base")
+    cm.add_argument("new")
+    cm.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown ratio (0.2 = +20%%)")
+    a = p.parse_args(argv)
+
+    if a.cmd == "gen":
+        if os.path.exists(a.db):
+            p.error(f"{a.db} exists")
+        params = dict(SCALES[a.scale])
+        for k in params:
+            v = getattr(a, k)
+            if v is not None:
+                params[k] = v
+        print(json.dumps(gen_db(a.db, seed=a.seed, **params)))
+        return 0
+
+    if a.cmd == "run":
+        with tempfile.TemporaryDirectory() as work:
+            gen = None
+            if a.db:
+                db = _work_copy(a.db, work)
+            else:
+                db = os.path.join(work, "inv.db")
+                gen = gen_db(db, seed=a.seed, **SCALES[a.scale])
+            res = {"meta": _meta(a.db or db, {"scale": None if a.db else a.scale, "gen": gen, "repeat": a.repeat}),
+                   "results": run_benches(db, a.only, a.repeat)}
+        with open(a.out, "w", encoding="utf-8") as f:
+            json.dump(res, f, indent=2)
+        print(f"results: {a.out}", file=sys.stderr)
+        return 0
+
+    if a.cmd == "plans":
+        with tempfile.TemporaryDirectory() as work:
+            if a.db:
+                db = _work_copy(a.db, work)
+            else:
+                db = os.path.join(work, "inv.db")
+                print(json.dumps(gen_db(db, seed=a.seed, **SCALES[a.scale])), file=sys.stderr)
+            rows = check_plans(db, a.repeat)
+        for row in rows:
+            t = f"{row['median'] * 1000:10.3f} ms" if row["median"] is not None else f"{'-':>10}   "
+            flag = "  FULL SCAN: " + "; ".join(row["bad"]) if row["bad"] else ""
+            print(f"{row['name']:<16}{t}{flag}" + (f"  ({row['err']})" if row["err"] else ""))
+            if a.verbose:
+                for l in row["plan"]:
+                    print(f"{'':<20}{l}")
+        bad = [row["name"] for row in rows if row["bad"]]
+        if bad:
+            print(f"{len(bad)} query plan regression(s): {', '.join(bad)}")
+            return 1
+        return 0
+
+    with open(a.base, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(a.new, encoding="utf-8") as f:
+        new = json.load(f)
+    rows = compare(base, new, a.threshold)
+    print(f"{'bench':<18}{'base':>15}{'new':>15}{'ratio':>8}")
+    for row in rows:
+        flag = "  REGRESSION" if row["regressed"] else ""
+        scale, unit = (1000, "ms") if row["key"] == "median" else (2 ** -20, "MiB")
+        print(f"{row['name']:<18}{row['base'] * scale:11.2f} {unit:<3}{row['new'] * scale:11.2f} {unit:<3}{row['ratio']:8.2f}{flag}")
+    bad = [row["name"] for row in rows if row["regressed"]]
+    if bad:
+        print(f"{len(bad)} regression(s) over {a.threshold:.0%}: {', '.join(bad)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+import json
+import sqlite3
+import threading
+import logging
+from typing import Optional, List, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+# Registro de cambios (CDC) append-only. Lo escriben triggers, así cada fila de
+# `changes` entra en la misma transacción que la mutación que la produce, venga de
+# InvApp, QRMgr, un borrado en cascada o un UPDATE masivo. seq es AUTOINCREMENT:
+# crece siempre y no se reutiliza aunque se poden filas.
+#
+# Los QR reemitidos se ven en el UPDATE de tool_inst (qr_uuid); h_qr no se registra.
+# loans/rets/consumes son historial: solo se registran altas y cambios (en rets, el h_id
+# que mueve una fusión). Salen de main por la cascada del borrado de su herramienta (ya
+# registrado) o por el archivo anual.
+
+OPS = {
+    "tools": "IUD",
+    "tool_inst": "IUD",
+    "loans": "IU",
+    "rets": "IU",
+    "consumes": "I",
+}
+
+
+class ChangeLog:
+    def __init__(self, conn: sqlite3.Connection, lock: Optional[threading.RLock] = None):
+        self.conn, self.c = conn, conn.cursor()
+        self.lock = lock or threading.RLock()
+        self._init_db()
+
+    def _init_db(self):
+        with self.lock:
+            self.c.executescript('''
+            CREATE TABLE IF NOT EXISTS changes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                tbl TEXT,
+                op TEXT,
+                row_id INTEGER,
+                data TEXT,  -- fila tras el cambio (la borrada en D) como JSON
+                ts TEXT DEFAULT (datetime('now', 'localtime'))
+            );
+            ''')
+            # Se rehacen en cada arranque: recogen las columnas añadidas por migraciones
+            for tbl, ops in OPS.items():
+                cols = [r[1] for r in self.c.execute(f'PRAGMA table_info({tbl})').fetchall()]
+                row = lambda ref: "json_object(" + ", ".join(f"'{c}', {ref}.{c}" for c in cols) + ")"
+                for op, ev, ref in (("I", "INSERT", "NEW"), ("U", "UPDATE", "NEW"), ("D", "DELETE", "OLD")):
+                    self.c.execute(f'DROP TRIGGER IF EXISTS cdc_{tbl}_{op.lower()}')
+                    if op in ops:
+                        self.c.execute(f'''
+                            CREATE TRIGGER cdc_{tbl}_{op.lower()} AFTER {ev} ON {tbl} BEGIN
+                                INSERT INTO changes (tbl, op, row_id, data) VALUES ('{tbl}', '{op}', {ref}.id, {row(ref)});
+                            END
+                        ''')
+            self.conn.commit()
+
+    def head(self) -> int:
+        with self.lock:
+            self.c.execute('SELECT COALESCE(MAX(seq), 0) FROM changes')
+            return self.c.fetchone()[0]
+
+    def since(self, seq: int, limit: int = 1000, tbls: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        # Cambios con seq > `seq`, en orden; el consumidor guarda el último seq que aplicó
+        q, args = 'SELECT seq, tbl, op, row_id, data, ts FROM changes WHERE seq > ?', [seq]
+        if tbls:
+            q += f' AND tbl IN ({",".join("?" * len(tbls))})'
+            args += tbls
+        with self.lock:
+            self.c.execute(q + ' ORDER BY seq LIMIT ?', (*args, limit))
+            rows = self.c.fetchall()
+        return [{
+            "seq": r[0],
+            "tbl": r[1],
+            "op": r[2],
+            "id": r[3],
+            "data": json.loads(r[4]) if r[4] else None,
+            "ts": r[5]
+        } for r in rows]
+
+    def prune(self, before: str) -> int:
+        # Poda por fecha (los seq no se reutilizan)
+        with self.lock:
+            self.c.execute('DELETE FROM changes WHERE ts < ?', (before,))
+            self.conn.commit()
+            return self.c.rowcount
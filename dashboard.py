@@ -0,0 +1,88 @@
+import datetime as dt
+import logging
+
+import flet as ft
+
+from analytics import Analytics, DAY
+
+logger = logging.getLogger(__name__)
+
+WINDOWS = {"7d": 7, "30d": 30, "90d": 90, "1y": 365}
+
+
+def dashboard_app(page: ft.Page, an: Analytics):
+    # an es el de la InvApp (InvApp.an): misma BD, conexión y lock que el resto de módulos
+    page.title = "Inv Crisoull - Analytics"
+    page.scroll = ft.ScrollMode.AUTO
+
+    win_dd = ft.Dropdown(label="Window", value="30d", width=120,
+                         options=[ft.dropdown.Option(k) for k in WINDOWS])
+    sum_txt = ft.Text(size=14, font_family="Roboto Mono")
+    peak_row = ft.Row(spacing=2, vertical_alignment=ft.CrossAxisAlignment.END)
+    tool_tbl = ft.DataTable(columns=[
+        ft.DataColumn(ft.Text("Tool")),
+        ft.DataColumn(ft.Text("Loans"), numeric=True),
+        ft.DataColumn(ft.Text("Util %"), numeric=True),
+        ft.DataColumn(ft.Text("Mean h"), numeric=True),
+    ])
+    worker_tbl = ft.DataTable(columns=[
+        ft.DataColumn(ft.Text("Worker")),
+        ft.DataColumn(ft.Text("Loans"), numeric=True),
+        ft.DataColumn(ft.Text("Rets"), numeric=True),
+        ft.DataColumn(ft.Text("Hours"), numeric=True),
+    ])
+
+    def load(e=None):
+        try:
+            an.refresh()
+            end = dt.date.today()
+            start = end - dt.timedelta(days=WINDOWS[win_dd.value] - 1)
+            r = an.report(start.strftime(DAY), end.strftime(DAY))
+            sum_txt.value = (
+                f"{r['start']} .. {r['end']}\n"
+                f"Loans: {r['loans']}  Rets: {r['rets']}\n"
+                f"Mean loan: {r['mean_h'] if r['mean_h'] is not None else 'N/A'} h\n"
+                f"Utilization: {r['util'] * 100:.1f}%"
+            )
+            top = max(r["peak_hours"]) or 1
+            peak_row.controls = [
+                ft.Column([
+                    ft.Container(width=14, height=4 + 96 * n / top, bgcolor=ft.colors.BLUE_400, tooltip=f"{h}:00 - {n}"),
+                    ft.Text(f"{h}", size=9)
+                ], spacing=1, horizontal_alignment=ft.CrossAxisAlignment.CENTER)
+                for h, n in enumerate(r["peak_hours"])
+            ]
+            tool_tbl.rows = [
+                ft.DataRow(cells=[
+                    ft.DataCell(ft.Text(t["name"])),
+                    ft.DataCell(ft.Text(str(t["loans"]))),
+                    ft.DataCell(ft.Text(f"{t['util'] * 100:.1f}")),
+                    ft.DataCell(ft.Text(str(t["mean_h"] if t["mean_h"] is not None else "-"))),
+                ]) for t in r["tools"]
+            ]
+            worker_tbl.rows = [
+                ft.DataRow(cells=[
+                    ft.DataCell(ft.Text(w["worker"])),
+                    ft.DataCell(ft.Text(str(w["loans"]))),
+                    ft.DataCell(ft.Text(str(w["rets"]))),
+                    ft.DataCell(ft.Text(str(w["hours"]))),
+                ]) for w in r["workers"]
+            ]
+        except Exception as ex:
+            logger.error("Dashboard err: %s", ex)
+            sum_txt.value = f"Err: {ex}"
+        page.update()
+
+    win_dd.on_change = load
+    page.add(
+        ft.Row([ft.Text("Analytics", style=ft.TextThemeStyle.HEADLINE_SMALL), win_dd,
+                ft.IconButton(ft.icons.REFRESH, on_click=load)]),
+        sum_txt,
+        ft.Text("Loans by hour", weight="bold"),
+        peak_row,
+        ft.Row([
+            ft.Column([ft.Text("Top tools", weight="bold"), tool_tbl]),
+            ft.Column([ft.Text("Workers", weight="bold"), worker_tbl]),
+        ], vertical_alignment=ft.CrossAxisAlignment.START, wrap=True)
+    )
+    load()
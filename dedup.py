@@ -0,0 +1,181 @@
+import json
+import sqlite3
+import threading
+import unicodedata
+import logging
+from typing import Optional, Dict, List, Any, Set, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Nombres de herramienta casi repetidos. Trigramas del nombre normalizado (sin acentos,
+# minúsculas, solo letras y dígitos), como pg_trgm: cada palabra se rellena "  pal " y se
+# trocea de 3 en 3. Similitud = |A∩B| / |A∪B|. Cada trigrama es un entero (3 puntos de
+# código de 21 bits); tool_norm guarda los de cada herramienta como blob int64 ordenado.
+# Las listas invertidas viven en memoria (numpy, tipo CSR: trigramas ordenados y, por cada
+# uno, sus h_id); se montan en la primera búsqueda y lo que cambia después (put) va a un
+# parche que se compara aparte, hasta REBUILD cambios. Una búsqueda suma con bincount las
+# listas de sus trigramas: |A∩B| de todas las herramientas a la vez, sin candidatos.
+# Las pocas que pasan el umbral se comprueban contra tool_norm (borradas, rollback).
+# El trigger ti_h_follow hace que loans/rets/reservas/vencidos sigan a su inst si cambia de
+# herramienta (fusión local o aplicada por repl.py).
+
+SIM = 0.6  # umbral de aviso
+REBUILD = 2000  # cambios en el parche antes de rehacer las listas
+
+SQL = {
+    "dd_stale": '''
+        SELECT t.id, t.name FROM tools t LEFT JOIN tool_norm n ON n.h_id = t.id
+        WHERE n.name IS NOT t.name
+    ''',
+    "dd_get": 'SELECT name FROM tool_norm WHERE h_id = ?',
+    "dd_put": 'INSERT OR REPLACE INTO tool_norm (h_id, name, norm, tri) VALUES (?, ?, ?, ?)',
+    "dd_all": 'SELECT h_id, tri FROM tool_norm',
+    "dd_rows": 'SELECT h_id, name, tri FROM tool_norm WHERE h_id IN (SELECT value FROM json_each(?))',
+}
+
+# Planes admitidos por `bench.py plans` (ver PLAN_OK en inv2log.py)
+PLAN_OK = {
+    "dd_stale": ("SCAN t",),  # fill(): arranque y tras sync_in
+    "dd_all": ("SCAN tool_norm",),  # montaje de las listas en memoria
+}
+
+
+def norm(name: Optional[str]) -> str:
+    s = unicodedata.normalize("NFKD", name or "")
+    s = "".join(c if c.isalnum() else " " for c in s if not unicodedata.combining(c))
+    return " ".join(s.casefold().split())
+
+
+def tris(n: str) -> Set[int]:
+    out = set()
+    for w in n.split():
+        w = "  " + w + " "
+        o = [ord(c) for c in w]
+        out.update((o[k] << 42) | (o[k + 1] << 21) | o[k + 2] for k in range(len(o) - 2))
+    return out
+
+
+def _row(h_id: int, name: str) -> Tuple[int, str, str, bytes]:
+    n = norm(name)
+    return h_id, name, n, np.array(sorted(tris(n)), dtype=np.int64).tobytes()
+
+
+def _jac(q: np.ndarray, b: np.ndarray) -> float:
+    k = len(np.intersect1d(q, b, assume_unique=True))
+    return k / (len(q) + len(b) - k) if len(q) + len(b) else 0.0
+
+
+class Dedup:
+    def __init__(self, conn: sqlite3.Connection, lock: Optional[threading.RLock] = None):
+        self.conn, self.c = conn, conn.cursor()
+        self.lock = lock or threading.RLock()
+        self._ix: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]] = None  # (tri, inicio, h_id, nº tri)
+        self._mod: Dict[int, np.ndarray] = {}  # h_id -> trigramas actuales, cambiados tras montar _ix
+        self._init_db()
+
+    def _init_db(self):
+        with self.lock:
+            self.c.executescript('''
+            CREATE TABLE IF NOT EXISTS tool_norm (
+                h_id INTEGER PRIMARY KEY,
+                name TEXT,  -- nombre indexado: si tools.name difiere, fill() lo rehace
+                norm TEXT,
+                tri BLOB,  -- trigramas int64 ordenados
+                FOREIGN KEY (h_id) REFERENCES tools (id) ON DELETE CASCADE
+            );
+            CREATE TRIGGER IF NOT EXISTS ti_h_follow AFTER UPDATE OF h_id ON tool_inst
+            WHEN OLD.h_id IS NOT NEW.h_id BEGIN
+                UPDATE loans SET h_id = NEW.h_id WHERE i_id = NEW.id;
+                UPDATE rets SET h_id = NEW.h_id WHERE i_id = NEW.id;
+                UPDATE reservations SET h_id = NEW.h_id WHERE i_id = NEW.id;
+                UPDATE overdue SET h_id = NEW.h_id WHERE i_id = NEW.id;
+            END;
+            ''')
+            self.conn.commit()
+            n = self.fill()
+            if n:
+                logger.info("Dedup: %d names indexed", n)
+
+    def _touch(self, rows: List[Tuple[int, str, str, bytes]]):
+        # Cambios ya escritos en tool_norm: al parche, o se tiran las listas si son muchos
+        if self._ix is None:
+            return
+        if len(self._mod) + len(rows) > REBUILD:
+            self._ix, self._mod = None, {}
+            return
+        for h_id, _, _, b in rows:
+            self._mod[h_id] = np.frombuffer(b, dtype=np.int64)
+
+    def put(self, h_id: int, name: str) -> bool:
+        # Reindexa h_id si su nombre cambió; sin commit: va en la transacción de add/upd
+        with self.lock:
+            r = self.c.execute(SQL["dd_get"], (h_id,)).fetchone()
+            if r and r[0] == name:
+                return False
+            row = _row(h_id, name)
+            self.c.execute(SQL["dd_put"], row)
+            self._touch([row])
+            return True
+
+    def fill(self) -> int:
+        # Herramientas sin indexar o renombradas fuera de InvApp (repl.py, cargas directas)
+        with self.lock:
+            rows = [_row(h_id, name) for h_id, name in self.c.execute(SQL["dd_stale"]).fetchall()]
+            if not rows:
+                return 0
+            try:
+                self.c.executemany(SQL["dd_put"], rows)
+                self.conn.commit()
+            except sqlite3.Error:
+                self.conn.rollback()
+                raise
+            self._touch(rows)
+            return len(rows)
+
+    def _build(self):
+        rows = self.c.execute(SQL["dd_all"]).fetchall()
+        hs = np.array([r[0] for r in rows], dtype=np.int64)
+        arrs = [np.frombuffer(r[1], dtype=np.int64) for r in rows]
+        ln = np.array([len(a) for a in arrs], dtype=np.int64)
+        T = np.concatenate(arrs) if arrs else np.empty(0, dtype=np.int64)
+        o = np.argsort(T, kind="stable")
+        T, H = T[o], np.repeat(hs, ln)[o].astype(np.int32)
+        keys, st = np.unique(T, return_index=True)
+        ns = np.zeros(int(hs.max()) + 1 if len(hs) else 1, dtype=np.int64)
+        ns[hs] = ln
+        self._ix, self._mod = (keys, np.append(st, len(T)), H, ns), {}
+
+    def similar(self, name: str, t: float = SIM, limit: int = 5, skip: Optional[int] = None) -> List[Dict[str, Any]]:
+        # Herramientas con similitud >= t, de más a menos parecida; skip excluye una (la que se edita)
+        q = np.array(sorted(tris(norm(name))), dtype=np.int64)
+        if not len(q):
+            return []
+        with self.lock:
+            if self._ix is None:
+                self._build()
+            keys, st, H, ns = self._ix
+            k = np.minimum(np.searchsorted(keys, q), max(len(keys) - 1, 0))
+            k = k[keys[k] == q] if len(keys) else k[:0]
+            cnt = np.bincount(np.concatenate([H[st[i]:st[i + 1]] for i in k]) if len(k) else H[:0],
+                              minlength=len(ns))
+            sim = cnt / (len(q) + ns - cnt)
+            sim[list(h for h in self._mod if h < len(sim))] = 0
+            if skip is not None and skip < len(sim):
+                sim[skip] = 0
+            ids = np.flatnonzero(sim >= t)
+            ids = ids[np.argsort(-sim[ids], kind="stable")][:4 * limit].tolist()
+            ids += [h for h, b in self._mod.items() if h != skip and _jac(q, b) >= t]
+            if not ids:
+                return []
+            # Comprobación sobre tool_norm: fuera las borradas y los cambios de una transacción deshecha
+            self.c.execute(SQL["dd_rows"], (json.dumps(ids),))
+            rows = self.c.fetchall()
+        out = []
+        for h_id, nm, b in rows:
+            s = _jac(q, np.frombuffer(b, dtype=np.int64))
+            if s >= t:
+                out.append({"id": h_id, "name": nm, "sim": round(s, 3)})
+        out.sort(key=lambda d: (-d["sim"], d["name"]))
+        return out[:limit]
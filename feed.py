@@ -0,0 +1,71 @@
+import queue
+import threading
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, FrozenSet
+
+logger = logging.getLogger(__name__)
+
+# Canal de cambios en proceso: InvApp publica un Delta tras cada commit y un hilo
+# despachador lo reparte a las sesiones suscritas. Los deltas que llegan juntos
+# (borrado masivo, varias sesiones escribiendo) se funden en uno antes de repartir.
+
+
+@dataclass(frozen=True)
+class Delta:
+    evs: FrozenSet[str] = frozenset()  # add, upd, del, consume, loan, ret, qr...
+    tools: Dict[int, Any] = field(default_factory=dict)  # id -> Tool, None si se borró
+    insts: Dict[int, Any] = field(default_factory=dict)  # i_id -> ToolInst, None si se borró
+    note: str = ""  # texto para avisos (p.ej. vencidos)
+
+    def __or__(self, o: "Delta") -> "Delta":
+        note = "; ".join(n for n in (self.note, o.note) if n)
+        return Delta(self.evs | o.evs, {**self.tools, **o.tools}, {**self.insts, **o.insts}, note)
+
+
+class Feed:
+    def __init__(self):
+        self._subs: Dict[int, Callable[[Delta], None]] = {}
+        self._next = 0
+        self._lock = threading.Lock()
+        self._q: "queue.Queue[Delta]" = queue.Queue()
+        self._t = None
+
+    def subscribe(self, fn: Callable[[Delta], None]) -> int:
+        with self._lock:
+            self._next += 1
+            self._subs[self._next] = fn
+            if self._t is None:
+                self._t = threading.Thread(target=self._run, name="inv-feed", daemon=True)
+                self._t.start()
+            return self._next
+
+    def unsubscribe(self, tok: int):
+        with self._lock:
+            self._subs.pop(tok, None)
+
+    def __len__(self) -> int:
+        return len(self._subs)
+
+    def publish(self, d: Delta):
+        # No bloquea: se llama con el lock de la BD tomado
+        if self._subs:
+            self._q.put(d)
+
+    def _run(self):
+        while True:
+            d = self._q.get()
+            try:
+                while True:
+                    d = d | self._q.get_nowait()
+            except queue.Empty:
+                pass
+            with self._lock:
+                subs = list(self._subs.items())
+            for tok, fn in subs:
+                try:
+                    fn(d)
+                except Exception as e:
+                    # Sesión cerrada o rota: se da de baja
+                    logger.error("Feed sub %d err: %s", tok, e)
+                    self.unsubscribe(tok)
@@ -14,10 +14,31 @@ import base64
 import logging
 from logging.handlers import RotatingFileHandler
 import zipfile
-from dataclasses import dataclass
+import sys
+from array import array
+import hmac
+import hashlib
+import secrets
+from dataclasses import dataclass, field
 from typing import Optional, List, Dict, Any
 from functools import wraps
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import threading
+from qrpack import QRPack, LEGACY_RE, GC_DEAD, GC_MIN
+from feed import Feed, Delta
+from analytics import Analytics
+from overdue import OverdueSched, OVERDUE_HRS
+from archive import Archiver, ARCH_MONTHS
+from backup import Backup
+from cdc import ChangeLog
+from repl import Repl
+from mirror import Mirror
+from workers import Workers
+from reservations import Reservations, norm_ts
+from locations import Locations, KINDS as LOC_KINDS
+from timeline import Timeline, PAGE as TL_PAGE
+from dedup import Dedup
 
 # Configuración de logging
 logging.basicConfig(
@@ -32,13 +53,324 @@ USERS = {
     "worker": {"password": "worker123", "role": "worker"}
 }
 
+# Pool compartido para SQL y E/S lanzados desde la UI
+POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="inv")
+PICK_N = 20  # filas por tecla en el selector de instancias
+MIRROR_MB = 128  # espejo en memoria de la app (get_app); InvApp() a secas no lo carga
+
+QR_PREFIX = "INV:"
+QR_VER = 1
+QR_EC = {
+    "L": qrcode.constants.ERROR_CORRECT_L,
+    "M": qrcode.constants.ERROR_CORRECT_M,
+    "Q": qrcode.constants.ERROR_CORRECT_Q,
+    "H": qrcode.constants.ERROR_CORRECT_H
+}
+
+# Registro de todas las consultas de QRMgr e InvApp por nombre (las migraciones de
+# esquema quedan en su sitio). `bench.py plans` pasa EXPLAIN QUERY PLAN por cada una
+# contra una BD sintética y falla si aparece un SCAN o un TEMP B-TREE no listado en PLAN_OK.
+SQL = {
+    # QRMgr
+    "qr_key": 'SELECT v FROM cfg WHERE k = "qr_key"',
+    "qr_key_add": 'INSERT INTO cfg (k, v) VALUES ("qr_key", ?)',
+    "inst_qr": 'SELECT qr_uuid FROM tool_inst WHERE id = ?',
+    "hqr_get": 'SELECT qr_uuid FROM h_qr WHERE tool_uuid = ? AND i_id = ?',
+    "hqr_add": 'INSERT INTO h_qr (tool_uuid, i_id, qr_uuid, date, img) VALUES (?, ?, ?, ?, ?)',
+    "hqr_upd": 'UPDATE h_qr SET qr_uuid = ?, img = NULL WHERE tool_uuid = ? AND i_id = ?',
+    "hqr_del": 'DELETE FROM h_qr WHERE tool_uuid = ? AND i_id = ?',
+    "hqr_queue": '''
+        INSERT OR IGNORE INTO h_qr (tool_uuid, i_id, qr_uuid, date, img)
+        SELECT tool_uuid, id, qr_uuid, ?, NULL FROM tool_inst WHERE h_id = ? AND ord > ?
+    ''',
+    "qr_q_add": '''
+        INSERT OR IGNORE INTO qr_q (i_id)
+        SELECT id FROM tool_inst WHERE h_id = ? AND ord > ?
+    ''',
+    "qr_q_next": '''
+        SELECT q.i_id, ti.qr_uuid FROM qr_q q JOIN tool_inst ti ON ti.id = q.i_id
+        ORDER BY q.i_id LIMIT ?
+    ''',
+    "qr_q_del": 'DELETE FROM qr_q WHERE i_id = ?',
+    # exp_qrs: insts sin PNG vivo en el pack (cargas directas, repl, pack rehecho) a h_qr y a la cola
+    "hqr_missing": '''
+        INSERT OR IGNORE INTO h_qr (tool_uuid, i_id, qr_uuid, date, img)
+        SELECT ti.tool_uuid, ti.id, ti.qr_uuid, ?, NULL FROM tool_inst ti
+        WHERE NOT EXISTS (SELECT 1 FROM qr_pack p WHERE p.qr_uuid = ti.qr_uuid AND p.live = 1)
+    ''',
+    "qr_q_missing": '''
+        INSERT OR IGNORE INTO qr_q (i_id)
+        SELECT ti.id FROM tool_inst ti
+        WHERE NOT EXISTS (SELECT 1 FROM qr_pack p WHERE p.qr_uuid = ti.qr_uuid AND p.live = 1)
+    ''',
+    "qr_q_gc": 'DELETE FROM qr_q WHERE i_id NOT IN (SELECT id FROM tool_inst)',
+    "read_qr": '''
+        SELECT h.id, h.name, h.resp, h.qty, h.img, h.status, h.is_consumable, ti.id, ti.serial, ti.status, ti.img
+        FROM tool_inst ti JOIN tools h ON h.id = ti.h_id
+        WHERE ti.qr_uuid = ?
+    ''',
+    "read_qr_json": '''
+        SELECT h.id, h.name, h.resp, h.qty, h.img, h.status, h.is_consumable, ti.id, ti.serial, ti.status, ti.img
+        FROM tools h JOIN tool_inst ti ON h.tool_uuid = ti.tool_uuid
+        WHERE h.tool_uuid = ? AND ti.id = ?
+    ''',
+    "ret_add": 'INSERT INTO rets (h_id, i_id, worker, w_id, date, notes) VALUES (?, ?, ?, ?, ?, ?)',
+    "ret_inst": "UPDATE tool_inst SET status = 'avail' WHERE id = ? AND h_id = ?",
+    "ret_close": 'UPDATE loans SET closed = ? WHERE i_id = ? AND closed IS NULL',
+    "ret_od": 'DELETE FROM overdue WHERE i_id = ?',
+    "stats_loaned": "SELECT COUNT(*) FROM tool_inst WHERE status = 'loaned'",
+    "stats_loans": 'SELECT COUNT(*) FROM loans WHERE date >= ?',
+    "stats_rets": 'SELECT COUNT(*) FROM rets WHERE date >= ?',
+    "stats_pop": '''
+        SELECT h.name, COUNT(l.id)
+        FROM loans l JOIN tools h ON l.h_id = h.id
+        GROUP BY h.id, h.name
+        ORDER BY COUNT(l.id) DESC LIMIT 5
+    ''',
+    # Por ubicación: cuenta lo de las insts que están ahora en loc (idx_ti_loc*). Los de hoy
+    # van primero por fecha (CROSS JOIN fija el orden): son pocos, la ubicación puede tener miles de insts
+    "stats_loaned_loc": "SELECT COUNT(*) FROM tool_inst WHERE loc_id = ? AND status = 'loaned'",
+    "stats_loans_loc": 'SELECT COUNT(*) FROM loans l CROSS JOIN tool_inst ti ON ti.id = l.i_id WHERE l.date >= ? AND ti.loc_id = ?',
+    "stats_rets_loc": 'SELECT COUNT(*) FROM rets r CROSS JOIN tool_inst ti ON ti.id = r.i_id WHERE r.date >= ? AND ti.loc_id = ?',
+    "stats_pop_loc": '''
+        SELECT h.name, COUNT(l.id)
+        FROM tool_inst ti JOIN loans l ON l.i_id = ti.id JOIN tools h ON h.id = ti.h_id
+        WHERE ti.loc_id = ?
+        GROUP BY h.id, h.name
+        ORDER BY COUNT(l.id) DESC LIMIT 5
+    ''',
+    # InvApp
+    "tool_add": '''
+        INSERT INTO tools (tool_uuid, name, resp, qty, is_consumable, img, status)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''',
+    "consume": '''
+        UPDATE tools SET qty = qty - ?
+        WHERE id = ? AND is_consumable = 1 AND qty >= ?
+        RETURNING name, qty
+    ''',
+    "consume_chk": 'SELECT name, qty, is_consumable FROM tools WHERE id = ?',
+    "consume_add": 'INSERT INTO consumes (h_id, qty, left, worker, date) VALUES (?, ?, ?, ?, ?)',
+    "low_stock": '''
+        SELECT id, name, resp, qty, reorder FROM tools
+        WHERE is_consumable = 1 AND reorder > 0 AND qty - reorder <= 0
+        ORDER BY qty - reorder LIMIT ?
+    ''',
+    "reorder": 'SELECT reorder FROM tools WHERE id = ?',
+    "consumes_tool": '''
+        SELECT c.id, t.name, c.qty, c.left, c.worker, c.date
+        FROM consumes c JOIN tools t ON t.id = c.h_id
+        WHERE c.h_id = ? ORDER BY c.date DESC LIMIT ?
+    ''',
+    "consumes": '''
+        SELECT c.id, t.name, c.qty, c.left, c.worker, c.date
+        FROM consumes c JOIN tools t ON t.id = c.h_id
+        ORDER BY c.id DESC LIMIT ?
+    ''',
+    "tools": '''
+        SELECT id, tool_uuid, name, resp, qty, is_consumable, img, status
+        FROM tools ORDER BY name
+    ''',
+    # Las de loc: reutilizables con alguna inst allí y los consumibles, que no tienen ubicación
+    "tools_loc": '''
+        SELECT id, tool_uuid, name, resp, qty, is_consumable, img, status
+        FROM tools WHERE id IN (SELECT h_id FROM tool_inst WHERE loc_id = ?)
+        UNION ALL
+        SELECT id, tool_uuid, name, resp, qty, is_consumable, img, status
+        FROM tools WHERE is_consumable = 1
+        ORDER BY name
+    ''',
+    "insts_at": 'SELECT COUNT(*) FROM tool_inst WHERE loc_id = ? AND h_id = ?',
+    "insts_at_loc": 'SELECT h_id, COUNT(*) FROM tool_inst WHERE loc_id = ? GROUP BY h_id',
+    "xfer_loaned": "SELECT COUNT(*) FROM tool_inst WHERE id IN (SELECT value FROM json_each(?)) AND status = 'loaned'",
+    "tool": '''
+        SELECT id, tool_uuid, name, resp, qty, is_consumable, img, status
+        FROM tools WHERE id = ?
+    ''',
+    "inst": '''
+        SELECT id, h_id, tool_uuid, serial, status, qr_uuid, img
+        FROM tool_inst WHERE id = ?
+    ''',
+    "insts": '''
+        SELECT id, h_id, tool_uuid, serial, status, qr_uuid, img
+        FROM tool_inst WHERE h_id = ? ORDER BY ord
+    ''',
+    "insts_loc": '''
+        SELECT id, h_id, tool_uuid, serial, status, qr_uuid, img
+        FROM tool_inst WHERE loc_id = ? AND h_id = ? ORDER BY ord
+    ''',
+    "find_insts": '''
+        SELECT id, h_id, tool_uuid, serial, status, qr_uuid, img
+        FROM tool_inst WHERE h_id = ? AND status = ? AND serial >= ? AND serial < ?
+        AND (? IS NULL OR loc_id = ?)
+        ORDER BY serial LIMIT ?
+    ''',
+    # Por ordinal: un rango [lo, hi) de ord; las fundidas conservan el serial de su herramienta de origen
+    "find_insts_ord": '''
+        SELECT id, h_id, tool_uuid, serial, status, qr_uuid, img
+        FROM tool_inst WHERE h_id = ? AND status = ? AND ord >= ? AND ord < ?
+        AND (? IS NULL OR loc_id = ?)
+        ORDER BY ord LIMIT ?
+    ''',
+    "find_insts_ord_any": '''
+        SELECT id, h_id, tool_uuid, serial, status, qr_uuid, img
+        FROM tool_inst WHERE h_id = ? AND ord >= ? AND ord < ?
+        AND (? IS NULL OR loc_id = ?)
+        ORDER BY ord LIMIT ?
+    ''',
+    "inst_top": 'SELECT MAX(ord) FROM tool_inst WHERE h_id = ?',
+    # Sin estado: el prefijo <tool_uuid>- ya acota a la herramienta; +h_id evita que gane idx_ti_ord
+    "find_insts_any": '''
+        SELECT id, h_id, tool_uuid, serial, status, qr_uuid, img
+        FROM tool_inst WHERE serial >= ? AND serial < ? AND +h_id = ?
+        AND (? IS NULL OR loc_id = ?)
+        ORDER BY serial LIMIT ?
+    ''',
+    "all_insts": '''
+        SELECT id, h_id, tool_uuid, serial, status, qr_uuid, img, ord
+        FROM tool_inst ORDER BY h_id, ord
+    ''',
+    "tool_upd": '''
+        UPDATE tools
+        SET name = ?, resp = ?, qty = ?, is_consumable = ?, img = ?, reorder = COALESCE(?, reorder)
+        WHERE id = ?
+    ''',
+    "resize_n": 'SELECT COUNT(*), COALESCE(MAX(ord), 0) FROM tool_inst WHERE h_id = ?',
+    "resize_add": '''
+        INSERT INTO tool_inst (h_id, tool_uuid, serial, status, qr_uuid, img, ord, loc_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''',
+    "resize_pick": '''
+        SELECT id, qr_uuid FROM tool_inst WHERE h_id = ? AND status = 'avail'
+        ORDER BY ord DESC LIMIT ?
+    ''',
+    "resize_del_qr": 'DELETE FROM h_qr WHERE i_id IN (SELECT value FROM json_each(?))',
+    "resize_del": 'DELETE FROM tool_inst WHERE id IN (SELECT value FROM json_each(?))',
+    "tool_del_get": 'SELECT name, img FROM tools WHERE id = ?',
+    "tool_del": 'DELETE FROM tools WHERE id = ?',
+    "bulk_imgs": 'SELECT img FROM tools WHERE id IN (SELECT value FROM json_each(?)) AND img IS NOT NULL',
+    "bulk_del": 'DELETE FROM tools WHERE id IN (SELECT value FROM json_each(?))',
+    "bulk_flip": '''
+        SELECT id, tool_uuid, name, qty, img FROM tools
+        WHERE id IN (SELECT value FROM json_each(?)) AND is_consumable != ?
+    ''',
+    "bulk_upd": 'UPDATE tools SET {sets} WHERE id IN (SELECT value FROM json_each(?))',
+    # merge_tools: loans/rets/reservas siguen a las insts por el trigger ti_h_follow (dedup.py)
+    "merge_get": 'SELECT id, tool_uuid, name, qty, is_consumable, img FROM tools WHERE id IN (SELECT value FROM json_each(?))',
+    "merge_qr": 'UPDATE h_qr SET tool_uuid = ? WHERE tool_uuid = ?',
+    "merge_insts": 'UPDATE tool_inst SET h_id = ?1, tool_uuid = ?2, ord = ord + ?3, img = ?4 WHERE h_id = ?5',
+    "merge_cons": 'UPDATE consumes SET h_id = ? WHERE h_id = ?',
+    "merge_dst": 'UPDATE tools SET qty = qty + ?, img = ? WHERE id = ?',
+    "regen_inst": 'UPDATE tool_inst SET qr_uuid = ? WHERE id = ?',
+    "loan_hrs": 'SELECT COALESCE(loan_hrs, ?) FROM tools WHERE id = ?',
+    "loan_add": '''
+        INSERT INTO loans (h_id, i_id, worker, w_id, date, due)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''',
+    "loan_inst": "UPDATE tool_inst SET status = 'loaned' WHERE id = ? AND h_id = ?",
+    "policy_set": 'UPDATE tools SET loan_hrs = ? WHERE id = ?',
+    "policy_due": '''
+        UPDATE loans SET due = datetime(date, '+' || ? || ' hours')
+        WHERE h_id = ? AND closed IS NULL
+    ''',
+    "policy": 'SELECT loan_hrs FROM tools WHERE id = ?',
+    "hist": '''
+        SELECT d.id, h.name, ti.serial, d.worker, d.date, d.notes
+        FROM {src} d
+        JOIN tools h ON d.h_id = h.id
+        JOIN tool_inst ti ON d.i_id = ti.id
+        ORDER BY d.date DESC LIMIT ?
+    ''',
+    "rollup_tools": '''
+        SELECT resp, is_consumable, COUNT(*), COALESCE(SUM(qty), 0)
+        FROM tools GROUP BY resp, is_consumable
+    ''',
+    "rollup_insts": '''
+        SELECT t.resp, i.status, COUNT(*)
+        FROM tool_inst i JOIN tools t ON t.id = i.h_id
+        GROUP BY t.resp, i.status
+    ''',
+    # En una ubicación la qty de una reutilizable es el nº de sus insts allí; los consumibles van enteros
+    "rollup_tools_loc": '''
+        SELECT t.resp, 0, COUNT(DISTINCT i.h_id), COUNT(*)
+        FROM tool_inst i JOIN tools t ON t.id = i.h_id
+        WHERE i.loc_id = ? GROUP BY t.resp
+        UNION ALL
+        SELECT resp, 1, COUNT(*), COALESCE(SUM(qty), 0)
+        FROM tools WHERE is_consumable = 1 GROUP BY resp
+    ''',
+    "rollup_insts_loc": '''
+        SELECT t.resp, i.status, COUNT(*)
+        FROM tool_inst i JOIN tools t ON t.id = i.h_id
+        WHERE i.loc_id = ?
+        GROUP BY t.resp, i.status
+    ''',
+    "csv_counts": 'SELECT h_id, COUNT(*) FROM tool_inst GROUP BY h_id',
+}
+
+# Recorridos aceptados: consulta -> patrones (fnmatch) de líneas de plan permitidas. Son
+# agregados o listados enteros por diseño, recorridos de índice en orden con LIMIT, o la
+# cola qr_q, que es pequeña. Cualquier otro SCAN o TEMP B-TREE es una regresión.
+PLAN_OK = {
+    "qr_q_next": ("SCAN q",),
+    "qr_q_gc": ("SCAN qr_q",),
+    "hqr_missing": ("SCAN ti*",),  # exportación completa
+    "qr_q_missing": ("SCAN ti*",),
+    "stats_pop": ("SCAN h*", "SCAN l*", "USE TEMP B-TREE FOR ORDER BY"),
+    "consumes": ("SCAN c",),  # id DESC + LIMIT: rowid hacia atrás
+    "tools": ("SCAN tools", "USE TEMP B-TREE FOR ORDER BY"),  # ordenar sale más barato que un índice por name
+    "all_insts": ("SCAN tool_inst USING INDEX idx_ti_ord",),
+    "hist": ("SCAN d USING INDEX idx_rets_date",),
+    "hist_all": ("SCAN *.rets USING INDEX idx_rets_date",),
+    "rollup_tools": ("SCAN tools*", "USE TEMP B-TREE FOR GROUP BY"),
+    "rollup_insts": ("SCAN i*", "SCAN t*", "USE TEMP B-TREE FOR GROUP BY"),
+    "csv_counts": ("SCAN tool_inst USING COVERING INDEX idx_ti_h_id",),
+    # Agregados de una ubicación: recorren su parte de idx_ti_loc y agrupan
+    "stats_pop_loc": ("USE TEMP B-TREE FOR GROUP BY", "USE TEMP B-TREE FOR ORDER BY"),
+    "tools_loc": ("SCAN tools USING INDEX idx_tools_cons", "USE TEMP B-TREE FOR ORDER BY"),
+    "rollup_tools_loc": ("SCAN tools USING INDEX idx_tools_cons", "USE TEMP B-TREE FOR *"),
+    "rollup_insts_loc": ("USE TEMP B-TREE FOR GROUP BY",),
+}
+
+def _now() -> str:
+    return dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+def _ord_ranges(q: str, top: int) -> List[tuple]:
+    # Rangos [lo, hi) crecientes de ord: el propio q como número y luego los que en el serial
+    # ({ord:03d}) empiezan por q ("12" -> 12, 120-129, 1200-1299...)
+    if not q:
+        return [(0, top + 1)]
+    n, out = int(q), []
+    if len(q) < 3 and q[0] != "0":
+        out.append((n, n + 1))
+    if len(q) <= 3:
+        out.append((n * 10 ** (3 - len(q)), (n + 1) * 10 ** (3 - len(q))))
+    w = max(4, len(q))
+    while q[0] != "0" and n * 10 ** (w - len(q)) <= top:
+        out.append((n * 10 ** (w - len(q)), (n + 1) * 10 ** (w - len(q))))
+        w += 1
+    return out
+
+def locked(func):
+    # Serializa el acceso al cursor compartido entre hilos (handlers, pool de trabajo)
+    @wraps(func)
+    def wrap(self, *args, **kwargs):
+        with self.lock:
+            return func(self, *args, **kwargs)
+    return wrap
+
 @dataclass
 class QRData:
     tool_uuid: str
     i_id: int
     name: str
-    date: str = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    uuid: str = str(uuid.uuid4())
+    date: str = field(default_factory=_now)
+    uuid: str = field(default_factory=lambda: str(uuid.uuid4()))
+    def to_payload(self, key: bytes) -> str:
+        # INV:<base32(ver | qr_uuid[16] | hmac[8])> -> 44 chars, modo alfanumérico del QR
+        raw = bytes([QR_VER]) + uuid.UUID(self.uuid).bytes
+        sig = hmac.new(key, raw, hashlib.sha256).digest()[:8]
+        return QR_PREFIX + base64.b32encode(raw + sig).decode('ascii')
     def to_json(self):
         return json.dumps({
             "tool_uuid": self.tool_uuid,
@@ -48,12 +380,39 @@ class QRData:
             "uuid": self.uuid
         })
 
+class LRU:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._d = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            val = self._d.get(key)
+            if val is not None:
+                self._d.move_to_end(key)
+            return val
+
+    def put(self, key, val):
+        with self._lock:
+            self._d[key] = val
+            self._d.move_to_end(key)
+            while len(self._d) > self.maxsize:
+                self._d.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._d.clear()
+
+    def __len__(self):
+        return len(self._d)
+
 @dataclass
 class RetData:
     h_id: int
     i_id: int
     worker: str
-    date: str = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    date: str = field(default_factory=_now)
     notes: str = ""
     def to_dict(self):
         return {
@@ -64,7 +423,7 @@ class RetData:
             "notes": self.notes
         }
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class ToolInst:
     id: int
     h_id: int
@@ -74,7 +433,7 @@ class ToolInst:
     qr_uuid: str
     img: Optional[str] = None
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Tool:
     id: int
     tool_uuid: str
@@ -85,12 +444,151 @@ class Tool:
     img: Optional[str] = None
     status: str = "avail"
 
+def _intern(v: Optional[str]) -> Optional[str]:
+    return sys.intern(v) if v else v
+
+def _ub(v: Optional[str]) -> Optional[bytes]:
+    # 16 bytes solo si _us devuelve el mismo texto (minúsculas con guiones); si no, None y
+    # el llamador guarda el original: mayúsculas, sin guiones o {…} de datos antiguos o replicados
+    try:
+        u = uuid.UUID(v)
+    except (ValueError, TypeError, AttributeError):
+        return None
+    return u.bytes if str(u) == v else None
+
+def _us(b: bytearray, i: int) -> str:
+    return str(uuid.UUID(bytes=bytes(b[i * 16:i * 16 + 16])))
+
+class ToolTable:
+    # Vista columnar de tools: un array/lista por columna, filas Tool creadas bajo demanda.
+    # tool_uuid se guarda como 16 bytes; los que no vuelven igual de _us van a _uuid_raw.
+    __slots__ = ("_id", "_uuid", "_uuid_raw", "_name", "_resp", "_qty", "_cons", "_img", "_status")
+
+    def __init__(self, rows=()):
+        self._id, self._qty = array('q'), array('q')
+        self._uuid, self._cons = bytearray(), bytearray()
+        self._uuid_raw = {}
+        self._name, self._resp, self._img, self._status = [], [], [], []
+        for r in rows:
+            self._append(r)
+
+    def _append(self, r):
+        ub = _ub(r[1])
+        if ub is None:
+            self._uuid_raw[len(self._id)] = r[1]
+        self._uuid += ub or bytes(16)
+        self._id.append(r[0])
+        self._name.append(r[2])
+        self._resp.append(_intern(r[3]))
+        self._qty.append(r[4] or 0)
+        self._cons.append(1 if r[5] else 0)
+        self._img.append(r[6])
+        self._status.append(_intern(r[7]))
+
+    def _tool_uuid(self, i: int) -> Optional[str]:
+        if i in self._uuid_raw:
+            return self._uuid_raw[i]
+        return _us(self._uuid, i)
+
+    def row(self, i: int) -> tuple:
+        return (self._id[i], self._tool_uuid(i), self._name[i], self._resp[i], self._qty[i],
+                bool(self._cons[i]), self._img[i], self._status[i])
+
+    def rows(self):
+        for i in range(len(self._id)):
+            yield self.row(i)
+
+    def __len__(self) -> int:
+        return len(self._id)
+
+    def __getitem__(self, i: int) -> Tool:
+        if i < 0:
+            i += len(self._id)
+        return Tool(*self.row(i))
+
+    def __iter__(self):
+        for i in range(len(self._id)):
+            yield Tool(*self.row(i))
+
+    def filter(self, text: str) -> "ToolTable":
+        text = text.lower()
+        out = ToolTable()
+        for i, name in enumerate(self._name):
+            if text in (name or "").lower():
+                out._append(self.row(i))
+        return out
+
+    def total_qty(self) -> int:
+        return sum(self._qty)
+
+class InstTable:
+    # Igual que ToolTable para tool_inst. El serial no se guarda si es el estándar <tool_uuid>-NNN;
+    # cualquier valor que no encaje en la forma compacta va a _raw[(fila, columna)].
+    __slots__ = ("_id", "_h_id", "_ord", "_uuid", "_qr", "_status", "_img", "_raw")
+
+    def __init__(self, rows=()):
+        self._id, self._h_id, self._ord = array('q'), array('q'), array('q')
+        self._uuid, self._qr = bytearray(), bytearray()
+        self._status, self._img = [], []
+        self._raw = {}
+        for r in rows:
+            self._append(r)
+
+    def _append(self, r):
+        # r = (id, h_id, tool_uuid, serial, status, qr_uuid, img, ord)
+        i = len(self._id)
+        tb, qb = _ub(r[2]), _ub(r[5])
+        if tb is None:
+            self._raw[(i, 2)] = r[2]
+        if qb is None:
+            self._raw[(i, 5)] = r[5]
+        if tb is None or r[7] is None or r[3] != f"{r[2]}-{r[7]:03d}":
+            self._raw[(i, 3)] = r[3]
+        self._id.append(r[0])
+        self._h_id.append(r[1])
+        self._ord.append(r[7] or 0)
+        self._uuid += tb or bytes(16)
+        self._qr += qb or bytes(16)
+        self._status.append(_intern(r[4]))
+        self._img.append(_intern(r[6]))
+
+    def row(self, i: int) -> tuple:
+        raw = self._raw
+        tool_uuid = raw[(i, 2)] if (i, 2) in raw else _us(self._uuid, i)
+        serial = raw[(i, 3)] if (i, 3) in raw else f"{tool_uuid}-{self._ord[i]:03d}"
+        qr_uuid = raw[(i, 5)] if (i, 5) in raw else _us(self._qr, i)
+        return (self._id[i], self._h_id[i], tool_uuid, serial, self._status[i], qr_uuid, self._img[i])
+
+    def __len__(self) -> int:
+        return len(self._id)
+
+    def __getitem__(self, i: int) -> ToolInst:
+        if i < 0:
+            i += len(self._id)
+        return ToolInst(*self.row(i))
+
+    def __iter__(self):
+        for i in range(len(self._id)):
+            yield ToolInst(*self.row(i))
+
 class QRMgr:
-    def __init__(self, conn: sqlite3.Connection, qr_dir: str = "qr_codes"):
+    def __init__(self, conn: sqlite3.Connection, qr_dir: str = "qr_codes", ec: str = "H", cache_size: int = 512,
+                 lock: Optional[threading.RLock] = None):
         self.conn, self.c = conn, conn.cursor()
+        self.lock = lock or threading.RLock()
         self.qr_dir = os.path.abspath(qr_dir)
         os.makedirs(self.qr_dir, exist_ok=True)
+        self.ec = QR_EC[ec]
+        self._png_cache = LRU(cache_size)  # (qr_uuid, size) -> bytes PNG
+        self._mat_cache = LRU(cache_size)  # qr_uuid -> matriz de módulos
+        self.on_change = None  # (ev, tool_ids, inst_ids) tras cada commit; lo engancha InvApp
+        self.mirror = None  # espejo en memoria de tools/tool_inst (mirror.py); lo engancha InvApp
+        self.wk = None  # registro de trabajadores (workers.py); lo engancha InvApp
         self._init_db()
+        self.key = self._load_key()
+        self.pack = QRPack(conn, self.qr_dir, self.lock)
+        if any(LEGACY_RE.match(f) for f in os.listdir(self.qr_dir)):
+            self.pack.migrate_dir(self.qr_dir)
 
     def _init_db(self):
         self.c.executescript('''
@@ -122,6 +620,7 @@ class QRMgr:
             status TEXT,
             qr_uuid TEXT UNIQUE,
             img TEXT,
+            ord INTEGER,
             FOREIGN KEY (h_id) REFERENCES tools (id) ON DELETE CASCADE,
             FOREIGN KEY (tool_uuid) REFERENCES tools (tool_uuid) ON DELETE CASCADE
         );
@@ -129,6 +628,18 @@ class QRMgr:
         CREATE INDEX IF NOT EXISTS idx_ti_uuid ON tool_inst(tool_uuid);
         CREATE INDEX IF NOT EXISTS idx_loans_h_id ON loans(h_id);
         CREATE INDEX IF NOT EXISTS idx_rets_h_id ON rets(h_id);
+        CREATE INDEX IF NOT EXISTS idx_h_qr_i_id ON h_qr(i_id);
+        CREATE INDEX IF NOT EXISTS idx_h_qr_uuid ON h_qr(tool_uuid);
+        CREATE INDEX IF NOT EXISTS idx_loans_i_id ON loans(i_id);
+        CREATE INDEX IF NOT EXISTS idx_rets_i_id ON rets(i_id);
+        CREATE TABLE IF NOT EXISTS cfg (
+            k TEXT PRIMARY KEY,
+            v TEXT
+        );
+        CREATE TABLE IF NOT EXISTS qr_q (
+            i_id INTEGER PRIMARY KEY,
+            FOREIGN KEY (i_id) REFERENCES tool_inst (id) ON DELETE CASCADE
+        );
         ''')
         self.c.execute("PRAGMA table_info(tools)")
         cols = [col[1] for col in self.c.fetchall()]
@@ -140,101 +651,259 @@ class QRMgr:
         ]:
             if col not in cols:
                 self.c.execute(sql)
+        self.c.execute("PRAGMA table_info(tool_inst)")
+        if 'ord' not in [col[1] for col in self.c.fetchall()]:
+            # Ordinal numérico a partir del sufijo del serial (<tool_uuid>-NNN)
+            self.c.execute('ALTER TABLE tool_inst ADD COLUMN ord INTEGER')
+            self.c.execute('UPDATE tool_inst SET ord = CAST(substr(serial, length(tool_uuid) + 2) AS INTEGER)')
+        self.c.execute('CREATE INDEX IF NOT EXISTS idx_ti_ord ON tool_inst(h_id, ord)')
+        self.c.execute('CREATE INDEX IF NOT EXISTS idx_ti_status ON tool_inst(status)')  # COUNT de prestadas en get_stats
+        self.c.execute('CREATE INDEX IF NOT EXISTS idx_ti_pick ON tool_inst(h_id, status, serial)')  # find_insts
+        self.c.execute('CREATE INDEX IF NOT EXISTS idx_ti_pick_ord ON tool_inst(h_id, status, ord)')  # find_insts por ordinal
         self.conn.commit()
 
-    def gen_qr(self, tool_uuid: str, i_id: int, name: str) -> Optional[str]:
+    def _load_key(self) -> bytes:
+        # Clave HMAC por base de datos: las etiquetas solo validan contra su inv.db
+        self.c.execute(SQL["qr_key"])
+        r = self.c.fetchone()
+        if r:
+            return bytes.fromhex(r[0])
+        key = secrets.token_bytes(16)
+        self.c.execute(SQL["qr_key_add"], (key.hex(),))
+        self.conn.commit()
+        return key
+
+    def decode(self, payload: str) -> Optional[Dict[str, Any]]:
+        payload = payload.strip()
+        if payload.upper().startswith(QR_PREFIX):
+            try:
+                raw = base64.b32decode(payload[len(QR_PREFIX):].upper())
+            except ValueError:
+                return None
+            if len(raw) != 25 or raw[0] != QR_VER:
+                return None
+            sig = hmac.new(self.key, raw[:17], hashlib.sha256).digest()[:8]
+            if not hmac.compare_digest(sig, raw[17:]):
+                logger.warning("QR bad sig")
+                return None
+            return {"qr_uuid": str(uuid.UUID(bytes=raw[1:17]))}
+        # Etiquetas antiguas: JSON con tool_uuid/i_id
         try:
-            self.c.execute('SELECT qr_uuid, img FROM h_qr WHERE tool_uuid = ? AND i_id = ?', (tool_uuid, i_id))
-            existing = self.c.fetchone()
-            if existing and existing[1] and os.path.exists(existing[1]):
-                return existing[1]
-            qr_data = QRData(tool_uuid=tool_uuid, i_id=i_id, name=name)
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=qrcode.constants.ERROR_CORRECT_H,
-                box_size=10,
-                border=4
-            )
-            qr.add_data(qr_data.to_json())
+            data = json.loads(payload)
+        except ValueError:
+            return None
+        if not isinstance(data, dict) or not (data.get("tool_uuid") and data.get("i_id")):
+            return None
+        return {"tool_uuid": data["tool_uuid"], "i_id": data["i_id"], "qr_uuid": data.get("uuid")}
+
+    def matrix(self, qr_uuid: str) -> np.ndarray:
+        # Matriz de módulos (True = negro) con el borde incluido; se codifica una sola vez
+        m = self._mat_cache.get(qr_uuid)
+        if m is None:
+            qr = qrcode.QRCode(version=None, error_correction=self.ec, border=4)
+            qr.add_data(QRData(tool_uuid="", i_id=0, name="", uuid=qr_uuid).to_payload(self.key))
             qr.make(fit=True)
-            qr_img = qr.make_image(fill_color="black", back_color="white")
-            qr_file = f"qr_{tool_uuid}_{i_id}_{qr_data.uuid}.png"
-            qr_path = os.path.join(self.qr_dir, qr_file)
-            qr_img.save(qr_path)
-            if existing:
-                self.c.execute('UPDATE h_qr SET img = ? WHERE tool_uuid = ? AND i_id = ?', (qr_path, tool_uuid, i_id))
-            else:
-                self.c.execute(
-                    'INSERT INTO h_qr (tool_uuid, i_id, qr_uuid, date, img) VALUES (?, ?, ?, ?, ?)',
-                    (tool_uuid, i_id, qr_data.uuid, qr_data.date, qr_path)
-                )
+            m = np.array(qr.get_matrix(), dtype=bool)
+            self._mat_cache.put(qr_uuid, m)
+        return m
+
+    @staticmethod
+    def raster(m: np.ndarray, size: int) -> np.ndarray:
+        # Escalado vecino más cercano a cualquier tamaño sin pasar por PIL
+        idx = np.arange(size) * m.shape[0] // size
+        return np.where(m[idx[:, None], idx[None, :]], 0, 255).astype(np.uint8)
+
+    def qr_png(self, qr_uuid: str, size: Optional[int] = None, cache: bool = True) -> Optional[bytes]:
+        png = self._png_cache.get((qr_uuid, size))
+        if png is not None:
+            return png
+        png = self.pack.get(qr_uuid) if size is None else None
+        if png is not None:
+            if cache:
+                self._png_cache.put((qr_uuid, size), png)
+            return png
+        try:
+            m = self.matrix(qr_uuid)
+            ok, buf = cv2.imencode(".png", self.raster(m, size or m.shape[0] * 10))
+            if not ok:
+                return None
+            png = buf.tobytes()
+        except Exception as e:
+            logger.error("QR png err: %s", e)
+            return None
+        if cache:
+            self._png_cache.put((qr_uuid, size), png)
+        return png
+
+    def qr_b64(self, qr_uuid: str, size: Optional[int] = None) -> Optional[str]:
+        png = self.qr_png(qr_uuid, size)
+        return base64.b64encode(png).decode('utf-8') if png else None
+
+    @locked
+    def reg_qr(self, tool_uuid: str, i_id: int) -> Optional[str]:
+        # Registra en h_qr el qr_uuid vigente de la instancia; no renderiza ni escribe a disco
+        self.c.execute(SQL["inst_qr"], (i_id,))
+        r = self.c.fetchone()
+        if not r:
+            return None
+        self.c.execute(SQL["hqr_get"], (tool_uuid, i_id))
+        existing = self.c.fetchone()
+        if not existing:
+            self.c.execute(SQL["hqr_add"], (tool_uuid, i_id, r[0], _now(), None))
+        elif existing[0] != r[0]:
+            self.c.execute(SQL["hqr_upd"], (r[0], tool_uuid, i_id))
+            self.pack.drop(existing[0])
+        return r[0]
+
+    @locked
+    def gen_qr(self, tool_uuid: str, i_id: int, name: str) -> Optional[str]:
+        # Persiste el PNG a tamaño completo en el pack; devuelve el qr_uuid
+        try:
+            qr_uuid = self.reg_qr(tool_uuid, i_id)
+            if not qr_uuid:
+                return None
+            if not self.pack.has(qr_uuid):
+                png = self.qr_png(qr_uuid)
+                if not png:
+                    return None
+                self.pack.put(qr_uuid, png, commit=False)
             self.conn.commit()
-            return qr_path
+            return qr_uuid
         except Exception as e:
             logger.error("QR gen err: %s", e)
             return None
 
-    def read_qr(self, qr_json: str) -> Optional[Dict[str, Any]]:
+    @locked
+    def queue_qrs(self, h_id: int, after_ord: int):
+        # Alta en h_qr en bloque; el PNG para el pack queda en cola (qr_q)
+        self.c.execute(SQL["hqr_queue"], (_now(), h_id, after_ord))
+        self.c.execute(SQL["qr_q_add"], (h_id, after_ord))
+
+    @locked
+    def queue_missing(self) -> int:
+        # Encola las insts cuyo PNG no está en el pack; drain_qr_q lo renderiza y lo guarda una vez
+        self.c.execute(SQL["hqr_missing"], (_now(),))
+        self.c.execute(SQL["qr_q_missing"])
+        n = self.c.rowcount
+        self.conn.commit()
+        return n
+
+    def drain_qr_q(self, limit: int = 50) -> int:
+        # El render va fuera del lock: solo la lectura de la cola y la escritura al pack lo toman
         try:
-            data = json.loads(qr_json)
-            tool_uuid, i_id = data.get("tool_uuid"), data.get("i_id")
-            if not (tool_uuid and i_id):
-                return None
-            self.c.execute('''
-                SELECT h.id, h.name, h.resp, h.qty, h.img, h.status, h.is_consumable, ti.id, ti.serial, ti.status, ti.img
-                FROM tools h JOIN tool_inst ti ON h.tool_uuid = ti.tool_uuid
-                WHERE h.tool_uuid = ? AND ti.id = ?
-            ''', (tool_uuid, i_id))
-            r = self.c.fetchone()
-            if not r:
+            with self.lock:
+                self.c.execute(SQL["qr_q_next"], (limit,))
+                rows = self.c.fetchall()
+                todo = [r[1] for r in rows if not self.pack.has(r[1])]
+            pngs = [(qr_uuid, self.qr_png(qr_uuid, cache=False)) for qr_uuid in todo]
+            with self.lock:
+                for qr_uuid, png in pngs:
+                    if png:
+                        self.pack.put(qr_uuid, png, commit=False)
+                self.c.executemany(SQL["qr_q_del"], [(r[0],) for r in rows])
+                if len(rows) < limit:
+                    self.c.execute(SQL["qr_q_gc"])
+                self.conn.commit()
+                if len(rows) < limit:
+                    self.gc_qrs(force=False)  # cola vacía: buen momento para compactar
+            return len(rows)
+        except Exception as e:
+            logger.error("QR queue err: %s", e)
+            return 0
+
+    @locked
+    def gc_qrs(self, force: bool = True) -> Optional[Dict[str, int]]:
+        # Compacta el pack; sin force solo si pasa de GC_MIN con más de GC_DEAD muerto
+        if not force and (self.pack.size() < GC_MIN or self.pack.dead() < GC_DEAD):
+            return None
+        return self.pack.gc()
+
+    def read_qr(self, payload: str) -> Optional[Dict[str, Any]]:
+        try:
+            data = self.decode(payload)
+            if not data:
                 return None
-            return {
-                "id": r[0],
-                "name": r[1],
-                "resp": r[2],
-                "qty": r[3],
-                "img": r[4],
-                "status": r[5],
-                "is_consumable": bool(r[6]),
-                "i_id": r[7],
-                "serial": r[8],
-                "i_status": r[9],
-                "i_img": r[10],
-                "qr_uuid": data.get("uuid")
-            }
+            m = self.mirror
+            if m is not None:
+                # Acierto en el espejo: sin lock ni SQL; un fallo sigue por disco
+                i = m.inst(data["i_id"]) if "i_id" in data else m.inst_by_qr(data["qr_uuid"])
+                t = m.tool(i.h_id) if i is not None else None
+                if t is not None and ("i_id" not in data or t.tool_uuid == data["tool_uuid"]):
+                    return {
+                        "id": t.id,
+                        "name": t.name,
+                        "resp": t.resp,
+                        "qty": t.qty,
+                        "img": t.img,
+                        "status": t.status,
+                        "is_consumable": t.is_consumable,
+                        "i_id": i.id,
+                        "serial": i.serial,
+                        "i_status": i.status,
+                        "i_img": i.img,
+                        "qr_uuid": data.get("qr_uuid")
+                    }
+            with self.lock:
+                return self._read_qr(data)
         except Exception as e:
             logger.error("QR read err: %s", e)
             return None
 
+    def _read_qr(self, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if "i_id" not in data:
+            self.c.execute(SQL["read_qr"], (data["qr_uuid"],))
+        else:
+            self.c.execute(SQL["read_qr_json"], (data["tool_uuid"], data["i_id"]))
+        r = self.c.fetchone()
+        if not r:
+            return None
+        return {
+            "id": r[0],
+            "name": r[1],
+            "resp": r[2],
+            "qty": r[3],
+            "img": r[4],
+            "status": r[5],
+            "is_consumable": bool(r[6]),
+            "i_id": r[7],
+            "serial": r[8],
+            "i_status": r[9],
+            "i_img": r[10],
+            "qr_uuid": data.get("qr_uuid")
+        }
+
+    @locked
     def reg_ret(self, ret: RetData) -> bool:
         try:
-            self.c.execute(
-                'INSERT INTO rets (h_id, i_id, worker, date, notes) VALUES (?, ?, ?, ?, ?)',
-                (ret.h_id, ret.i_id, ret.worker, ret.date, ret.notes)
-            )
-            self.c.execute('UPDATE tool_inst SET status = "avail" WHERE id = ? AND h_id = ?', (ret.i_id, ret.h_id))
+            w_id, worker = self.wk.get_or_add(ret.worker) if self.wk else (None, ret.worker)
+            self.c.execute(SQL["ret_add"], (ret.h_id, ret.i_id, worker, w_id, ret.date, ret.notes))
+            self.c.execute(SQL["ret_inst"], (ret.i_id, ret.h_id))
+            self.c.execute(SQL["ret_close"], (ret.date, ret.i_id))
+            self.c.execute(SQL["ret_od"], (ret.i_id,))
             self.conn.commit()
+            if self.on_change:
+                self.on_change("ret", (), (ret.i_id,))
             return True
         except Exception as e:
             logger.error("Ret reg err: %s", e)
             return False
 
-    def get_stats(self, cache_secs: int = 60) -> Dict[str, Any]:
-        if hasattr(self, '_cache') and (dt.datetime.now() - self._cache_time).seconds < cache_secs:
-            return self._cache
+    @locked
+    def get_stats(self, cache_secs: int = 60, loc: Optional[int] = None) -> Dict[str, Any]:
+        # Cache por ubicación, como InvApp.get_tools; loc None = todo
+        hit = (getattr(self, '_cache', None) or {}).get(loc)
+        if hit and (dt.datetime.now() - hit[1]).seconds < cache_secs:
+            return hit[0]
         try:
-            self.c.execute('SELECT COUNT(*) FROM tool_inst WHERE status = "loaned"')
+            sfx, args = ("", ()) if loc is None else ("_loc", (loc,))
+            self.c.execute(SQL["stats_loaned" + sfx], args)
             loaned = self.c.fetchone()[0] or 0
-            self.c.execute('SELECT COUNT(*) FROM loans WHERE DATE(date) = DATE("now")')
+            today = dt.date.today().strftime("%Y-%m-%d")  # comparación directa: usa idx_*_date
+            self.c.execute(SQL["stats_loans" + sfx], (today, *args))
             loans_today = self.c.fetchone()[0] or 0
-            self.c.execute('SELECT COUNT(*) FROM rets WHERE DATE(date) = DATE("now")')
+            self.c.execute(SQL["stats_rets" + sfx], (today, *args))
             rets_today = self.c.fetchone()[0] or 0
-            self.c.execute('''
-                SELECT h.name, COUNT(l.id)
-                FROM loans l JOIN tools h ON l.h_id = h.id
-                GROUP BY h.id, h.name
-                ORDER BY COUNT(l.id) DESC LIMIT 5
-            ''')
+            self.c.execute(SQL["stats_pop" + sfx], args)
             pop_tools = [{"name": r[0], "loans": r[1]} for r in self.c.fetchall()]
             stats = {
                 "loaned": loaned,
@@ -243,7 +912,7 @@ class QRMgr:
                 "pop_tools": pop_tools,
                 "ts": dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             }
-            self._cache, self._cache_time = stats, dt.datetime.now()
+            self._cache = {**(getattr(self, '_cache', None) or {}), loc: (stats, dt.datetime.now())}
             return stats
         except Exception as e:
             logger.error("Stats err: %s", e)
@@ -256,15 +925,40 @@ class QRMgr:
             }
 
 class InvApp:
-    def __init__(self):
-        self.conn = sqlite3.connect('inv.db', check_same_thread=False)
+    def __init__(self, db: str = 'inv.db', img_dir: str = "tool_imgs", qr_dir: str = "qr_codes", qr_ec: str = "H",
+                 arch_dir: str = "archive", bk_dir: str = "backups", mirror_mb: float = 0, loc: Optional[str] = None):
+        self.conn = sqlite3.connect(db, check_same_thread=False)
+        self.conn.execute('PRAGMA foreign_keys = ON')  # ON DELETE CASCADE de insts, QRs, loans y rets
         self.c = self.conn.cursor()
+        self.lock = threading.RLock()
         self._init_db()
-        self.qr_mgr = QRMgr(self.conn)
-        self.img_dir = os.path.abspath("tool_imgs")
+        self.qr_mgr = QRMgr(self.conn, qr_dir, qr_ec, lock=self.lock)
+        self._purge_orphans()
+        self._migrate_loans()
+        self.feed = Feed()
+        self.qr_mgr.on_change = self._pub
+        self.an = Analytics(self.conn, self.lock)
+        self.od = OverdueSched(self.conn, self.lock, notify=self._od_notify)
+        self.wk = Workers(self.conn, self.lock)  # añade loans/rets.w_id: antes que los triggers de cdc
+        self.arch = Archiver(self.conn, arch_dir, self.lock)  # loans/rets cerrados > ARCH_MONTHS; copia w_id: tras Workers
+        self.qr_mgr.wk = self.wk
+        self.locs = Locations(self.conn, self.lock)  # añade tool_inst.loc_id: también antes que cdc
+        self.home = self.locs.get_or_add(loc) if loc else None  # ubicación de este kiosco; None = todas
+        self.conn.commit()
+        self.res = Reservations(self.conn, self.lock)  # sus triggers no pasan por cdc: no se replican
+        self.tl = Timeline(self.conn, self.lock)  # inst_edits: local, cada nodo anota lo que le llega
+        self.dd = Dedup(self.conn, self.lock)  # trigramas de nombres; su trigger toca reservations: tras Reservations
+        self.cdc = ChangeLog(self.conn, self.lock)  # tras las migraciones: los triggers copian todas las columnas
+        self.repl = Repl(self.conn, self.lock)
+        self.mirror = Mirror(self.conn, Tool, ToolInst, self.lock, mirror_mb)  # mirror_mb=0 (defecto): sin espejo
+        self.mirror.load()
+        self.qr_mgr.mirror = self.mirror
+        self.img_dir = os.path.abspath(img_dir)
         os.makedirs(self.img_dir, exist_ok=True)
-        self._cache = None
-        self._cache_time = None
+        self.bk = Backup(self.conn, bk_dir, {"tool_imgs": self.img_dir, "qr_codes": self.qr_mgr.qr_dir})
+        self._cache = None  # loc -> (ToolTable, hora de carga)
+        self._rollup = None  # se invalida en _pub, es decir en cada escritura
+        self._rollup_by = {}  # loc -> totales de get_rollup(loc=...), igual
 
     def _init_db(self):
         self.c.executescript('''
@@ -284,78 +978,201 @@ class InvApp:
             i_id INTEGER,
             worker TEXT,
             date TEXT,
+            due TEXT,
+            closed TEXT,
             FOREIGN KEY (h_id) REFERENCES tools (id) ON DELETE CASCADE,
             FOREIGN KEY (i_id) REFERENCES tool_inst (id) ON DELETE CASCADE
         );
+        CREATE TABLE IF NOT EXISTS consumes (
+            id INTEGER PRIMARY KEY,
+            h_id INTEGER,
+            qty INTEGER,
+            left INTEGER,
+            worker TEXT,
+            date TEXT,
+            FOREIGN KEY (h_id) REFERENCES tools (id) ON DELETE CASCADE
+        );
+        CREATE INDEX IF NOT EXISTS idx_consumes_h_id ON consumes(h_id, date);
         ''')
+        self.c.execute("PRAGMA table_info(tools)")
+        cols = [col[1] for col in self.c.fetchall()]
+        if 'reorder' not in cols:
+            self.c.execute('ALTER TABLE tools ADD COLUMN reorder INTEGER DEFAULT 0')
+        if 'loan_hrs' not in cols:
+            self.c.execute('ALTER TABLE tools ADD COLUMN loan_hrs INTEGER')  # NULL = OVERDUE_HRS
+        # Solo consumibles con umbral: low_stock() recorre este índice, no la tabla
+        self.c.execute('''
+            CREATE INDEX IF NOT EXISTS idx_tools_low ON tools(qty - reorder)
+            WHERE is_consumable = 1 AND reorder > 0
+        ''')
+        self.c.execute('CREATE INDEX IF NOT EXISTS idx_tools_cons ON tools(name) WHERE is_consumable = 1')  # tools_loc
+        self.conn.commit()
+
+    def _purge_orphans(self):
+        # Restos de cuando las FK no se aplicaban; se hace una vez por BD
+        self.c.execute('SELECT 1 FROM cfg WHERE k = "fk_clean"')
+        if self.c.fetchone():
+            return
+        for sql in (
+            'DELETE FROM tool_inst WHERE h_id NOT IN (SELECT id FROM tools)',
+            'DELETE FROM loans WHERE h_id NOT IN (SELECT id FROM tools) OR i_id NOT IN (SELECT id FROM tool_inst)',
+            'DELETE FROM rets WHERE h_id NOT IN (SELECT id FROM tools) OR i_id NOT IN (SELECT id FROM tool_inst)',
+            'DELETE FROM h_qr WHERE i_id NOT IN (SELECT id FROM tool_inst)',
+            'DELETE FROM qr_q WHERE i_id NOT IN (SELECT id FROM tool_inst)',
+        ):
+            self.c.execute(sql)
+            if self.c.rowcount:
+                logger.info("FK purge: %d rows (%s)", self.c.rowcount, sql.split()[2])
+        self.c.execute('INSERT INTO cfg (k, v) VALUES ("fk_clean", "1")')
+        self.conn.commit()
+
+    def _migrate_loans(self):
+        # due/closed en loans: el vencimiento y el cierre dejan de deducirse de tool_inst.status
+        self.c.execute("PRAGMA table_info(loans)")
+        if 'due' not in [col[1] for col in self.c.fetchall()]:
+            self.c.execute('ALTER TABLE loans ADD COLUMN due TEXT')
+            self.c.execute('ALTER TABLE loans ADD COLUMN closed TEXT')
+            self.c.execute('''
+                UPDATE loans SET due = datetime(date, '+' || COALESCE(
+                    (SELECT loan_hrs FROM tools WHERE id = loans.h_id), ?) || ' hours')
+            ''', (OVERDUE_HRS,))
+            # Abierto solo el último préstamo de cada inst que sigue prestada; el resto se da por cerrado
+            self.c.execute('''
+                UPDATE loans SET closed = date WHERE id NOT IN (
+                    SELECT MAX(l.id) FROM loans l JOIN tool_inst ti ON ti.id = l.i_id
+                    WHERE ti.status = "loaned" GROUP BY l.i_id
+                )
+            ''')
+        self.c.execute('CREATE INDEX IF NOT EXISTS idx_loans_due ON loans(due) WHERE closed IS NULL')
+        self.c.execute('CREATE INDEX IF NOT EXISTS idx_loans_open ON loans(i_id) WHERE closed IS NULL')
         self.conn.commit()
 
-    def add_tool(self, name: str, resp: str, qty: int, is_consumable: bool, img: Optional[str] = None) -> tuple[bool, str]:
+    @locked
+    def add_tool(self, name: str, resp: str, qty: int, is_consumable: bool, img: Optional[str] = None,
+                 loc: Optional[int] = None) -> tuple[bool, str]:
         try:
             if not name.strip() or not resp.strip() or qty < 0:
                 return False, "Invalid input"
             tool_uuid = str(uuid.uuid4())
             img_path = self._save_img(img) if img else None
-            self.c.execute('''
-                INSERT INTO tools (tool_uuid, name, resp, qty, is_consumable, img, status)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (tool_uuid, name, resp, qty, is_consumable, img_path, 'avail'))
+            self.c.execute(SQL["tool_add"], (tool_uuid, name, resp, qty, is_consumable, img_path, 'avail'))
             h_id = self.c.lastrowid
+            self.dd.put(h_id, name)
             if not is_consumable:
-                for i in range(qty):
-                    serial = f"{tool_uuid}-{i+1:03d}"
-                    self.c.execute('''
-                        INSERT INTO tool_inst (h_id, tool_uuid, serial, status, qr_uuid, img)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    ''', (h_id, tool_uuid, serial, 'avail', str(uuid.uuid4()), img_path))
-                    i_id = self.c.lastrowid
-                    self.qr_mgr.gen_qr(tool_uuid, i_id, name)
+                self._resize(h_id, tool_uuid, qty, img_path, loc)
             self.conn.commit()
             self._cache = None
+            self._pub("add", (h_id,))
             return True, f"Tool '{name}' added"
         except sqlite3.Error as e:
             return False, f"DB err: {str(e)}"
 
-    def consume_tool(self, id: int, qty: int) -> tuple[bool, str]:
-        try:
-            self.c.execute('SELECT name, qty, is_consumable FROM tools WHERE id = ?', (id,))
+    def _consume(self, id: int, qty: int, worker: str, date: str) -> tuple[Optional[str], Optional[str]]:
+        # Descuento atómico: la comprobación de stock va en el propio UPDATE, sin leer antes
+        self.c.execute(SQL["consume"], (qty, id, qty))
+        r = self.c.fetchone()
+        if not r:
+            self.c.execute(SQL["consume_chk"], (id,))
             r = self.c.fetchone()
             if not r:
-                return False, "Tool not found"
-            name, curr_qty, is_consumable = r
-            if not is_consumable:
-                return False, "Not consumable"
-            if qty <= 0 or qty > curr_qty:
-                return False, f"Invalid qty (max {curr_qty})"
-            new_qty = curr_qty - qty
-            self.c.execute('UPDATE tools SET qty = ? WHERE id = ?', (new_qty, id))
+                return None, "Tool not found"
+            return None, f"{r[0]}: not consumable" if not r[2] else f"{r[0]}: invalid qty (max {r[1]})"
+        self.c.execute(SQL["consume_add"], (id, qty, r[1], worker, date))
+        return r[0], None
+
+    @locked
+    def consume_tool(self, id: int, qty: int, worker: str = "") -> tuple[bool, str]:
+        if qty <= 0:
+            return False, "Invalid qty"
+        try:
+            name, err = self._consume(id, qty, worker, _now())
+            if err:
+                self.conn.rollback()
+                return False, err
             self.conn.commit()
             self._cache = None
+            self._pub("consume", (id,))
             return True, f"Consumed {qty} {name}"
         except sqlite3.Error as e:
+            self.conn.rollback()
             return False, f"DB err: {str(e)}"
 
-    def get_tools(self) -> List[Tool]:
-        if self._cache and self._cache_time and (dt.datetime.now() - self._cache_time).seconds < 60:
-            return self._cache
+    @locked
+    def consume_batch(self, items: List[tuple[int, int]], worker: str = "") -> tuple[bool, str]:
+        # Lista de picking [(h_id, qty), ...]: todo o nada en una transacción
+        want = {}
+        for id, qty in items:
+            want[id] = want.get(id, 0) + qty
+        if not want or any(q <= 0 for q in want.values()):
+            return False, "Invalid qty"
         try:
-            self.c.execute('''
-                SELECT id, tool_uuid, name, resp, qty, is_consumable, img, status
-                FROM tools ORDER BY name
-            ''')
-            tools = [Tool(id=r[0], tool_uuid=r[1], name=r[2], resp=r[3], qty=r[4], is_consumable=bool(r[5]), img=r[6], status=r[7]) for r in self.c.fetchall()]
-            self._cache, self._cache_time = tools, dt.datetime.now()
+            date = _now()
+            for id, qty in sorted(want.items()):
+                _, err = self._consume(id, qty, worker, date)
+                if err:
+                    self.conn.rollback()
+                    return False, err
+            self.conn.commit()
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            return False, f"DB err: {str(e)}"
+        self._cache = None
+        self._pub("consume", tuple(want))
+        return True, f"Consumed {sum(want.values())} units of {len(want)} tools"
+
+    @locked
+    def low_stock(self, limit: int = 100) -> List[Dict[str, Any]]:
+        try:
+            self.c.execute(SQL["low_stock"], (limit,))
+            return [{"id": r[0], "name": r[1], "resp": r[2], "qty": r[3], "reorder": r[4]} for r in self.c.fetchall()]
+        except sqlite3.Error as e:
+            logger.error("Low stock err: %s", e)
+            return []
+
+    @locked
+    def get_reorder(self, id: int) -> int:
+        self.c.execute(SQL["reorder"], (id,))
+        r = self.c.fetchone()
+        return r[0] or 0 if r else 0
+
+    @locked
+    def get_consumes(self, h_id: Optional[int] = None, limit: int = 200) -> List[tuple]:
+        try:
+            if h_id:
+                self.c.execute(SQL["consumes_tool"], (h_id, limit))
+            else:
+                self.c.execute(SQL["consumes"], (limit,))
+            return self.c.fetchall()
+        except sqlite3.Error as e:
+            logger.error("Consumes err: %s", e)
+            return []
+
+    @locked
+    def get_tools(self, loc: Optional[int] = None) -> ToolTable:
+        # Cache por ubicación (None = todas); self._cache = None las invalida todas
+        hit = (self._cache or {}).get(loc)
+        if hit and (dt.datetime.now() - hit[1]).seconds < 60:
+            return hit[0]
+        try:
+            if loc is None:
+                self.c.execute(SQL["tools"])
+            else:
+                self.c.execute(SQL["tools_loc"], (loc,))
+            tools = ToolTable(self.c)
+            self._cache = {**(self._cache or {}), loc: (tools, dt.datetime.now())}
             return tools
         except sqlite3.Error as e:
             logger.error("Get tools err: %s", e)
-            return []
+            return ToolTable()
 
     def get_tool(self, id: int) -> Optional[Tool]:
+        t = self.mirror.tool(id)
+        return t if t is not None else self._get_tool(id)
+
+    @locked
+    def _get_tool(self, id: int) -> Optional[Tool]:
         try:
-            self.c.execute('''
-                SELECT id, tool_uuid, name, resp, qty, is_consumable, img, status
-                FROM tools WHERE id = ?
-            ''', (id,))
+            self.c.execute(SQL["tool"], (id,))
             r = self.c.fetchone()
             return Tool(id=r[0], tool_uuid=r[1], name=r[2], resp=r[3], qty=r[4], is_consumable=bool(r[5]), img=r[6], status=r[7]) if r else None
         except sqlite3.Error as e:
@@ -363,78 +1180,265 @@ class InvApp:
             return None
 
     def get_inst(self, i_id: int) -> Optional[ToolInst]:
+        i = self.mirror.inst(i_id)
+        return i if i is not None else self._get_inst(i_id)
+
+    @locked
+    def _get_inst(self, i_id: int) -> Optional[ToolInst]:
         try:
-            self.c.execute('''
-                SELECT id, h_id, tool_uuid, serial, status, qr_uuid, img
-                FROM tool_inst WHERE id = ?
-            ''', (i_id,))
+            self.c.execute(SQL["inst"], (i_id,))
             r = self.c.fetchone()
             return ToolInst(*r) if r else None
         except sqlite3.Error as e:
             logger.error("Get inst err: %s", e)
             return None
 
-    def get_insts(self, h_id: int) -> List[ToolInst]:
+    @locked
+    def get_insts(self, h_id: int, loc: Optional[int] = None) -> List[ToolInst]:
+        if self.mirror.on:
+            return self.mirror.insts_of(h_id, loc)
         try:
-            self.c.execute('''
-                SELECT id, h_id, tool_uuid, serial, status, qr_uuid, img
-                FROM tool_inst WHERE h_id = ? ORDER BY serial
-            ''', (h_id,))
+            if loc is None:
+                self.c.execute(SQL["insts"], (h_id,))
+            else:
+                self.c.execute(SQL["insts_loc"], (loc, h_id))
             return [ToolInst(*r) for r in self.c.fetchall()]
         except sqlite3.Error as e:
             logger.error("Get insts err: %s", e)
             return []
 
-    def upd_tool(self, id: int, name: str, resp: str, qty: int, is_consumable: bool, img: Optional[str] = None) -> tuple[bool, str]:
+    @locked
+    def find_insts(self, h_id: int, q: str, status: Optional[str] = None, limit: int = PICK_N,
+                   loc: Optional[int] = None) -> List[ToolInst]:
+        # Primeras `limit` insts de h_id. q con dígitos (o vacío): por ordinal, como si fuera el
+        # sufijo NNN del serial; si no, prefijo de serial (el de la etiqueta, también el de una fundida)
         try:
-            if not name.strip() or not resp.strip() or qty < 0:
+            if q.isdigit() or not q:
+                self.c.execute(SQL["inst_top"], (h_id,))
+                top = self.c.fetchone()[0] or 0
+                out = []
+                for lo, hi in _ord_ranges(q, top):
+                    if status:
+                        self.c.execute(SQL["find_insts_ord"], (h_id, status, lo, hi, loc, loc, limit - len(out)))
+                    else:
+                        self.c.execute(SQL["find_insts_ord_any"], (h_id, lo, hi, loc, loc, limit - len(out)))
+                    out += [ToolInst(*r) for r in self.c.fetchall()]
+                    if len(out) >= limit:
+                        break
+                return out
+            hi = q[:-1] + chr(ord(q[-1]) + 1)
+            if status:
+                self.c.execute(SQL["find_insts"], (h_id, status, q, hi, loc, loc, limit))
+            else:
+                self.c.execute(SQL["find_insts_any"], (q, hi, h_id, loc, loc, limit))
+            return [ToolInst(*r) for r in self.c.fetchall()]
+        except sqlite3.Error as e:
+            logger.error("Find insts err: %s", e)
+            return []
+
+    @locked
+    def get_all_insts(self) -> InstTable:
+        try:
+            self.c.execute(SQL["all_insts"])
+            return InstTable(self.c)
+        except sqlite3.Error as e:
+            logger.error("Get all insts err: %s", e)
+            return InstTable()
+
+    @locked
+    def upd_tool(self, id: int, name: str, resp: str, qty: int, is_consumable: bool, img: Optional[str] = None,
+                 reorder: Optional[int] = None) -> tuple[bool, str]:
+        try:
+            if not name.strip() or not resp.strip() or qty < 0 or (reorder or 0) < 0:
                 return False, "Invalid input"
             curr = self.get_tool(id)
             if not curr:
                 return False, "Tool not found"
             img_path = self._save_img(img) if img else curr.img
-            self.c.execute('''
-                UPDATE tools
-                SET name = ?, resp = ?, qty = ?, is_consumable = ?, img = ?
-                WHERE id = ?
-            ''', (name, resp, qty, is_consumable, img_path, id))
-            if not is_consumable:
-                curr_insts = len(self.get_insts(id))
-                tool_uuid = curr.tool_uuid
-                if qty > curr_insts:
-                    for i in range(curr_insts + 1, qty + 1):
-                        serial = f"{tool_uuid}-{i:03d}"
-                        self.c.execute('''
-                            INSERT INTO tool_inst (h_id, tool_uuid, serial, status, qr_uuid, img)
-                            VALUES (?, ?, ?, ?, ?, ?)
-                        ''', (id, tool_uuid, serial, 'avail', str(uuid.uuid4()), img_path))
-                        self.qr_mgr.gen_qr(tool_uuid, self.c.lastrowid, name)
-                elif qty < curr_insts:
-                    self.c.execute('DELETE FROM tool_inst WHERE h_id = ? AND serial > ?', (id, f"{tool_uuid}-{qty:03d}"))
-            else:
-                self.c.execute('DELETE FROM tool_inst WHERE h_id = ?', (id,))
+            self.c.execute(SQL["tool_upd"], (name, resp, qty, is_consumable, img_path, reorder, id))
+            self.dd.put(id, name)
+            err = self._resize(id, curr.tool_uuid, 0 if is_consumable else qty, img_path)
+            if err:
+                self.conn.rollback()
+                return False, err
             self.conn.commit()
             self._cache = None
+            self._pub("upd", (id,))
             return True, "Tool updated"
         except sqlite3.Error as e:
             return False, f"DB err: {str(e)}"
 
+    def _resize(self, h_id: int, tool_uuid: str, qty: int, img_path: Optional[str], loc: Optional[int] = None) -> Optional[str]:
+        # Ajusta el número de instancias sin materializarlas; devuelve un error o None.
+        # Las nuevas van a loc, o a la ubicación del kiosco, o a la principal
+        self.c.execute(SQL["resize_n"], (h_id,))
+        n, top = self.c.fetchone()
+        if qty > n:
+            loc = loc or self.home or self.locs.main
+            self.c.executemany(SQL["resize_add"], [
+                (h_id, tool_uuid, f"{tool_uuid}-{o:03d}", 'avail', str(uuid.uuid4()), img_path, o, loc)
+                for o in range(top + 1, top + qty - n + 1)
+            ])
+            self.qr_mgr.queue_qrs(h_id, top)
+        elif qty < n:
+            # Solo se retiran instancias disponibles, del ordinal más alto hacia abajo
+            self.c.execute(SQL["resize_pick"], (h_id, n - qty))
+            rows = self.c.fetchall()
+            if len(rows) < n - qty:
+                return f"Cannot remove {n - qty} insts: {n - len(rows)} loaned"
+            # Un solo DELETE: 'now' del ts de changes se evalúa una vez por sentencia
+            ids_j = json.dumps([r[0] for r in rows])
+            self.c.execute(SQL["resize_del_qr"], (ids_j,))
+            self.c.execute(SQL["resize_del"], (ids_j,))
+            for _, qr_uuid in rows:
+                self.qr_mgr.pack.drop(qr_uuid)
+        return None
+
+    @locked
     def del_tool(self, id: int) -> tuple[bool, str]:
         try:
-            self.c.execute('SELECT name, img FROM tools WHERE id = ?', (id,))
+            self.c.execute(SQL["tool_del_get"], (id,))
             r = self.c.fetchone()
             if not r:
                 return False, "Tool not found"
             name, img = r
-            self.c.execute('DELETE FROM tools WHERE id = ?', (id,))
+            self.c.execute(SQL["tool_del"], (id,))
             self.conn.commit()
-            if img and os.path.exists(img):
-                os.remove(img)
             self._cache = None
+            self._pub("del", (id,))
+            if img:
+                POOL.submit(self._rm_files, [img])
             return True, f"Tool '{name}' deleted"
         except sqlite3.Error as e:
             return False, f"Del err: {str(e)}"
 
+    @locked
+    def bulk_del(self, ids: List[int]) -> tuple[bool, str]:
+        # Un DELETE para todo el lote; la cascada se lleva insts, h_qr, qr_q, loans y rets
+        if not ids:
+            return False, "No tools selected"
+        try:
+            ids_j = json.dumps(list(ids))
+            self.c.execute(SQL["bulk_imgs"], (ids_j,))
+            imgs = [r[0] for r in self.c.fetchall()]
+            self.c.execute(SQL["bulk_del"], (ids_j,))
+            n = self.c.rowcount
+            self.conn.commit()
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            return False, f"Del err: {str(e)}"
+        self._cache = None
+        self._pub("del", ids)
+        if imgs:
+            POOL.submit(self._rm_files, imgs)
+        return True, f"{n} tools deleted"
+
+    @locked
+    def bulk_upd(self, ids: List[int], status: Optional[str] = None, resp: Optional[str] = None,
+                 is_consumable: Optional[bool] = None) -> tuple[bool, str]:
+        # Todo o nada: si una herramienta no puede cambiar de tipo (insts prestadas) no se toca ninguna
+        sets = {k: v for k, v in (("status", status), ("resp", resp), ("is_consumable", is_consumable)) if v is not None}
+        if not ids or not sets:
+            return False, "Nothing to update"
+        if any(isinstance(v, str) and not v.strip() for v in sets.values()):
+            return False, "Invalid input"
+        try:
+            ids_j = json.dumps(list(ids))
+            if is_consumable is not None:
+                self.c.execute(SQL["bulk_flip"], (ids_j, int(is_consumable)))
+                for h_id, tool_uuid, name, qty, img in self.c.fetchall():
+                    err = self._resize(h_id, tool_uuid, 0 if is_consumable else qty, img)
+                    if err:
+                        self.conn.rollback()
+                        return False, f"{name}: {err}"
+            self.c.execute(SQL["bulk_upd"].format(sets=", ".join(f"{k} = ?" for k in sets)), (*sets.values(), ids_j))
+            n = self.c.rowcount
+            self.conn.commit()
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            return False, f"DB err: {str(e)}"
+        self._cache = None
+        self._pub("upd", ids)
+        return True, f"{n} tools updated"
+
+    def similar(self, name: str, skip: Optional[int] = None, limit: int = 5) -> List[Dict[str, Any]]:
+        # Posibles duplicados de `name` (similitud de trigramas >= dedup.SIM)
+        try:
+            return self.dd.similar(name, limit=limit, skip=skip)
+        except sqlite3.Error as e:
+            logger.error("Similar err: %s", e)
+            return []
+
+    @locked
+    def merge_tools(self, dst: int, src: List[int]) -> tuple[bool, str]:
+        # Funde src en dst en una transacción: insts (con sus loans, rets, reservas y QR), consumos,
+        # stock, cubos de analítica e historial archivado pasan a dst; luego se borran las de src
+        src = [h for h in dict.fromkeys(src) if h != dst]
+        if not src:
+            return False, "Nothing to merge"
+        try:
+            self.c.execute(SQL["merge_get"], (json.dumps([dst, *src]),))
+            rows = {r[0]: r[1:] for r in self.c.fetchall()}
+            if dst not in rows or len(rows) < len(src) + 1:
+                return False, "Tool not found"
+            d_uuid, d_name, _, d_cons, img = rows[dst]
+            if any(rows[h][3] != d_cons for h in src):
+                return False, "Cannot merge consumable and reusable tools"
+            imgs = [rows[h][4] for h in src if rows[h][4]]
+            if not img and imgs:
+                img = imgs.pop(0)  # dst sin imagen: se queda la primera de src
+            self.c.execute(SQL["resize_n"], (dst,))
+            top = self.c.fetchone()[1]
+            for h in src:
+                if d_cons:
+                    self.c.execute(SQL["merge_cons"], (dst, h))
+                    continue
+                self.c.execute(SQL["resize_n"], (h,))
+                top_h = self.c.fetchone()[1]
+                self.c.execute(SQL["merge_qr"], (d_uuid, rows[h][0]))
+                self.c.execute(SQL["merge_insts"], (dst, d_uuid, top, img, h))
+                top += top_h
+            self.c.execute(SQL["merge_dst"], (sum(rows[h][2] for h in src), img, dst))
+            self.an.repoint(src, dst)
+            self.arch.repoint(src, dst)
+            self.c.execute(SQL["bulk_del"], (json.dumps(src),))
+            self.conn.commit()
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            logger.error("Merge err: %s", e)
+            return False, f"Merge err: {str(e)}"
+        self._cache = None
+        self.qr_mgr._cache = None
+        self._pub("del", src)
+        self._pub("upd", (dst,))
+        if imgs:
+            POOL.submit(self._rm_files, imgs)
+        return True, f"{len(src)} merged into '{d_name}'"
+
+    @staticmethod
+    def _rm_files(paths: List[str]):
+        for p in paths:
+            try:
+                if os.path.exists(p):
+                    os.remove(p)
+            except OSError as e:
+                logger.error("Rm file err: %s", e)
+
+    def _pub(self, ev: str, tool_ids=(), inst_ids=()):
+        # Tras el commit (con el lock tomado): solo las filas tocadas van al feed
+        self.mirror.sync()
+        if ev in ("loan", "ret"):
+            self.qr_mgr._cache = None
+        self._rollup = None
+        self._rollup_by = {}
+        if not len(self.feed):
+            return
+        self.feed.publish(Delta(
+            frozenset((ev,)),
+            {id: None if ev == "del" else self.get_tool(id) for id in tool_ids},
+            {i_id: self.get_inst(i_id) for i_id in inst_ids}
+        ))
+
     def _save_img(self, img_path: Optional[str]) -> Optional[str]:
         if not img_path or not os.path.exists(img_path):
             return None
@@ -447,58 +1451,320 @@ class InvApp:
             logger.error("Save img err: %s", e)
             return None
 
+    @locked
     def regen_qr(self, tool_uuid: str, i_id: int, name: str) -> Optional[str]:
         try:
-            self.c.execute('DELETE FROM h_qr WHERE tool_uuid = ? AND i_id = ?', (tool_uuid, i_id))
-            qr_path = self.qr_mgr.gen_qr(tool_uuid, i_id, name)
-            if qr_path:
-                self.c.execute('UPDATE tool_inst SET qr_uuid = ? WHERE id = ?', (str(uuid.uuid4()), i_id))
+            # Nuevo qr_uuid primero: la etiqueta codifica el qr_uuid de la instancia
+            self.c.execute(SQL["hqr_get"], (tool_uuid, i_id))
+            for (old,) in self.c.fetchall():
+                self.qr_mgr.pack.drop(old)
+            self.c.execute(SQL["hqr_del"], (tool_uuid, i_id))
+            self.c.execute(SQL["regen_inst"], (str(uuid.uuid4()), i_id))
+            qr_uuid = self.qr_mgr.reg_qr(tool_uuid, i_id)
+            if qr_uuid:
                 self.conn.commit()
-                return qr_path
+                self._pub("qr", (), (i_id,))
+                return qr_uuid
+            self.conn.rollback()
             return None
         except Exception as e:
             logger.error("Regen QR err: %s", e)
             return None
 
+    @locked
     def reg_loan(self, h_id: int, i_id: int, worker: str) -> bool:
         try:
             if not worker.strip():
                 return False
-            date = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            self.c.execute('''
-                INSERT INTO loans (h_id, i_id, worker, date)
-                VALUES (?, ?, ?, ?)
-            ''', (h_id, i_id, worker, date))
-            self.c.execute('UPDATE tool_inst SET status = "loaned" WHERE id = ? AND h_id = ?', (i_id, h_id))
+            now = dt.datetime.now()
+            self.c.execute(SQL["loan_hrs"], (OVERDUE_HRS, h_id))
+            r = self.c.fetchone()
+            if not r:
+                return False
+            due = (now + dt.timedelta(hours=r[0])).strftime("%Y-%m-%d %H:%M:%S")
+            w_id, worker = self.wk.get_or_add(worker)
+            # No se presta si choca con la reserva de otro antes del vencimiento
+            busy = self.res.clash(i_id, now.strftime("%Y-%m-%d %H:%M:%S"), due, w_id) if w_id else []
+            if busy:
+                self.conn.rollback()
+                logger.error("Loan reg err: reserved by %s from %s", busy[0]["worker"], busy[0]["start"])
+                return False
+            self.c.execute(SQL["loan_add"], (h_id, i_id, worker, w_id, now.strftime("%Y-%m-%d %H:%M:%S"), due))
+            self.c.execute(SQL["loan_inst"], (i_id, h_id))
             self.conn.commit()
+            self._pub("loan", (), (i_id,))
             return True
         except sqlite3.Error as e:
             logger.error("Loan reg err: %s", e)
             return False
 
-    def check_overdue(self) -> List[Dict[str, Any]]:
+    @locked
+    def set_loan_policy(self, h_id: int, hrs: Optional[int]) -> tuple[bool, str]:
+        # Plazo por herramienta (None = OVERDUE_HRS); se aplica también a sus préstamos abiertos
+        if hrs is not None and hrs <= 0:
+            return False, "Invalid hrs"
+        try:
+            self.c.execute(SQL["policy_set"], (hrs, h_id))
+            if not self.c.rowcount:
+                return False, "Tool not found"
+            self.c.execute(SQL["policy_due"], (hrs or OVERDUE_HRS, h_id))
+            self.od.resync(h_id)
+            self.conn.commit()
+            return True, "Policy updated"
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            return False, f"DB err: {str(e)}"
+
+    @locked
+    def get_loan_policy(self, h_id: int) -> Optional[int]:
+        self.c.execute(SQL["policy"], (h_id,))
+        r = self.c.fetchone()
+        return r[0] if r else None
+
+    def _od_notify(self, batch: List[Dict[str, Any]]):
+        self.feed.publish(Delta(frozenset(("overdue",)), note=f"{len(batch)} loans overdue: " + ", ".join(
+            f"{o['tool']} ({o['worker']})" for o in batch[:5]) + (" ..." if len(batch) > 5 else "")))
+
+    @locked
+    def get_hist(self, limit: int = 200, all_years: bool = False) -> List[tuple]:
+        # all_years: incluye los rets archivados (vista rets_all)
+        try:
+            self.c.execute(SQL["hist"].format(src="rets_all" if all_years else "rets"), (limit,))
+            return self.c.fetchall()
+        except sqlite3.Error as e:
+            logger.error("Hist err: %s", e)
+            return []
+
+    @locked
+    def get_rollup(self, resp: Optional[str] = None, loc: Optional[int] = None) -> Dict[str, Any]:
+        # Totales agregados en SQL: qty, reutilizables/consumibles, insts por estado, y lo mismo por responsable.
+        # Con loc, solo lo de esa ubicación (cacheado aparte en _rollup_by)
+        tot = self._rollup if loc is None else self._rollup_by.get(loc)
+        if tot is None:
+            try:
+                sfx, args = ("", ()) if loc is None else ("_loc", (loc,))
+                empty = lambda: {"tools": 0, "reusable": 0, "consumable": 0, "qty": 0, "insts": {}}
+                tot, by_resp = empty(), {}
+                self.c.execute(SQL["rollup_tools" + sfx], args)
+                for r, cons, n, qty in self.c.fetchall():
+                    for d in (tot, by_resp.setdefault(r, empty())):
+                        d["tools"] += n
+                        d["consumable" if cons else "reusable"] += n
+                        d["qty"] += qty
+                self.c.execute(SQL["rollup_insts" + sfx], args)
+                for r, status, n in self.c.fetchall():
+                    for d in (tot, by_resp.setdefault(r, empty())):
+                        d["insts"][status] = d["insts"].get(status, 0) + n
+                tot["by_resp"] = by_resp
+                tot["ts"] = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                if loc is None:
+                    self._rollup = tot
+                else:
+                    self._rollup_by[loc] = tot
+            except sqlite3.Error as e:
+                logger.error("Rollup err: %s", e)
+                return {"tools": 0, "reusable": 0, "consumable": 0, "qty": 0, "insts": {}, "by_resp": {}}
+        if resp is not None:
+            return tot["by_resp"].get(resp, {"tools": 0, "reusable": 0, "consumable": 0, "qty": 0, "insts": {}})
+        return tot
+
+    def maint(self):
+        # Mantenimiento en segundo plano: primero cubos, luego archivo (solo días ya en cubos) y el
+        # pack de QR si tiene mucho sustituido. Se reprograma cada 24 h; cada lote de archivo toma el lock unos ms.
+        try:
+            self.an.refresh()
+            self.arch.archive(ARCH_MONTHS)
+            self.qr_mgr.gc_qrs(force=False)
+        except (sqlite3.Error, OSError) as e:
+            logger.error("Maint err: %s", e)
+        t = threading.Timer(86400, POOL.submit, (self.maint,))
+        t.daemon = True
+        t.start()
+
+    def find_workers(self, prefix: str, limit: int = PICK_N) -> List[Dict[str, Any]]:
+        try:
+            return self.wk.find(prefix, limit)
+        except sqlite3.Error as e:
+            logger.error("Find workers err: %s", e)
+            return []
+
+    def worker_loans(self, w_id: int) -> List[Dict[str, Any]]:
+        # Lo que tiene ahora mismo (idx_loans_w_open), por vencimiento
+        try:
+            return self.wk.open_loans(w_id)
+        except sqlite3.Error as e:
+            logger.error("Worker loans err: %s", e)
+            return []
+
+    def worker_hist(self, w_id: int, limit: int = 50) -> List[Dict[str, Any]]:
+        try:
+            return self.wk.hist(w_id, limit)
+        except sqlite3.Error as e:
+            logger.error("Worker hist err: %s", e)
+            return []
+
+    def get_locs(self) -> List[Dict[str, Any]]:
+        try:
+            return self.locs.all()
+        except sqlite3.Error as e:
+            logger.error("Get locs err: %s", e)
+            return []
+
+    @locked
+    def add_loc(self, name: str, kind: str = "warehouse") -> tuple[bool, str]:
+        name = " ".join(name.split())
+        if not name or kind not in LOC_KINDS:
+            return False, "Invalid input"
+        try:
+            if self.locs.get(name):
+                return False, "Location exists"
+            self.locs.get_or_add(name, kind)
+            self.conn.commit()
+            return True, f"Location '{name}' added"
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            return False, f"DB err: {str(e)}"
+
+    @locked
+    def transfer(self, i_ids: List[int], dst: int, worker: str, notes: str = "") -> tuple[bool, str]:
+        # Cambio de ubicación + evento en transfers, en una transacción; las prestadas no se mueven
+        if not i_ids or not worker.strip():
+            return False, "Insts/worker required"
+        try:
+            self.c.execute(SQL["xfer_loaned"], (json.dumps(i_ids),))
+            if self.c.fetchone()[0]:
+                return False, "Return loaned insts first"
+            n = self.locs.move(i_ids, dst, worker.strip(), _now(), notes.strip())
+            self.conn.commit()
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            return False, f"DB err: {str(e)}"
+        self._cache = None
+        self.qr_mgr._cache = None
+        if n:
+            # Las herramientas pueden entrar o salir de la lista de una ubicación
+            self._pub("move", {i.h_id for i in map(self.get_inst, i_ids) if i}, i_ids)
+        return True, f"{n} moved"
+
+    def transfers_of(self, i_id: int, limit: int = 50) -> List[Dict[str, Any]]:
+        try:
+            return self.locs.of_inst(i_id, limit)
+        except sqlite3.Error as e:
+            logger.error("Transfers err: %s", e)
+            return []
+
+    def timeline(self, i_id: int, cur: Optional[tuple] = None, limit: int = TL_PAGE) -> tuple[List[Dict[str, Any]], Optional[tuple]]:
+        # Página de historial de una inst (recientes primero) y cursor de la siguiente; con años
+        # archivados adjuntos, sus loans/rets también (quién tuvo la inst, sin límite de ARCH_MONTHS)
+        try:
+            return self.tl.page(i_id, cur, limit, all_years=bool(self.arch.years))
+        except sqlite3.Error as e:
+            logger.error("Timeline err: %s", e)
+            return [], None
+
+    def transfers_at(self, loc: int, limit: int = 100) -> List[Dict[str, Any]]:
+        try:
+            return self.locs.of_loc(loc, limit)
+        except sqlite3.Error as e:
+            logger.error("Transfers err: %s", e)
+            return []
+
+    @locked
+    def insts_at(self, h_id: int, loc: int) -> int:
+        self.c.execute(SQL["insts_at"], (loc, h_id))
+        return self.c.fetchone()[0]
+
+    @locked
+    def insts_at_loc(self, loc: int) -> Dict[int, int]:
+        # h_id -> insts en loc; las tarjetas muestran esto y no tools.qty, que es el total
+        try:
+            self.c.execute(SQL["insts_at_loc"], (loc,))
+            return dict(self.c.fetchall())
+        except sqlite3.Error as e:
+            logger.error("Insts at err: %s", e)
+            return {}
+
+    @locked
+    def reserve(self, h_id: int, i_id: int, worker: str, start: str, end: str, notes: str = "") -> tuple[bool, str]:
+        s, e = norm_ts(start), norm_ts(end)
+        if not worker.strip():
+            return False, "Worker required"
+        if not s or not e or s >= e:
+            return False, "Invalid dates"
+        try:
+            w_id, worker = self.wk.get_or_add(worker)
+            r_id, why = self.res.add(h_id, i_id, worker, w_id, s, e, notes.strip())
+            if r_id is None:
+                self.conn.rollback()
+                return False, why
+            self.conn.commit()
+            self._pub("res", (), (i_id,))
+            return True, "Reserved"
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            return False, f"DB err: {str(e)}"
+
+    @locked
+    def cancel_res(self, r_id: int) -> tuple[bool, str]:
+        try:
+            if not self.res.cancel(r_id):
+                return False, "Reservation not found"
+            self.conn.commit()
+            self._pub("res")
+            return True, "Cancelled"
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            return False, f"DB err: {str(e)}"
+
+    def free_insts(self, h_id: int, start: str, end: str) -> List[Dict[str, Any]]:
+        # Instancias libres de h_id en [start, end): sin reserva solapada ni préstamo abierto
+        s, e = norm_ts(start), norm_ts(end)
+        if not s or not e or s >= e:
+            return []
+        try:
+            return self.res.free(h_id, s, e)
+        except sqlite3.Error as e:
+            logger.error("Free insts err: %s", e)
+            return []
+
+    def get_res(self, h_id: int, limit: int = 100) -> List[Dict[str, Any]]:
+        # Reservas activas de h_id que aún no han terminado
+        try:
+            return self.res.of_tool(h_id, dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), limit)
+        except sqlite3.Error as e:
+            logger.error("Get res err: %s", e)
+            return []
+
+    def changes_since(self, seq: int, limit: int = 1000) -> List[Dict[str, Any]]:
+        return self.cdc.since(seq, limit)
+
+    def sync_out(self, path: str, peer: str) -> Optional[Dict[str, Any]]:
+        try:
+            return self.repl.export(path, peer)
+        except (sqlite3.Error, OSError) as e:
+            logger.error("Sync out err: %s", e)
+            return None
+
+    @locked
+    def sync_in(self, path: str) -> Optional[Dict[str, Any]]:
         try:
-            limit = (dt.datetime.now().astimezone() - dt.timedelta(days=1)).strftime("%Y-%m-%d %H:%M:%S")
-            self.c.execute('''
-                SELECT l.id, h.name, ti.serial, l.worker, l.date
-                FROM loans l
-                JOIN tools h ON l.h_id = h.id
-                JOIN tool_inst ti ON l.i_id = ti.id
-                WHERE l.date < ? AND ti.status = "loaned"
-            ''', (limit,))
-            return [
-                {
-                    "id": r[0],
-                    "tool": r[1],
-                    "serial": r[2],
-                    "worker": r[3],
-                    "date": r[4],
-                    "hrs_overdue": round(
-                        (dt.datetime.now() - dt.datetime.strptime(r[4], "%Y-%m-%d %H:%M:%S")).total_seconds() / 3600, 2
-                    )
-                } for r in self.c.fetchall()
-            ]
-        except Exception as e:
+            res = self.repl.apply(path)
+        except (sqlite3.Error, OSError, ValueError) as e:
+            logger.error("Sync in err: %s", e)
+            return None
+        self.wk.link()  # los loans/rets llegados no traen w_id
+        self.locs.fill()  # insts nuevas de un nodo sin ubicaciones
+        self.dd.fill()  # herramientas llegadas o renombradas
+        self._cache = None
+        self.qr_mgr._cache = None
+        self._pub("sync", res["tools"])
+        return res
+
+    def check_overdue(self, loc: Optional[int] = None) -> List[Dict[str, Any]]:
+        # Lee la cola que mantiene OverdueSched; no recorre loans
+        try:
+            return self.od.queue(loc=loc)
+        except sqlite3.Error as e:
             logger.error("Overdue err: %s", e)
             return []
 
@@ -507,26 +1773,66 @@ class InvApp:
             with open(fname, 'w', newline='', encoding='utf-8') as f:
                 w = csv.writer(f)
                 w.writerow(['ID', 'UUID', 'Name', 'Resp', 'Qty', 'Consumable', 'Status', 'Img', 'Insts'])
-                for t in self.get_tools():
-                    insts = len(self.get_insts(t.id)) if not t.is_consumable else 0
+                with self.lock:
+                    self.c.execute(SQL["csv_counts"])
+                    counts = dict(self.c.fetchall())
+                for id, tool_uuid, name, resp, qty, is_consumable, img, status in self.get_tools().rows():
                     w.writerow([
-                        t.id,
-                        t.tool_uuid,
-                        t.name,
-                        t.resp,
-                        t.qty,
-                        'Yes' if t.is_consumable else 'No',
-                        t.status,
-                        t.img or '',
-                        insts
+                        id,
+                        tool_uuid,
+                        name,
+                        resp,
+                        qty,
+                        'Yes' if is_consumable else 'No',
+                        status,
+                        img or '',
+                        counts.get(id, 0) if not is_consumable else 0
                     ])
             return True
         except IOError as e:
             logger.error("CSV err: %s", e)
             return False
 
+    def backup(self) -> Optional[Dict[str, Any]]:
+        # En caliente y sin self.lock: la API de backup va por pasos y reintenta si conn está escribiendo
+        try:
+            return self.bk.snapshot()
+        except (sqlite3.Error, OSError) as e:
+            logger.error("Backup err: %s", e)
+            return None
+
+    def exp_qrs(self, zip_path: str) -> bool:
+        try:
+            # Lo que no esté en el pack se guarda ahora: la siguiente exportación solo lee
+            self.qr_mgr.queue_missing()
+            while self.qr_mgr.drain_qr_q():
+                pass
+            # PNG ya va comprimido: ZIP_STORED y sin pasar por qr_codes/
+            with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_STORED) as z:
+                for i in self.get_all_insts():
+                    png = self.qr_mgr.qr_png(i.qr_uuid, cache=False)
+                    if png:
+                        z.writestr(f"qr_{i.tool_uuid}_{i.id}_{i.qr_uuid}.png", png)
+            return True
+        except (IOError, zipfile.BadZipFile) as e:
+            logger.error("QRs exp err: %s", e)
+            return False
+
+_APP = None
+_APP_LOCK = threading.Lock()
+
+def get_app() -> InvApp:
+    # Una sola InvApp (conexión, caches, pack de QR y feed) para todas las sesiones del proceso
+    global _APP
+    with _APP_LOCK:
+        if _APP is None:
+            _APP = InvApp(mirror_mb=MIRROR_MB)  # la UI pide el espejo; scripts y repl.py no lo cargan
+            POOL.submit(_APP.maint)  # cubos diarios hasta ayer, luego archivo
+            _APP.od.start()
+        return _APP
+
 def main(page: ft.Page):
-    app = InvApp()
+    app = get_app()
     page.title = "Inv Crisoull v2.3"
     page.theme_mode = ft.ThemeMode.LIGHT
     page.window.width = 900
@@ -534,11 +1840,12 @@ def main(page: ft.Page):
     page.scroll = ft.ScrollMode.AUTO
     selected_tools = {}  # Diccionario para rastrear herramientas seleccionadas
     current_user_role = None  # To store the logged-in user's role
+    current_user = ""
 
     def launch_dashboard():
         def run_dashboard():
             from dashboard import dashboard_app
-            ft.app(target=dashboard_app, port=0)  # Use port=0 to let Flet assign a free port
+            ft.app(target=lambda p: dashboard_app(p, app.an), port=0)  # Use port=0 to let Flet assign a free port
         threading.Thread(target=run_dashboard, daemon=True).start()
 
     def confirm(msg="¿Sure?"):
@@ -585,11 +1892,12 @@ def main(page: ft.Page):
     login_btn = ft.ElevatedButton("Login", on_click=lambda e: login())
 
     def login():
-        nonlocal current_user_role
+        nonlocal current_user_role, current_user
         username = username_inp.value.strip()
         password = password_inp.value.strip()
         if username in USERS and USERS[username]["password"] == password:
             current_user_role = USERS[username]["role"]
+            current_user = username
             toast(f"Welcome, {username} ({current_user_role})")
             show_main_ui()
         else:
@@ -611,10 +1919,22 @@ def main(page: ft.Page):
         c_inp = ft.Switch(label="Consumable", value=False)
         img_inp = ft.FilePicker(on_result=lambda e: add_img(e))
         s_inp = ft.TextField(label="Search", expand=1, prefix_icon=icons.SEARCH)
+        dup_txt = ft.Text(size=12, color=ft.colors.ORANGE_700, visible=False)  # posibles duplicados del nombre en n_inp
         loan_txt = ft.Text(size=20)
         tot_txt = ft.Text(size=20)
         stat_txt = ft.Text(value="Stats...", size=14, font_family="Roboto Mono")
         hist_cont = ft.ListView(expand=True, spacing=5, padding=10)
+        prog = ft.ProgressBar(width=200, visible=False)
+        prog_txt = ft.Text(size=12, italic=True)
+        busy = {}  # tarea en curso -> mensaje
+        pending = set()  # partes de la UI a refrescar en el próximo flush
+        pend_d = None  # deltas del feed aún sin aplicar
+        cards = {}  # tool id -> tarjeta en tools_row
+        NO_TOOLS = object()  # data del texto "No tools"; las tarjetas llevan el nombre (orden de SQL["tools"])
+        inst_txts = {}  # i_id -> texto de estado en el detalle abierto
+        flush_t = None
+        ui_lock, flush_lock = threading.Lock(), threading.Lock()
+        cur_loc = app.home  # ubicación de la sesión: listas, stats y vencidos solo de ella; None = todas
 
         # Disable inputs for worker role
         if current_user_role == "worker":
@@ -623,6 +1943,84 @@ def main(page: ft.Page):
             q_inp.disabled = True
             c_inp.disabled = True
 
+        def set_busy(key, msg=None):
+            with ui_lock:
+                if msg:
+                    busy[key] = msg
+                else:
+                    busy.pop(key, None)
+                prog.visible = bool(busy)
+                prog_txt.value = next(iter(busy.values()), "")
+            page.update()
+
+        def bg(work, done=None, msg=None):
+            # SQL/E/S en el pool; done(res) aplica el resultado a la UI al terminar
+            key = object()
+            if msg:
+                set_busy(key, msg)
+            def run():
+                try:
+                    res = work()
+                except Exception as e:
+                    logger.error("Bg err: %s", e)
+                    toast(f"Err: {str(e)}", ft.colors.RED_400)
+                    return
+                finally:
+                    if msg:
+                        set_busy(key)
+                if done:
+                    done(res)
+            POOL.submit(run)
+
+        def refresh(*parts):
+            # Junta refrescos seguidos (tools, loans, tot, hist, stats) en una carga y un page.update()
+            nonlocal flush_t
+            with ui_lock:
+                pending.update(parts)
+                if flush_t is None:
+                    flush_t = threading.Timer(0.05, lambda: POOL.submit(flush))
+                    flush_t.daemon = True
+                    flush_t.start()
+
+        def debounce(fn, secs=0.25):
+            # fn(*args) solo cuando dejan de llegar llamadas durante `secs` (p.ej. una por tecla)
+            t, lock = None, threading.Lock()
+            def call(*args):
+                nonlocal t
+                with lock:
+                    if t is not None:
+                        t.cancel()
+                    t = threading.Timer(secs, fn, args)
+                    t.daemon = True
+                    t.start()
+            return call
+
+        def flush():
+            nonlocal flush_t, pend_d
+            with flush_lock:
+                with ui_lock:
+                    parts, d = set(pending), pend_d
+                    pending.clear()
+                    flush_t, pend_d = None, None
+                filt = s_inp.value.strip() if s_inp.value else None
+                if "tools" in parts:
+                    upd_tools(filt)
+                elif d is not None:
+                    apply_delta(d, filt)
+                if "loans" in parts:
+                    upd_loans()
+                if "tot" in parts:
+                    calc_tot()
+                if "hist" in parts:
+                    upd_hist()
+                if "stats" in parts:
+                    upd_stats()
+                page.update()
+
+        def drain_qrs():
+            while app.qr_mgr.drain_qr_q():
+                pass
+
         def add_img(e):
             nonlocal img_sel
             if current_user_role == "worker":
@@ -633,98 +2031,154 @@ def main(page: ft.Page):
 
         def upd_tools(filt=None):
             tools_row.controls.clear()
+            cards.clear()
             selected_tools.clear()  # Reset selection
             try:
-                tools = app.get_tools()
+                tools = app.get_tools(cur_loc)
                 if filt:
-                    tools = [t for t in tools if filt.lower() in t.name.lower()]
+                    tools = tools.filter(filt)
                 if not tools:
-                    tools_row.controls.append(ft.Text("No tools", italic=True))
+                    tools_row.controls.append(ft.Text("No tools", italic=True, data=NO_TOOLS))
+                here = app.insts_at_loc(cur_loc) if cur_loc else None
                 for t in tools:
-                    img_path = t.img if t.img and os.path.exists(t.img) else None
-                    img_w = ft.Image(
-                        src=img_path,
-                        width=50,
-                        height=50,
-                        fit=ft.ImageFit.CONTAIN
-                    ) if img_path else ft.Icon(icons.IMAGE_NOT_SUPPORTED)
-                    insts = app.get_insts(t.id) if not t.is_consumable else []
-                    chk = ft.Checkbox(
-                        value=False,
-                        on_change=lambda e, t_id=t.id: toggle_select(t_id, e.control.value),
-                        disabled=current_user_role == "worker"  # Workers can't select tools for bulk actions
-                    )
-                    tools_row.controls.append(
-                        ft.Card(
-                            content=ft.Container(
-                                content=ft.Column([
-                                    ft.Row([
-                                        chk,
-                                        img_w,
-                                        ft.ListTile(
-                                            title=ft.Text(
-                                                f"{t.name} (ID: {t.id})",
-                                                size=16,
-                                                weight="bold"
-                                            ),
-                                            subtitle=ft.Text(
-                                                f"Resp: {t.resp}\nQty: {t.qty}\nStatus: {t.status}\nType: {'Consumable' if t.is_consumable else 'Reusable'}\nInsts: {len(insts) if not t.is_consumable else 'N/A'}"
-                                            )
-                                        )
-                                    ]),
-                                    ft.Row([
-                                        ft.IconButton(
-                                            icons.VISIBILITY,
-                                            on_click=lambda _, t=t: show_tool(t),
-                                            tooltip="View"
-                                        ),
-                                        ft.IconButton(
-                                            icons.EDIT,
-                                            on_click=lambda _, t=t: edit_tool(t),
-                                            tooltip="Edit",
-                                            disabled=current_user_role == "worker"  # Workers can't edit
-                                        ),
-                                        ft.IconButton(
-                                            icons.DELETE,
-                                            on_click=lambda _, id=t.id: del_tool(id),
-                                            tooltip="Del",
-                                            disabled=current_user_role == "worker"  # Workers can't delete
-                                        ),
-                                        ft.IconButton(
-                                            icons.SEND,
-                                            on_click=lambda _, t=t: loan_dlg(t),
-                                            tooltip="Loan",
-                                            disabled=t.is_consumable
-                                        ),
-                                        ft.IconButton(
-                                            icons.QR_CODE,
-                                            on_click=lambda _, t=t: regen_qr(t),
-                                            tooltip="QR",
-                                            disabled=t.is_consumable or current_user_role == "worker"  # Workers can't regen QR
-                                        ),
-                                        ft.IconButton(
-                                            icons.UNDO,
-                                            on_click=lambda _, t=t: ret_dlg(t),
-                                            tooltip="Ret",
-                                            disabled=t.is_consumable
-                                        ),
-                                        ft.IconButton(
-                                            icons.REMOVE_CIRCLE,
-                                            on_click=lambda _, t=t: consume_dlg(t),
-                                            tooltip="Consume",
-                                            disabled=not t.is_consumable or current_user_role == "worker"  # Workers can't consume
-                                        )
-                                    ], alignment=ft.MainAxisAlignment.END)
-                                ]),
-                                width=300,
-                                padding=10
-                            )
-                        )
-                    )
-                page.update()
+                    cards[t.id] = tool_card(t, here.get(t.id, 0) if here is not None else None)
+                    tools_row.controls.append(cards[t.id])
             except Exception as e:
                 toast(f"List err: {str(e)}", ft.colors.RED_400)
 
+        def apply_delta(d: Delta, filt=None):
+            # Sustituye solo las tarjetas tocadas; las reutilizables tienen tantas insts como qty
+            for id, t in d.tools.items():
+                old = cards.pop(id, None)
+                if old is not None:
+                    tools_row.controls.remove(old)
+                    selected_tools.pop(id, None)
+                if t is None or (filt and filt.lower() not in (t.name or "").lower()):
+                    continue
+                here = app.insts_at(id, cur_loc) if cur_loc and not t.is_consumable else None
+                if here == 0:
+                    continue  # sin insts en esta ubicación
+                cards[id] = tool_card(t, here)
+                pos = next((k for k, c in enumerate(tools_row.controls)
+                            if c.data is not NO_TOOLS and c.data > (t.name or "")), len(tools_row.controls))
+                tools_row.controls.insert(pos, cards[id])
+            if cards and tools_row.controls and tools_row.controls[0].data is NO_TOOLS:
+                tools_row.controls.pop(0)
+            elif not cards and not tools_row.controls:
+                tools_row.controls.append(ft.Text("No tools", italic=True, data=NO_TOOLS))
+            for i_id, i in d.insts.items():
+                if i is not None and i_id in inst_txts:
+                    inst_txts[i_id].value = f"{i.serial} ({i.status})"
+
+        def on_delta(d: Delta):
+            nonlocal pend_d
+            with ui_lock:
+                pend_d = d if pend_d is None else pend_d | d
+            parts = {"cards"}
+            if d.tools or d.evs & {"loan", "ret"}:
+                parts.update(("tot", "stats"))
+            if d.evs & {"loan", "ret"}:
+                parts.add("loans")
+            if "ret" in d.evs:
+                parts.add("hist")
+            if "sync" in d.evs:
+                parts.update(("tools", "loans", "hist"))
+            if "move" in d.evs:
+                parts.update(("tot", "stats", "loans"))
+            if "overdue" in d.evs:
+                parts.add("loans")
+                if current_user_role == "admin" and d.note:
+                    toast(d.note, ft.colors.ORANGE_700, 6000)
+            refresh(*parts)
+
+        def tool_card(t: Tool, here: Optional[int] = None):
+            # here: insts en cur_loc; sin ubicación, el total (qty)
+            insts = 'N/A' if t.is_consumable else f"{t.qty}" if here is None else f"{here} here of {t.qty}"
+            img_path = t.img if t.img and os.path.exists(t.img) else None
+            img_w = ft.Image(
+                src=img_path,
+                width=50,
+                height=50,
+                fit=ft.ImageFit.CONTAIN
+            ) if img_path else ft.Icon(icons.IMAGE_NOT_SUPPORTED)
+            chk = ft.Checkbox(
+                value=False,
+                on_change=lambda e, t_id=t.id: toggle_select(t_id, e.control.value),
+                disabled=current_user_role == "worker"  # Workers can't select tools for bulk actions
+            )
+            return ft.Card(
+                data=t.name or "",  # posición en apply_delta
+                content=ft.Container(
+                    content=ft.Column([
+                        ft.Row([
+                            chk,
+                            img_w,
+                            ft.ListTile(
+                                title=ft.Text(
+                                    f"{t.name} (ID: {t.id})",
+                                    size=16,
+                                    weight="bold"
+                                ),
+                                subtitle=ft.Text(
+                                    f"Resp: {t.resp}\nQty: {t.qty}\nStatus: {t.status}\nType: {'Consumable' if t.is_consumable else 'Reusable'}\nInsts: {insts}"
+                                )
+                            )
+                        ]),
+                        ft.Row([
+                            ft.IconButton(
+                                icons.VISIBILITY,
+                                on_click=lambda _, t=t: show_tool(t),
+                                tooltip="View"
+                            ),
+                            ft.IconButton(
+                                icons.EDIT,
+                                on_click=lambda _, t=t: edit_tool(t),
+                                tooltip="Edit",
+                                disabled=current_user_role == "worker"  # Workers can't edit
+                            ),
+                            ft.IconButton(
+                                icons.DELETE,
+                                on_click=lambda _, id=t.id: del_tool(id),
+                                tooltip="Del",
+                                disabled=current_user_role == "worker"  # Workers can't delete
+                            ),
+                            ft.IconButton(
+                                icons.SEND,
+                                on_click=lambda _, t=t: loan_dlg(t),
+                                tooltip="Loan",
+                                disabled=t.is_consumable
+                            ),
+                            ft.IconButton(
+                                icons.QR_CODE,
+                                on_click=lambda _, t=t: regen_qr(t),
+                                tooltip="QR",
+                                disabled=t.is_consumable or current_user_role == "worker"  # Workers can't regen QR
+                            ),
+                            ft.IconButton(
+                                icons.UNDO,
+                                on_click=lambda _, t=t: ret_dlg(t),
+                                tooltip="Ret",
+                                disabled=t.is_consumable
+                            ),
+                            ft.IconButton(
+                                icons.EVENT,
+                                on_click=lambda _, t=t: res_dlg(t),
+                                tooltip="Reserve",
+                                disabled=t.is_consumable
+                            ),
+                            ft.IconButton(
+                                icons.REMOVE_CIRCLE,
+                                on_click=lambda _, t=t: consume_dlg(t),
+                                tooltip="Consume",
+                                disabled=not t.is_consumable or current_user_role == "worker"  # Workers can't consume
+                            )
+                        ], alignment=ft.MainAxisAlignment.END)
+                    ]),
+                    width=300,
+                    padding=10
+                )
+            )
+
         def toggle_select(tool_id: int, selected: bool):
             if current_user_role == "worker":
                 toast("Workers cannot perform bulk actions", ft.colors.RED_400)
@@ -741,17 +2195,40 @@ def main(page: ft.Page):
             if not selected_tools:
                 toast("No tools selected", ft.colors.RED_400)
                 return
+            ids = list(selected_tools.keys())
+            def done(res, dlg=None):
+                ok, msg = res
+                if ok:
+                    selected_tools.clear()
+                    if dlg:
+                        dlg.open = False
+                    toast(msg)
+                else:
+                    toast(msg, ft.colors.RED_400)
             if action == "delete":
-                for tool_id in list(selected_tools.keys()):
-                    ok, msg = app.del_tool(tool_id)
-                    if ok:
-                        selected_tools.pop(tool_id, None)
-                        toast(msg)
-                    else:
-                        toast(msg, ft.colors.RED_400)
-            upd_tools()
-            upd_loans()
-            calc_tot()
+                bg(lambda: app.bulk_del(ids), done, f"Deleting {len(ids)}...")
+            elif action == "update":
+                st_dd = ft.Dropdown(label="Status (keep)", options=[ft.dropdown.Option(v) for v in ("avail", "maint", "retired")])
+                r_ed = ft.TextField(label="Resp (keep)")
+                c_dd = ft.Dropdown(label="Type (keep)", options=[ft.dropdown.Option("Reusable"), ft.dropdown.Option("Consumable")])
+                def reg(e):
+                    kw = {
+                        "status": st_dd.value or None,
+                        "resp": r_ed.value.strip() or None,
+                        "is_consumable": None if not c_dd.value else c_dd.value == "Consumable"
+                    }
+                    bg(lambda: app.bulk_upd(ids, **kw), lambda res: done(res, dlg), f"Updating {len(ids)}...")
+                dlg = ft.AlertDialog(
+                    title=ft.Text(f"Update {len(ids)} tools"),
+                    content=ft.Column([st_dd, r_ed, c_dd], tight=True),
+                    actions=[
+                        ft.TextButton("Apply", on_click=reg),
+                        ft.TextButton("Cancel", on_click=lambda _: setattr(dlg, 'open', False))
+                    ]
+                )
+                page.overlay.append(dlg)
+                dlg.open = True
+                page.update()
 
         def add_tool(e):
             nonlocal img_sel
@@ -765,22 +2242,34 @@ def main(page: ft.Page):
                     return toast("Name/resp req", ft.colors.RED_400)
                 if q < 0:
                     return toast("Qty >= 0", ft.colors.RED_400)
-                ok, msg = app.add_tool(n, r, q, is_consumable, img_sel)
-                if ok:
-                    upd_tools()
-                    n_inp.value = r_inp.value = q_inp.value = ""
-                    c_inp.value = False
-                    img_sel = None  # Reset after adding
-                    upd_loans()
-                    calc_tot()
-                    toast(msg)
-                else:
-                    toast(msg, ft.colors.RED_400)
+                img = img_sel
+                def done(res):
+                    nonlocal img_sel
+                    ok, msg = res
+                    if ok:
+                        n_inp.value = r_inp.value = q_inp.value = ""
+                        c_inp.value = False
+                        dup_txt.visible = False
+                        img_sel = None  # Reset after adding
+                        toast(msg)
+                        bg(drain_qrs)
+                    else:
+                        toast(msg, ft.colors.RED_400)
+                bg(lambda: app.add_tool(n, r, q, is_consumable, img, cur_loc), done, f"Adding {n}...")
             except ValueError:
                 toast("Invalid qty", ft.colors.RED_400)
             except Exception as e:
                 toast(f"Err: {str(e)}", ft.colors.RED_400)
 
+        def check_dup(q):
+            # Aviso al escribir el nombre: herramientas ya existentes con nombre parecido
+            def done(res):
+                dup_txt.value = "Similar: " + ", ".join(f"{d['name']} ({d['sim']:.0%})" for d in res) if res else ""
+                dup_txt.visible = bool(res)
+                page.update()
+            bg(lambda: app.similar(q) if q else [], done)
+        n_inp.on_change = debounce(lambda e: check_dup((n_inp.value or "").strip()), 0.3)
+
         def consume_dlg(t: Tool):
             if current_user_role == "worker":
                 toast("Workers cannot consume tools", ft.colors.RED_400)
@@ -789,14 +2278,14 @@ def main(page: ft.Page):
             def reg(e):
                 try:
                     qty = int(q_inp.value)
-                    ok, msg = app.consume_tool(t.id, qty)
-                    if ok:
-                        upd_tools()
-                        toast(msg)
-                        dlg.open = False
-                        page.update()
-                    else:
-                        toast(msg, ft.colors.RED_400)
+                    def done(res):
+                        ok, msg = res
+                        if ok:
+                            dlg.open = False
+                            toast(msg)
+                        else:
+                            toast(msg, ft.colors.RED_400)
+                    bg(lambda: app.consume_tool(t.id, qty, current_user), done)
                 except ValueError:
                     toast("Invalid qty", ft.colors.RED_400)
             dlg = ft.AlertDialog(
@@ -819,6 +2308,9 @@ def main(page: ft.Page):
             r_ed = ft.TextField(value=t.resp, label="Resp")
             q_ed = ft.TextField(value=str(t.qty), label="Qty", keyboard_type=ft.KeyboardType.NUMBER)
             c_ed = ft.Switch(label="Consumable", value=t.is_consumable)
+            o_ed = ft.TextField(value=str(app.get_reorder(t.id)), label="Reorder at (0 = off)", keyboard_type=ft.KeyboardType.NUMBER)
+            lh = app.get_loan_policy(t.id)
+            h_ed = ft.TextField(value=str(lh) if lh else "", label=f"Loan hrs (empty = {OVERDUE_HRS})", keyboard_type=ft.KeyboardType.NUMBER)
             img_ed = ft.FilePicker(on_result=lambda e: ed_img(e))
             img_sel_ed = None  # To store the edited image path
             img_curr = ft.Image(
@@ -836,21 +2328,24 @@ def main(page: ft.Page):
             def save(e):
                 try:
                     n, r, q = n_ed.value.strip(), r_ed.value.strip(), int(q_ed.value)
+                    o = int(o_ed.value or 0)
+                    hrs = int(h_ed.value) if h_ed.value and h_ed.value.strip() else None
                     is_consumable = c_ed.value
                     if not n or not r:
                         return toast("Name/resp req", ft.colors.RED_400)
-                    if q < 0:
+                    if q < 0 or o < 0:
                         return toast("Qty >= 0", ft.colors.RED_400)
-                    ok, msg = app.upd_tool(t.id, n, r, q, is_consumable, img_sel_ed or t.img)
-                    if ok:
-                        upd_tools()
-                        upd_loans()
-                        calc_tot()
-                        toast(msg)
-                        dlg.open = False
-                    else:
-                        toast(msg, ft.colors.RED_400)
-                    page.update()
+                    def done(res):
+                        ok, msg = res
+                        if ok:
+                            dlg.open = False
+                            toast(msg)
+                            bg(drain_qrs)
+                            if hrs != lh:
+                                bg(lambda: app.set_loan_policy(t.id, hrs), lambda r: None if r[0] else toast(r[1], ft.colors.RED_400))
+                        else:
+                            toast(msg, ft.colors.RED_400)
+                    bg(lambda: app.upd_tool(t.id, n, r, q, is_consumable, img_sel_ed or t.img, o), done, f"Saving {n}...")
                 except ValueError:
                     toast("Invalid qty", ft.colors.RED_400)
                 except Exception as e:
@@ -862,6 +2357,8 @@ def main(page: ft.Page):
                     r_ed,
                     q_ed,
                     c_ed,
+                    o_ed,
+                    h_ed,
                     ft.Row([ft.Text("Img:"), img_curr]),
                     ft.ElevatedButton(
                         "Change Img",
@@ -882,57 +2379,57 @@ def main(page: ft.Page):
             if current_user_role == "worker":
                 toast("Workers cannot delete tools", ft.colors.RED_400)
                 return
-            ok, msg = app.del_tool(id)
-            if ok:
-                upd_tools()
-                upd_loans()
-                calc_tot()
-                toast(msg)
-            else:
-                toast(msg, ft.colors.RED_400)
+            def done(res):
+                ok, msg = res
+                if ok:
+                    toast(msg)
+                else:
+                    toast(msg, ft.colors.RED_400)
+            bg(lambda: app.del_tool(id), done)
 
         def show_tool(t: Tool):
-            insts = app.get_insts(t.id) if not t.is_consumable else []
+            insts = app.get_insts(t.id, cur_loc) if not t.is_consumable else []
             img_w = ft.Image(
                 src=t.img,
                 width=100,
                 height=100,
                 fit=ft.ImageFit.CONTAIN
             ) if t.img and os.path.exists(t.img) else ft.Text("No img")
-            def qr_b64(qr_path: str) -> Optional[str]:
-                try:
-                    with open(qr_path, "rb") as f:
-                        return base64.b64encode(f.read()).decode('utf-8')
-                except Exception as e:
-                    logger.error("QR b64 err: %s", e)
-                    return None
-            def dl_qr(e, i_id: int):
+            def dl_qr(e, i: ToolInst):
                 if current_user_role == "worker":
                     toast("Workers cannot download QR codes", ft.colors.RED_400)
                     return
-                qr_path = app.qr_mgr.gen_qr(t.tool_uuid, i_id, t.name)
-                if qr_path and os.path.exists(qr_path):
+                png = app.qr_mgr.qr_png(i.qr_uuid) if app.qr_mgr.gen_qr(t.tool_uuid, i.id, t.name) else None
+                if png:
                     dl_dir = os.path.expanduser("~/Downloads")
-                    dest = os.path.join(dl_dir, os.path.basename(qr_path))
-                    shutil.copy(qr_path, dest)
+                    dest = os.path.join(dl_dir, f"qr_{t.tool_uuid}_{i.id}_{i.qr_uuid}.png")
+                    with open(dest, "wb") as f:
+                        f.write(png)
                     toast(f"QR saved: {dest}")
                 else:
                     toast("QR dl err", ft.colors.RED_400)
+            def qr_w(i: ToolInst):
+                b64 = app.qr_mgr.qr_b64(i.qr_uuid, 160)
+                return ft.Image(src_base64=b64, width=80, height=80, fit=ft.ImageFit.CONTAIN) if b64 else ft.Text("No QR")
+            inst_txts.clear()
+            inst_txts.update({i.id: ft.Text(f"{i.serial} ({i.status})") for i in insts})
             inst_btns = ft.Column([
                 ft.Row([
-                    ft.Text(f"{i.serial} ({i.status})"),
-                    ft.Image(
-                        src_base64=qr_b64(app.qr_mgr.gen_qr(t.tool_uuid, i.id, t.name)),
-                        width=80,
-                        height=80,
-                        fit=ft.ImageFit.CONTAIN
-                    ) if app.qr_mgr.gen_qr(t.tool_uuid, i.id, t.name) else ft.Text("No QR"),
+                    inst_txts[i.id],
+                    qr_w(i),
                     ft.IconButton(
                         icons.DOWNLOAD,
-                        on_click=lambda e, i_id=i.id: dl_qr(e, i_id),
+                        on_click=lambda e, i=i: dl_qr(e, i),
                         tooltip="DL QR",
                         disabled=current_user_role == "worker"
-                    )
+                    ),
+                    ft.IconButton(
+                        icons.LOCAL_SHIPPING,
+                        on_click=lambda e, i=i: xfer_dlg(i),
+                        tooltip="Transfer",
+                        disabled=i.status == "loaned"
+                    ),
+                    ft.IconButton(icons.HISTORY, on_click=lambda e, i=i: tl_dlg(i), tooltip="History")
                 ], alignment=ft.MainAxisAlignment.SPACE_BETWEEN)
                 for i in insts
             ], scroll=ft.ScrollMode.AUTO)
@@ -947,10 +2444,88 @@ def main(page: ft.Page):
                     ft.Text(f"Qty: {t.qty}"),
                     ft.Text(f"Type: {'Consumable' if t.is_consumable else 'Reusable'}"),
                     ft.Text(f"Status: {t.status}"),
-                    ft.Text("Insts:" if not t.is_consumable else "No insts (consumable)"),
+                    ft.Text(("Insts here:" if cur_loc else "Insts:") if not t.is_consumable else "No insts (consumable)"),
                     inst_btns
                 ], scroll=ft.ScrollMode.AUTO),
                 actions=[
+                    ft.TextButton("Duplicates", on_click=lambda _: dup_dlg(t), disabled=current_user_role != "admin"),
+                    ft.TextButton("Close", on_click=lambda _: setattr(dlg, 'open', False))
+                ]
+            )
+            page.overlay.append(dlg)
+            dlg.open = True
+            page.update()
+
+        def xfer_dlg(i: ToolInst):
+            # Traslado de una inst a otra ubicación (queda en transfers)
+            w_pick, w_inp = worker_pick()
+            dst = ft.Dropdown(label="To", options=[])
+            n_inp = ft.TextField(label="Notes (opt)")
+            past = ft.Column(scroll=ft.ScrollMode.AUTO, height=150)
+            def loaded(res):
+                locs, xs = res
+                dst.options = [ft.dropdown.Option(str(l["id"]), f"{l['name']} ({l['kind']})") for l in locs]
+                past.controls = [ft.Text(f"{x['date'][:16]}  {x['src'] or '-'} -> {x['dst']}  {x['worker']}") for x in xs]
+                page.update()
+            bg(lambda: (app.get_locs(), app.transfers_of(i.id, 10)), loaded)
+            def reg(e):
+                w = w_inp.value.strip()
+                if not w or not dst.value:
+                    return toast("Worker/dest req", ft.colors.RED_400)
+                def done(res):
+                    ok, msg = res
+                    if ok:
+                        dlg.open = False
+                        toast(f"{i.serial}: {msg}")
+                    else:
+                        toast(msg, ft.colors.RED_400)
+                bg(lambda: app.transfer([i.id], int(dst.value), w, n_inp.value), done)
+            dlg = ft.AlertDialog(
+                title=ft.Text(f"Transfer: {i.serial}"),
+                content=ft.Column([w_pick, dst, n_inp, ft.Divider(), ft.Text("Recent moves"), past]),
+                actions=[
+                    ft.TextButton("Move", on_click=reg),
+                    ft.TextButton("Cancel", on_click=lambda _: setattr(dlg, 'open', False))
+                ]
+            )
+            page.overlay.append(dlg)
+            dlg.open = True
+            page.update()
+
+        def tl_dlg(i: ToolInst):
+            # Historial de la inst por páginas (TL_PAGE filas); "More" sigue desde el cursor
+            rows = ft.Column(scroll=ft.ScrollMode.AUTO, height=360)
+            more = ft.TextButton("More", disabled=True)
+            cur = None
+            def line(r):
+                k, d = r["kind"], r["date"][:16]
+                if k == "loan":
+                    return ft.Text(f"{d}  Loan  {r['worker']}  due {(r['due'] or '')[:16]}" + ("" if r["closed"] else "  (open)"))
+                if k == "ret":
+                    return ft.Text(f"{d}  Return  {r['worker']}" + (f"  {r['notes']}" if r["notes"] else ""))
+                if k == "move":
+                    return ft.Text(f"{d}  Move  {r['src'] or '-'} -> {r['dst']}  {r['worker']}")
+                if r["what"] == "qr":
+                    return ft.Text(f"{d}  QR regen", color=ft.colors.BLUE_GREY)
+                return ft.Text(f"{d}  {r['what'].capitalize()}  {r['old'] or '-'} -> {r['new'] or '-'}", color=ft.colors.BLUE_GREY)
+            def loaded(res):
+                nonlocal cur
+                got, cur = res
+                rows.controls += [line(r) for r in got]
+                if not rows.controls:
+                    rows.controls.append(ft.Text("No history"))
+                more.disabled = cur is None
+                page.update()
+            def load(e=None):
+                more.disabled = True
+                bg(lambda c=cur: app.timeline(i.id, c), loaded)
+            more.on_click = load
+            load()
+            dlg = ft.AlertDialog(
+                title=ft.Text(f"History: {i.serial}"),
+                content=rows,
+                actions=[
+                    more,
                     ft.TextButton("Close", on_click=lambda _: setattr(dlg, 'open', False))
                 ]
             )
@@ -958,32 +2533,176 @@ def main(page: ft.Page):
             dlg.open = True
             page.update()
 
+        def dup_dlg(t: Tool):
+            # Herramientas de nombre parecido a t; "Merge here" funde la elegida en t (solo admin)
+            lst = ft.Column(scroll=ft.ScrollMode.AUTO, height=300)
+            @confirm("Merge tools? Insts, loans and returns move here; the other tool is deleted")
+            def merge(d):
+                def done(res):
+                    ok, msg = res
+                    if ok:
+                        dlg.open = False
+                        toast(msg)
+                        refresh("loans", "hist")
+                    else:
+                        toast(msg, ft.colors.RED_400)
+                bg(lambda: app.merge_tools(t.id, [d["id"]]), done, f"Merging {d['name']}...")
+            def loaded(res):
+                lst.controls = [
+                    ft.Row([
+                        ft.Text(f"{d['name']} ({d['sim']:.0%})", expand=1),
+                        ft.TextButton("Merge here", on_click=lambda _, d=d: merge(d))
+                    ])
+                    for d in res
+                ] or [ft.Text("No similar tools", italic=True)]
+                page.update()
+            bg(lambda: app.similar(t.name, skip=t.id, limit=10), loaded)
+            dlg = ft.AlertDialog(
+                title=ft.Text(f"Similar to {t.name}"),
+                content=lst,
+                actions=[ft.TextButton("Close", on_click=lambda _: setattr(dlg, 'open', False))]
+            )
+            page.overlay.append(dlg)
+            dlg.open = True
+            page.update()
+
+        def set_loc(e):
+            # Cambiar de ubicación recarga la lista, stats y vencidos de la sesión
+            nonlocal cur_loc
+            cur_loc = int(loc_dd.value) if loc_dd.value and loc_dd.value != "all" else None
+            refresh("tools", "loans", "tot", "stats")
+
+        def loc_dlg():
+            # Alta de ubicaciones (solo admin)
+            name = ft.TextField(label="Name")
+            kind = ft.Dropdown(label="Kind", value="warehouse", options=[ft.dropdown.Option(k) for k in LOC_KINDS])
+            def reg(e):
+                def done(res):
+                    ok, msg = res
+                    toast(msg, ft.colors.GREEN if ok else ft.colors.RED_400)
+                    if ok:
+                        dlg.open = False
+                        load_locs()
+                bg(lambda: app.add_loc(name.value, kind.value), done)
+            dlg = ft.AlertDialog(
+                title=ft.Text("New location"),
+                content=ft.Column([name, kind], tight=True),
+                actions=[
+                    ft.TextButton("Add", on_click=reg),
+                    ft.TextButton("Cancel", on_click=lambda _: setattr(dlg, 'open', False))
+                ]
+            )
+            page.overlay.append(dlg)
+            dlg.open = True
+            page.update()
+
+        def load_locs():
+            def done(locs):
+                loc_dd.options = [ft.dropdown.Option("all", "All locations")] + [
+                    ft.dropdown.Option(str(l["id"]), l["name"]) for l in locs]
+                page.update()
+            bg(app.get_locs, done)
+
+        def inst_pick(t: Tool, status: Optional[str] = None):
+            # Autocompletado: PICK_N filas por consulta (idx_ti_pick/_ord), nunca todas las insts.
+            # Se acepta el serial entero (prefijo) o solo el ordinal que va tras "<tool_uuid>-"
+            sel = {"id": None, "q": None}
+            inp = ft.TextField(label="Inst (serial no.)", prefix_icon=icons.SEARCH)
+            res = ft.Column(spacing=0, scroll=ft.ScrollMode.AUTO, height=220)
+            def pick(i: ToolInst):
+                sel["id"] = i.id
+                inp.value = i.serial
+                res.controls.clear()
+                page.update()
+            def search(q):
+                sel["q"] = q
+                def done(insts):
+                    if q != sel["q"]:
+                        return  # ya hay una búsqueda más nueva
+                    res.controls = [
+                        ft.ListTile(title=ft.Text(f"{i.serial} ({i.status})"), dense=True,
+                                    on_click=lambda _, i=i: pick(i))
+                        for i in insts
+                    ] or [ft.Text("No match", italic=True)]
+                    page.update()
+                bg(lambda: app.find_insts(t.id, q, status, loc=cur_loc), done)
+            deb = debounce(search)
+            def on_change(e):
+                sel["id"] = None
+                deb(inp.value.strip())
+            inp.on_change = on_change
+            search("")
+            return ft.Column([inp, res]), lambda: sel["id"]
+
+        def worker_pick(on_pick=None):
+            # Nombre libre con sugerencias del registro (prefijo normalizado); al elegir, on_pick(w)
+            sel = {"q": None}
+            inp = ft.TextField(label="Worker")
+            res = ft.Column(spacing=0)
+            def pick(w):
+                inp.value = w["name"]
+                res.controls.clear()
+                page.update()
+                if on_pick:
+                    on_pick(w)
+            def search(q):
+                sel["q"] = q
+                def done(ws):
+                    if q != sel["q"]:
+                        return
+                    res.controls = [
+                        ft.ListTile(title=ft.Text(w["name"]), dense=True, on_click=lambda _, w=w: pick(w))
+                        for w in ws if w["name"] != q
+                    ]
+                    page.update()
+                if not q:
+                    return done([])
+                bg(lambda: app.find_workers(q, 8), done)
+            deb = debounce(search)
+            inp.on_change = lambda e: deb(inp.value.strip())
+            return ft.Column([inp, res], spacing=0), inp
+
+        def worker_dlg():
+            # Lo que tiene ahora una persona y sus últimos préstamos
+            out = ft.Column(scroll=ft.ScrollMode.AUTO, height=400)
+            def show(w):
+                def done(res):
+                    loans, hist = res
+                    out.controls = [ft.Text(f"Has now ({len(loans)})", weight="bold")] + [
+                        ft.Text(f"{l['tool']} - {l['serial']}  (due {l['due']})") for l in loans
+                    ] + [ft.Divider(), ft.Text("Recent", weight="bold")] + [
+                        ft.Text(f"{h['date'][:16]}  {h['tool']} - {h['serial']}" + (f"  -> {h['closed'][:16]}" if h["closed"] else ""))
+                        for h in hist
+                    ]
+                    page.update()
+                bg(lambda: (app.worker_loans(w["id"]), app.worker_hist(w["id"])), done)
+            w_pick, _ = worker_pick(show)
+            dlg = ft.AlertDialog(
+                title=ft.Text("Worker"),
+                content=ft.Column([w_pick, out]),
+                actions=[ft.TextButton("Close", on_click=lambda _: setattr(dlg, 'open', False))]
+            )
+            page.overlay.append(dlg)
+            dlg.open = True
+            page.update()
+
         def loan_dlg(t: Tool):
-            w_inp = ft.TextField(label="Worker")
-            i_dd = ft.Dropdown(label="Inst")
-            insts = app.get_insts(t.id)
-            i_dd.options = [
-                ft.dropdown.Option(key=str(i.id), text=f"{i.serial} ({i.status})")
-                for i in insts if i.status == "avail"
-            ]
+            w_pick, w_inp = worker_pick()
+            i_pick, i_sel = inst_pick(t, "avail")
             def reg(e):
-                try:
-                    w, i_id = w_inp.value.strip(), i_dd.value
-                    if not w or not i_id:
-                        return toast("Worker/inst req", ft.colors.RED_400)
-                    if app.reg_loan(t.id, int(i_id), w):
-                        upd_tools()
-                        upd_loans()
-                        toast(f"Loaned: {t.name}")
+                w, i_id = w_inp.value.strip(), i_sel()
+                if not w or not i_id:
+                    return toast("Worker/inst req", ft.colors.RED_400)
+                def done(ok):
+                    if ok:
                         dlg.open = False
-                        page.update()
+                        toast(f"Loaned: {t.name}")
                     else:
                         toast("Loan err", ft.colors.RED_400)
-                except ValueError:
-                    toast("Invalid inst", ft.colors.RED_400)
+                bg(lambda: app.reg_loan(t.id, i_id, w), done)
             dlg = ft.AlertDialog(
                 title=ft.Text(f"Loan: {t.name}"),
-                content=ft.Column([w_inp, i_dd]),
+                content=ft.Column([w_pick, i_pick]),
                 actions=[
                     ft.TextButton("Reg", on_click=reg),
                     ft.TextButton("Cancel", on_click=lambda _: setattr(dlg, 'open', False))
@@ -994,33 +2713,24 @@ def main(page: ft.Page):
             page.update()
 
         def ret_dlg(t: Tool):
-            w_inp = ft.TextField(label="Worker")
-            i_dd = ft.Dropdown(label="Inst")
+            w_pick, w_inp = worker_pick()
+            i_pick, i_sel = inst_pick(t, "loaned")
             n_inp = ft.TextField(label="Notes (opt)", multiline=True)
-            insts = app.get_insts(t.id)
-            i_dd.options = [
-                ft.dropdown.Option(key=str(i.id), text=f"{i.serial} ({i.status})")
-                for i in insts if i.status == "loaned"
-            ]
             def reg(e):
-                try:
-                    w, i_id, n = w_inp.value.strip(), i_dd.value, n_inp.value.strip()
-                    if not w or not i_id:
-                        return toast("Worker/inst req", ft.colors.RED_400)
-                    ret = RetData(h_id=t.id, i_id=int(i_id), worker=w, notes=n)
-                    if app.qr_mgr.reg_ret(ret):
-                        upd_tools()
-                        upd_loans()
-                        toast(f"Returned: {t.name}")
+                w, i_id, n = w_inp.value.strip(), i_sel(), n_inp.value.strip()
+                if not w or not i_id:
+                    return toast("Worker/inst req", ft.colors.RED_400)
+                ret = RetData(h_id=t.id, i_id=i_id, worker=w, notes=n)
+                def done(ok):
+                    if ok:
                         dlg.open = False
-                        page.update()
+                        toast(f"Returned: {t.name}")
                     else:
                         toast("Ret err", ft.colors.RED_400)
-                except ValueError:
-                    toast("Invalid inst", ft.colors.RED_400)
+                bg(lambda: app.qr_mgr.reg_ret(ret), done)
             dlg = ft.AlertDialog(
                 title=ft.Text(f"Return: {t.name}"),
-                content=ft.Column([w_inp, i_dd, n_inp]),
+                content=ft.Column([w_pick, i_pick, n_inp]),
                 actions=[
                     ft.TextButton("Reg", on_click=reg),
                     ft.TextButton("Cancel", on_click=lambda _: setattr(dlg, 'open', False))
@@ -1030,32 +2740,80 @@ def main(page: ft.Page):
             dlg.open = True
             page.update()
 
+        def res_dlg(t: Tool):
+            # Reservar una instancia libre en [desde, hasta); abajo, las reservas vigentes
+            w_pick, w_inp = worker_pick()
+            d = dt.date.today() + dt.timedelta(days=1)
+            s_inp = ft.TextField(label="From", value=f"{d} 08:00", width=180)
+            e_inp = ft.TextField(label="To", value=f"{d} 17:00", width=180)
+            n_inp = ft.TextField(label="Notes (opt)")
+            i_dd = ft.Dropdown(label="Free inst", options=[])
+            cur = ft.Column(scroll=ft.ScrollMode.AUTO, height=200)
+            def load_cur():
+                def done(rows):
+                    cur.controls = [ft.Row([
+                        ft.Text(f"{r['start'][:16]} - {r['end'][:16]}  {r['serial']}  {r['worker']}", expand=True),
+                        ft.IconButton(icons.CLOSE, tooltip="Cancel", on_click=lambda _, id=r["id"]: cancel(id))
+                    ]) for r in rows] or [ft.Text("No reservations")]
+                    page.update()
+                bg(lambda: app.get_res(t.id), done)
+            def cancel(id):
+                def done(res):
+                    toast(res[1], ft.colors.GREEN if res[0] else ft.colors.RED_400)
+                    load_cur()
+                bg(lambda: app.cancel_res(id), done)
+            def check(e=None):
+                def done(free):
+                    i_dd.options = [ft.dropdown.Option(str(i["id"]), f"{i['serial']} ({i['status']})") for i in free]
+                    i_dd.value = i_dd.options[0].key if free else None
+                    if not free:
+                        toast("No free inst in that window", ft.colors.ORANGE_400)
+                    page.update()
+                bg(lambda: app.free_insts(t.id, s_inp.value, e_inp.value), done)
+            s_inp.on_change = e_inp.on_change = debounce(check, 0.5)
+            def reg(e):
+                w = w_inp.value.strip()
+                if not w or not i_dd.value:
+                    return toast("Worker/inst req", ft.colors.RED_400)
+                def done(res):
+                    toast(res[1], ft.colors.GREEN if res[0] else ft.colors.RED_400)
+                    if res[0]:
+                        check()
+                        load_cur()
+                bg(lambda: app.reserve(t.id, int(i_dd.value), w, s_inp.value, e_inp.value, n_inp.value), done)
+            dlg = ft.AlertDialog(
+                title=ft.Text(f"Reserve: {t.name}"),
+                content=ft.Column([w_pick, ft.Row([s_inp, e_inp]), i_dd, n_inp, ft.Divider(), cur], scroll=ft.ScrollMode.AUTO),
+                actions=[
+                    ft.TextButton("Reg", on_click=reg),
+                    ft.TextButton("Close", on_click=lambda _: setattr(dlg, 'open', False))
+                ]
+            )
+            page.overlay.append(dlg)
+            dlg.open = True
+            page.update()
+            check()
+            load_cur()
+
         def regen_qr(t: Tool):
             if current_user_role == "worker":
                 toast("Workers cannot regenerate QR codes", ft.colors.RED_400)
                 return
-            i_dd = ft.Dropdown(label="Inst")
-            insts = app.get_insts(t.id)
-            i_dd.options = [
-                ft.dropdown.Option(key=str(i.id), text=f"{i.serial} ({i.status})")
-                for i in insts
-            ]
+            i_pick, i_sel = inst_pick(t)
             def reg(e):
-                try:
-                    i_id = i_dd.value
-                    if not i_id:
-                        return toast("Inst req", ft.colors.RED_400)
-                    if app.regen_qr(t.tool_uuid, int(i_id), t.name):
-                        toast(f"QR regen: {t.name}")
+                i_id = i_sel()
+                if not i_id:
+                    return toast("Inst req", ft.colors.RED_400)
+                def done(ok):
+                    if ok:
                         dlg.open = False
-                        page.update()
+                        toast(f"QR regen: {t.name}")
                     else:
                         toast("QR err", ft.colors.RED_400)
-                except ValueError:
-                    toast("Invalid inst", ft.colors.RED_400)
+                bg(lambda: app.regen_qr(t.tool_uuid, i_id, t.name), done)
             dlg = ft.AlertDialog(
                 title=ft.Text(f"Regen QR: {t.name}"),
-                content=ft.Column([i_dd]),
+                content=ft.Column([i_pick]),
                 actions=[
                     ft.TextButton("Reg", on_click=reg),
                     ft.TextButton("Cancel", on_click=lambda _: setattr(dlg, 'open', False))
@@ -1065,24 +2823,42 @@ def main(page: ft.Page):
             dlg.open = True
             page.update()
 
+        def overdue_dlg():
+            ods = app.check_overdue(cur_loc)
+            dlg = ft.AlertDialog(
+                title=ft.Text(f"Overdue ({len(ods)})"),
+                content=ft.Column([
+                    ft.ListTile(
+                        leading=ft.Icon(icons.WARNING, color=ft.colors.ORANGE_700),
+                        title=ft.Text(f"{o['tool']} - {o['serial']}", weight="bold"),
+                        subtitle=ft.Text(f"Worker: {o['worker']}\nDue: {o['due']} ({o['hrs_overdue']} h late)")
+                    ) for o in ods
+                ] or [ft.Text("Nothing overdue", italic=True)], scroll=ft.ScrollMode.AUTO, height=400),
+                actions=[ft.TextButton("Close", on_click=lambda _: setattr(dlg, 'open', False))]
+            )
+            page.overlay.append(dlg)
+            dlg.open = True
+            page.update()
+
         def upd_loans():
             try:
-                loan_txt.value = f"Overdue: {len(app.check_overdue())}"
-                page.update()
+                loan_txt.value = f"Overdue: {app.od.count(cur_loc)}"
             except Exception as e:
                 toast(f"Loans err: {str(e)}", ft.colors.RED_400)
 
         def calc_tot():
             try:
-                tot = sum(t.qty for t in app.get_tools())
-                tot_txt.value = f"Total: {tot}"
-                page.update()
+                r = app.get_rollup(loc=cur_loc)
+                tot_txt.value = (
+                    f"Total: {r['qty']} | Reusable: {r['reusable']} / Consumable: {r['consumable']}"
+                    f" | Avail: {r['insts'].get('avail', 0)} / Loaned: {r['insts'].get('loaned', 0)}"
+                )
             except Exception as e:
                 toast(f"Tot err: {str(e)}", ft.colors.RED_400)
 
         def upd_stats():
             try:
-                s = app.qr_mgr.get_stats()
+                s = app.qr_mgr.get_stats(loc=cur_loc)
                 stat_txt.value = (
                     f"Loaned: {s['loaned']}\n"
                     f"Loans Today: {s['loans_today']}\n"
@@ -1090,28 +2866,29 @@ def main(page: ft.Page):
                     f"Pop:\n" + "\n".join(f" - {t['name']}: {t['loans']}" for t in s['pop_tools']) +
                     f"\nUpdated: {s['ts']}"
                 )
-                page.update()
+                low = app.low_stock(20)
+                if low:
+                    stat_txt.value += "\nLow stock:\n" + "\n".join(f" - {x['name']}: {x['qty']}/{x['reorder']}" for x in low)
+                if current_user_role == "admin":
+                    # Vista por responsable para supervisores
+                    by_resp = sorted(app.get_rollup(loc=cur_loc)["by_resp"].items(), key=lambda kv: -kv[1]["qty"])
+                    stat_txt.value += "\nBy resp:\n" + "\n".join(
+                        f" - {r}: {d['tools']} tools, qty {d['qty']}, loaned {d['insts'].get('loaned', 0)}"
+                        for r, d in by_resp
+                    )
             except Exception as e:
                 toast(f"Stats err: {str(e)}", ft.colors.RED_400)
 
         def upd_hist():
             try:
-                app.c.execute('''
-                    SELECT d.id, h.name, ti.serial, d.worker, d.date, d.notes
-                    FROM rets d
-                    JOIN tools h ON d.h_id = h.id
-                    JOIN tool_inst ti ON d.i_id = ti.id
-                    ORDER BY d.date DESC
-                ''')
                 hist_cont.controls = [
                     ft.ListTile(
                         leading=ft.Icon(icons.RECEIPT),
                         title=ft.Text(f"{v[1]} - {v[2]}", weight="bold"),
                         subtitle=ft.Text(f"Worker: {v[3]}\nDate: {v[4]}\nNotes: {v[5] or 'N/A'}"),
                         trailing=ft.Icon(icons.CHECK_CIRCLE, color=ft.colors.GREEN)
-                    ) for v in app.c.fetchall()
+                    ) for v in app.get_hist()
                 ]
-                page.update()
             except Exception as e:
                 toast(f"Hist err: {str(e)}", ft.colors.RED_400)
 
@@ -1119,32 +2896,29 @@ def main(page: ft.Page):
             if current_user_role == "worker":
                 toast("Workers cannot generate CSV reports", ft.colors.RED_400)
                 return
-            try:
-                if app.gen_csv():
-                    toast("CSV OK")
-                else:
-                    toast("CSV err", ft.colors.RED_400)
-            except Exception as e:
-                toast(f"CSV err: {str(e)}", ft.colors.RED_400)
+            bg(app.gen_csv, lambda ok: toast("CSV OK") if ok else toast("CSV err", ft.colors.RED_400), "Writing CSV...")
 
         def exp_qrs():
             if current_user_role == "worker":
                 toast("Workers cannot export QR codes", ft.colors.RED_400)
                 return
-            try:
-                tools = app.get_tools()
-                zip_path = os.path.expanduser("~/Downloads/qrs.zip")
-                with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as z:
-                    for t in tools:
-                        if t.is_consumable:
-                            continue
-                        for i in app.get_insts(t.id):
-                            qr = app.qr_mgr.gen_qr(t.tool_uuid, i.id, t.name)
-                            if qr and os.path.exists(qr):
-                                z.write(qr, os.path.basename(qr))
-                toast(f"QRs: {zip_path}")
-            except Exception as e:
-                toast(f"QRs err: {str(e)}", ft.colors.RED_400)
+            zip_path = os.path.expanduser("~/Downloads/qrs.zip")
+            bg(
+                lambda: app.exp_qrs(zip_path),
+                lambda ok: toast(f"QRs: {zip_path}") if ok else toast("QRs err", ft.colors.RED_400),
+                "Exporting QRs..."
+            )
+
+        def backup():
+            if current_user_role != "admin":
+                toast("Only admins can run backups", ft.colors.RED_400)
+                return
+            bg(
+                app.backup,
+                lambda r: toast(f"Backup {r['snap']}: {r['s']} s, {r['new_bytes'] / 2**20:.1f} MiB new") if r
+                else toast("Backup err", ft.colors.RED_400),
+                "Backing up..."
+            )
 
         def toggle_menu(e):
             page.drawer.open = not page.drawer.open
@@ -1175,7 +2949,7 @@ def main(page: ft.Page):
                         ft.ExpansionTile(
                             title=ft.Text("Hist"),
                             leading=ft.Icon(icons.HISTORY),
-                            trailing=ft.IconButton(icon=icons.REFRESH, on_click=lambda e: upd_hist()),
+                            trailing=ft.IconButton(icon=icons.REFRESH, on_click=lambda e: refresh("hist")),
                             maintain_state=True,
                             controls=[
                                 ft.Container(
@@ -1189,7 +2963,7 @@ def main(page: ft.Page):
                         ft.ExpansionTile(
                             title=ft.Text("Stats"),
                             leading=ft.Icon(icons.ANALYTICS),
-                            trailing=ft.IconButton(icon=icons.REFRESH, on_click=lambda e: upd_stats()),
+                            trailing=ft.IconButton(icon=icons.REFRESH, on_click=lambda e: refresh("stats")),
                             maintain_state=True,
                             controls=[
                                 ft.Container(
@@ -1227,6 +3001,30 @@ def main(page: ft.Page):
                                 width=200,
                                 disabled=current_user_role == "worker"
                             ),
+                            ft.ElevatedButton(
+                                "Backup",
+                                icon=icons.BACKUP,
+                                on_click=lambda e: backup(),
+                                style=ft.ButtonStyle(
+                                    shape=ft.RoundedRectangleBorder(radius=8),
+                                    bgcolor=ft.colors.TEAL_600,
+                                    color=ft.colors.WHITE
+                                ),
+                                width=200,
+                                disabled=current_user_role != "admin"
+                            ),
+                            ft.ElevatedButton(
+                                "Update Selected",
+                                icon=icons.EDIT_NOTE,
+                                on_click=lambda e: bulk_action(e, "update"),
+                                style=ft.ButtonStyle(
+                                    shape=ft.RoundedRectangleBorder(radius=8),
+                                    bgcolor=ft.colors.ORANGE_600,
+                                    color=ft.colors.WHITE
+                                ),
+                                width=200,
+                                disabled=current_user_role == "worker"
+                            ),
                             ft.ElevatedButton(
                                 "Delete Selected",
                                 icon=icons.DELETE,
@@ -1256,11 +3054,17 @@ def main(page: ft.Page):
             ]
         )
 
+        loc_dd = ft.Dropdown(width=180, dense=True, value=str(cur_loc) if cur_loc else "all",
+                             options=[ft.dropdown.Option("all", "All locations")], on_change=set_loc)
+        load_locs()
         page.add(
             ft.AppBar(
                 leading=menu_btn,
                 title=ft.Text("Inv Crisoull v2.3"),
                 actions=[
+                    loc_dd,
+                    ft.IconButton(icons.ADD_LOCATION, on_click=lambda e: loc_dlg(), tooltip="New location",
+                                  disabled=current_user_role != "admin"),
                     ft.IconButton(icons.DOWNLOAD, on_click=lambda e: gen_csv(), tooltip="CSV", disabled=current_user_role == "worker"),
                     ft.IconButton(
                         icons.ANALYTICS,
@@ -1295,28 +3099,34 @@ def main(page: ft.Page):
                             disabled=current_user_role == "worker"
                         )
                     ]),
+                    dup_txt,
                     ft.Divider(),
                     ft.Row([
                         s_inp,
                         ft.ElevatedButton(
                             "Search",
-                            on_click=lambda e: upd_tools(s_inp.value),
+                            on_click=lambda e: refresh("tools"),
                             icon=icons.SEARCH
                         )
                     ]),
                     ft.Divider(),
                     tools_row,
                     ft.Divider(),
-                    ft.Row([loan_txt, tot_txt], alignment=ft.MainAxisAlignment.SPACE_BETWEEN)
+                    ft.Row([
+                        ft.Row([
+                            ft.TextButton(content=loan_txt, on_click=lambda e: overdue_dlg(), tooltip="Overdue list"),
+                            ft.IconButton(icons.BADGE, on_click=lambda e: worker_dlg(), tooltip="Worker loans")
+                        ]),
+                        ft.Row([prog, prog_txt]),
+                        tot_txt
+                    ], alignment=ft.MainAxisAlignment.SPACE_BETWEEN)
                 ], expand=True, scroll=ft.ScrollMode.AUTO)
             ], expand=True)
         )
         page.overlay.append(img_inp)
-        upd_tools()
-        upd_loans()
-        calc_tot()
-        upd_hist()
-        upd_stats()
+        sub = app.feed.subscribe(on_delta)
+        page.on_disconnect = lambda e: app.feed.unsubscribe(sub)
+        refresh("tools", "loans", "tot", "hist", "stats")
 
     # Show login UI initially
     page.add(
@@ -1328,4 +3138,5 @@ def main(page: ft.Page):
         ], alignment=ft.MainAxisAlignment.CENTER, horizontal_alignment=ft.CrossAxisAlignment.CENTER)
     )
 
-ft.app(target=main)
\ No newline at end of file
+if __name__ == "__main__":
+    ft.app(target=main)
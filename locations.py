@@ -0,0 +1,138 @@
+import json
+import sqlite3
+import threading
+import logging
+from typing import Optional, Dict, List, Any
+
+logger = logging.getLogger(__name__)
+
+# Ubicaciones (almacén, furgoneta, obra) y traslados de instancias entre ellas. Cada
+# tool_inst lleva loc_id; un traslado cambia loc_id y deja una fila en transfers en la
+# misma transacción. Las consultas por ubicación van por índices que empiezan por loc_id
+# (idx_ti_loc, idx_ti_loc_st); las listas y stats de InvApp las usan cuando se les pasa loc.
+# Entre nodos (repl.py) la ubicación viaja por nombre, no por id; transfers queda local.
+
+KINDS = ("warehouse", "van", "site")
+MAIN = "Main"  # ubicación por defecto: lo que existía antes y lo que llega sin ubicación
+
+SQL = {
+    "loc_add": 'INSERT INTO locations (name, kind) VALUES (?, ?)',
+    "loc_get": 'SELECT id FROM locations WHERE name = ?',
+    "loc_all": 'SELECT id, name, kind FROM locations WHERE active = 1 ORDER BY name',
+    "loc_insts": 'SELECT id, loc_id FROM tool_inst WHERE id IN (SELECT value FROM json_each(?))',
+    "loc_move": 'UPDATE tool_inst SET loc_id = ? WHERE id IN (SELECT value FROM json_each(?)) AND loc_id IS NOT ?',
+    "xfer_add": 'INSERT INTO transfers (i_id, src, dst, worker, date, notes) VALUES (?, ?, ?, ?, ?, ?)',
+    "xfers_inst": '''
+        SELECT x.id, s.name, d.name, x.worker, x.date, x.notes
+        FROM transfers x LEFT JOIN locations s ON s.id = x.src JOIN locations d ON d.id = x.dst
+        WHERE x.i_id = ? ORDER BY x.date DESC LIMIT ?
+    ''',
+    "xfers_loc": '''
+        SELECT x.id, t.name, ti.serial, s.name, d.name, x.worker, x.date
+        FROM transfers x
+        JOIN tool_inst ti ON ti.id = x.i_id JOIN tools t ON t.id = ti.h_id
+        LEFT JOIN locations s ON s.id = x.src JOIN locations d ON d.id = x.dst
+        WHERE x.src = ?1 OR x.dst = ?1
+        ORDER BY x.date DESC LIMIT ?2
+    ''',
+}
+
+# Planes admitidos por `bench.py plans` (ver PLAN_OK en inv2log.py)
+PLAN_OK = {
+    "loc_all": ("SCAN locations*",),  # pocas filas
+    "xfers_loc": ("USE TEMP B-TREE FOR ORDER BY",),  # OR por idx_xfer_src/idx_xfer_dst, luego se ordena
+}
+
+
+class Locations:
+    def __init__(self, conn: sqlite3.Connection, lock: Optional[threading.RLock] = None):
+        self.conn, self.c = conn, conn.cursor()
+        self.lock = lock or threading.RLock()
+        self._init_db()
+
+    def _init_db(self):
+        with self.lock:
+            self.c.executescript('''
+            CREATE TABLE IF NOT EXISTS locations (
+                id INTEGER PRIMARY KEY,
+                name TEXT UNIQUE,
+                kind TEXT DEFAULT 'warehouse' CHECK (kind IN ('warehouse', 'van', 'site')),
+                active INTEGER DEFAULT 1
+            );
+            CREATE TABLE IF NOT EXISTS transfers (
+                id INTEGER PRIMARY KEY,
+                i_id INTEGER,
+                src INTEGER REFERENCES locations (id),
+                dst INTEGER REFERENCES locations (id),
+                worker TEXT,
+                date TEXT,
+                notes TEXT,
+                FOREIGN KEY (i_id) REFERENCES tool_inst (id) ON DELETE CASCADE
+            );
+            CREATE INDEX IF NOT EXISTS idx_xfer_i ON transfers(i_id, date);
+            CREATE INDEX IF NOT EXISTS idx_xfer_src ON transfers(src, date);
+            CREATE INDEX IF NOT EXISTS idx_xfer_dst ON transfers(dst, date);
+            ''')
+            cols = [r[1] for r in self.c.execute('PRAGMA table_info(tool_inst)').fetchall()]
+            if 'loc_id' not in cols:
+                self.c.execute('ALTER TABLE tool_inst ADD COLUMN loc_id INTEGER REFERENCES locations (id)')
+            self.c.executescript('''
+            CREATE INDEX IF NOT EXISTS idx_ti_loc ON tool_inst(loc_id, h_id, ord);
+            CREATE INDEX IF NOT EXISTS idx_ti_loc_st ON tool_inst(loc_id, status);
+            ''')
+            self.main = self.get_or_add(MAIN)
+            self.fill()
+
+    def fill(self) -> int:
+        # Migración inicial e insts llegadas sin ubicación (repl de un nodo antiguo, cargas directas)
+        with self.lock:
+            self.c.execute('UPDATE tool_inst SET loc_id = ? WHERE loc_id IS NULL', (self.main,))
+            n = self.c.rowcount
+            self.conn.commit()
+        if n:
+            logger.info("Locations: %d insts -> %s", n, MAIN)
+        return n
+
+    def get(self, name: str) -> Optional[int]:
+        with self.lock:
+            self.c.execute(SQL["loc_get"], (name,))
+            r = self.c.fetchone()
+            return r[0] if r else None
+
+    def get_or_add(self, name: str, kind: str = "warehouse") -> int:
+        # Sin commit (salvo en _init_db): va en la transacción del llamador
+        with self.lock:
+            id = self.get(name)
+            if id is not None:
+                return id
+            self.c.execute(SQL["loc_add"], (name, kind))
+            return self.c.lastrowid
+
+    def all(self) -> List[Dict[str, Any]]:
+        with self.lock:
+            self.c.execute(SQL["loc_all"])
+            return [{"id": r[0], "name": r[1], "kind": r[2]} for r in self.c.fetchall()]
+
+    def move(self, i_ids: List[int], dst: int, worker: str, date: str, notes: str = "") -> int:
+        # Traslada las insts que no están ya en dst; una fila de transfers por inst. Sin commit
+        ids_j = json.dumps(i_ids)
+        with self.lock:
+            self.c.execute(SQL["loc_insts"], (ids_j,))
+            src = {r[0]: r[1] for r in self.c.fetchall() if r[1] != dst}
+            if not src:
+                return 0
+            self.c.execute(SQL["loc_move"], (dst, json.dumps(list(src)), dst))
+            self.c.executemany(SQL["xfer_add"], [(i, s, dst, worker, date, notes) for i, s in src.items()])
+            return len(src)
+
+    def of_inst(self, i_id: int, limit: int = 50) -> List[Dict[str, Any]]:
+        with self.lock:
+            self.c.execute(SQL["xfers_inst"], (i_id, limit))
+            return [{"id": r[0], "src": r[1], "dst": r[2], "worker": r[3], "date": r[4], "notes": r[5]}
+                    for r in self.c.fetchall()]
+
+    def of_loc(self, loc_id: int, limit: int = 100) -> List[Dict[str, Any]]:
+        with self.lock:
+            self.c.execute(SQL["xfers_loc"], (loc_id, limit))
+            return [{"id": r[0], "tool": r[1], "serial": r[2], "src": r[3], "dst": r[4], "worker": r[5], "date": r[6]}
+                    for r in self.c.fetchall()]
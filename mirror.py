@@ -0,0 +1,178 @@
+import sys
+import json
+import sqlite3
+import threading
+import logging
+from typing import Optional, Dict, List, Any, Callable
+
+logger = logging.getLogger(__name__)
+
+# Espejo en memoria de tools y tool_inst para búsquedas puntuales sin pasar por SQLite.
+# Se carga de golpe al arrancar y se pone al día leyendo el registro de cambios (cdc.py)
+# desde su último seq: InvApp llama a sync() en _pub, tras cada commit (lo escrito por otro
+# proceso entra en el siguiente). Las lecturas no toman el lock (un dict.get es atómico) y
+# devuelven los mismos objetos inmutables; quien no encuentra una fila va a disco.
+# Si la carga o el crecimiento pasa de budget_mb se apaga y todo vuelve a ir a disco.
+
+TOOL_SQL = 'SELECT id, tool_uuid, name, resp, qty, is_consumable, img, status FROM tools'
+INST_SQL = 'SELECT id, h_id, tool_uuid, serial, status, qr_uuid, img, ord, loc_id FROM tool_inst'
+RELOAD = 50_000  # más cambios pendientes que esto: recarga entera
+
+
+def _size(o) -> int:
+    # Aproximado por exceso: el objeto más sus cadenas (las internadas cuentan de más)
+    return sys.getsizeof(o) + sum(sys.getsizeof(v) for v in (getattr(o, f) for f in o.__slots__) if isinstance(v, str))
+
+
+class Mirror:
+    def __init__(self, conn: sqlite3.Connection, tool: Callable, inst: Callable,
+                 lock: Optional[threading.RLock] = None, budget_mb: float = 128):
+        self.conn, self.c = conn, conn.cursor()
+        self.lock = lock or threading.RLock()
+        self.budget = int(budget_mb * 2**20)
+        self._tool, self._inst = tool, inst  # constructores de fila (Tool, ToolInst)
+        self.on = False
+        self.seq = 0
+        self.bytes = 0
+        self._clear()
+
+    def _clear(self):
+        self.tools: Dict[int, Any] = {}
+        self.insts: Dict[int, Any] = {}
+        self.by_uuid: Dict[str, int] = {}
+        self.by_serial: Dict[str, int] = {}
+        self.by_qr: Dict[str, int] = {}
+        self.by_h: Dict[int, Dict[int, int]] = {}  # h_id -> {i_id: ord}
+        self.loc_of: Dict[int, Optional[int]] = {}  # i_id -> loc_id
+
+    def _off(self, why: str):
+        self.on = False
+        self._clear()
+        self.bytes = 0
+        logger.warning("Mirror off (%s): lookups go to disk", why)
+
+    def load(self) -> bool:
+        if self.budget <= 0:
+            return False
+        with self.lock:
+            self.on = False
+            self._clear()
+            self.c.execute('SELECT COALESCE(MAX(seq), 0) FROM changes')
+            self.seq = self.c.fetchone()[0]
+            n = 0
+            for r in self.conn.execute(TOOL_SQL):
+                n += self._put_tool(r)
+                if n > self.budget:
+                    self._off(f"tools > {self.budget >> 20} MiB")
+                    return False
+            for r in self.conn.execute(INST_SQL):
+                n += self._put_inst(r)
+                if n > self.budget:
+                    self._off(f"insts > {self.budget >> 20} MiB")
+                    return False
+            self.bytes = n + self._dicts()
+            self.on = self.bytes <= self.budget
+            if not self.on:
+                self._off(f"{self.bytes >> 20} MiB > {self.budget >> 20} MiB")
+            return self.on
+
+    def _dicts(self) -> int:
+        return sum(sys.getsizeof(d) for d in (self.tools, self.insts, self.by_uuid, self.by_serial, self.by_qr, self.by_h, self.loc_of))
+
+    def _put_tool(self, r) -> int:
+        t = self._tool(r[0], r[1], r[2], r[3], r[4], bool(r[5]), r[6], r[7])
+        old = self.tools.get(r[0])
+        if old is not None and old.tool_uuid != r[1]:
+            self.by_uuid.pop(old.tool_uuid, None)
+        self.tools[r[0]] = t
+        self.by_uuid[r[1]] = r[0]
+        return _size(t)
+
+    def _put_inst(self, r) -> int:
+        i = self._inst(*r[:7])
+        old = self.insts.get(r[0])
+        if old is not None:
+            self._drop_inst(r[0])
+        self.insts[r[0]] = i
+        self.by_serial[r[3]] = r[0]
+        self.by_qr[r[5]] = r[0]
+        self.by_h.setdefault(r[1], {})[r[0]] = r[7] or 0
+        self.loc_of[r[0]] = r[8]
+        return _size(i) + 144
+
+    def _drop_inst(self, i_id: int):
+        old = self.insts.pop(i_id, None)
+        if old is None:
+            return
+        self.by_serial.pop(old.serial, None)
+        self.by_qr.pop(old.qr_uuid, None)
+        self.loc_of.pop(i_id, None)
+        h = self.by_h.get(old.h_id)
+        if h is not None:
+            h.pop(i_id, None)
+            if not h:
+                del self.by_h[old.h_id]
+
+    def sync(self):
+        # Aplica los cambios de tools/tool_inst desde self.seq (con el lock tomado por el llamador o aquí)
+        if not self.on:
+            return
+        with self.lock:
+            # Una sola consulta por el rango de seq; las filas de otras tablas se saltan aquí
+            self.c.execute('SELECT seq, tbl, op, row_id, data FROM changes WHERE seq > ? ORDER BY seq LIMIT ?',
+                           (self.seq, RELOAD + 1))
+            rows = self.c.fetchall()
+            if len(rows) > RELOAD:
+                self.load()
+                return
+            if rows:
+                self.seq = rows[-1][0]
+            n = 0
+            for _, tbl, op, id, data in rows:
+                if tbl != "tools" and tbl != "tool_inst":
+                    continue
+                if op == "D":
+                    if tbl == "tool_inst":
+                        self._drop_inst(id)
+                    else:
+                        old = self.tools.pop(id, None)
+                        if old is not None:
+                            self.by_uuid.pop(old.tool_uuid, None)
+                    continue
+                d = json.loads(data)
+                if tbl == "tools":
+                    n += self._put_tool((id, d["tool_uuid"], d["name"], d["resp"], d["qty"], d["is_consumable"], d["img"], d["status"]))
+                else:
+                    n += self._put_inst((id, d["h_id"], d["tool_uuid"], d["serial"], d["status"], d["qr_uuid"], d["img"], d["ord"], d.get("loc_id")))
+            self.bytes += n
+            if self.bytes > self.budget:
+                self._off(f"grew past {self.budget >> 20} MiB")
+
+    # Búsquedas: None = no existe. Solo válidas con self.on
+    def tool(self, id: int):
+        return self.tools.get(id)
+
+    def tool_by_uuid(self, tool_uuid: str):
+        id = self.by_uuid.get(tool_uuid)
+        return None if id is None else self.tools.get(id)
+
+    def inst(self, i_id: int):
+        return self.insts.get(i_id)
+
+    def inst_by_serial(self, serial: str):
+        i = self.by_serial.get(serial)
+        return None if i is None else self.insts.get(i)
+
+    def inst_by_qr(self, qr_uuid: str):
+        i = self.by_qr.get(qr_uuid)
+        return None if i is None else self.insts.get(i)
+
+    def insts_of(self, h_id: int, loc: Optional[int] = None) -> List[Any]:
+        h = self.by_h.get(h_id)
+        if not h:
+            return []
+        return [self.insts[i] for i in sorted(h, key=h.get) if loc is None or self.loc_of.get(i) == loc]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"on": self.on, "tools": len(self.tools), "insts": len(self.insts),
+                "mb": round(self.bytes / 2**20, 1), "budget_mb": self.budget >> 20, "seq": self.seq}
@@ -0,0 +1,139 @@
+import sqlite3
+import threading
+import logging
+import datetime as dt
+from typing import Optional, Callable, List, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+# Cola persistente de préstamos vencidos. Cada tick solo mira los préstamos abiertos
+# cuyo `due` cae en (último tick, ahora], por el índice parcial idx_loans_due; las
+# devoluciones sacan su fila de la cola en la misma transacción (QRMgr.reg_ret).
+
+OVERDUE_HRS = 24  # plazo por defecto si la herramienta no tiene loan_hrs
+FMT = "%Y-%m-%d %H:%M:%S"
+
+
+class OverdueSched:
+    def __init__(self, conn: sqlite3.Connection, lock: Optional[threading.RLock] = None,
+                 notify: Optional[Callable[[List[Dict[str, Any]]], None]] = None, every: float = 60):
+        self.conn, self.c = conn, conn.cursor()
+        self.lock = lock or threading.RLock()
+        self.notify = notify  # recibe la tanda de vencidos nuevos de cada tick
+        self.every = every
+        self._stop = threading.Event()
+        self._t = None
+        self._init_db()
+
+    def _init_db(self):
+        with self.lock:
+            self.c.executescript('''
+            CREATE TABLE IF NOT EXISTS overdue (
+                l_id INTEGER PRIMARY KEY,
+                h_id INTEGER,
+                i_id INTEGER,
+                worker TEXT,
+                due TEXT,
+                notified INTEGER DEFAULT 0,
+                FOREIGN KEY (l_id) REFERENCES loans (id) ON DELETE CASCADE
+            );
+            CREATE INDEX IF NOT EXISTS idx_overdue_i_id ON overdue(i_id);
+            CREATE INDEX IF NOT EXISTS idx_overdue_new ON overdue(notified) WHERE notified = 0;
+            ''')
+            self.conn.commit()
+
+    def _last(self) -> str:
+        self.c.execute('SELECT v FROM cfg WHERE k = "od_tick"')
+        r = self.c.fetchone()
+        return r[0] if r else ""
+
+    def tick(self, now: Optional[str] = None) -> List[Dict[str, Any]]:
+        # Encola lo que venció desde el último tick y notifica en una sola tanda
+        now = now or dt.datetime.now().strftime(FMT)
+        with self.lock:
+            last = self._last()
+            self.c.execute('''
+                INSERT OR IGNORE INTO overdue (l_id, h_id, i_id, worker, due)
+                SELECT id, h_id, i_id, worker, due FROM loans
+                WHERE closed IS NULL AND due > ? AND due <= ?
+            ''', (last, now))
+            self.c.execute('''
+                SELECT o.l_id, t.name, ti.serial, o.worker, o.due
+                FROM overdue o
+                JOIN tools t ON t.id = o.h_id
+                JOIN tool_inst ti ON ti.id = o.i_id
+                WHERE o.notified = 0
+            ''')
+            batch = [{"id": r[0], "tool": r[1], "serial": r[2], "worker": r[3], "due": r[4]} for r in self.c.fetchall()]
+            self.c.execute('UPDATE overdue SET notified = 1 WHERE notified = 0')
+            self.c.execute('INSERT OR REPLACE INTO cfg (k, v) VALUES ("od_tick", ?)', (now,))
+            self.conn.commit()
+        if batch and self.notify:
+            try:
+                self.notify(batch)
+            except Exception as e:
+                logger.error("Overdue notify err: %s", e)
+        return batch
+
+    def resync(self, h_id: int):
+        # Tras cambiar el plazo de una herramienta: recalcula su parte de la cola
+        with self.lock:
+            last = self._last()
+            self.c.execute('''
+                DELETE FROM overdue WHERE h_id = ?
+                AND l_id IN (SELECT id FROM loans WHERE h_id = ? AND due > ?)
+            ''', (h_id, h_id, last))
+            self.c.execute('''
+                INSERT OR IGNORE INTO overdue (l_id, h_id, i_id, worker, due)
+                SELECT id, h_id, i_id, worker, due FROM loans
+                WHERE h_id = ? AND closed IS NULL AND due <= ?
+            ''', (h_id, last))
+            self.c.execute('UPDATE overdue SET due = (SELECT due FROM loans WHERE id = l_id) WHERE h_id = ?', (h_id,))
+
+    def queue(self, limit: int = 500, loc: Optional[int] = None) -> List[Dict[str, Any]]:
+        # loc: solo las insts que están en esa ubicación (None = todas)
+        now = dt.datetime.now()
+        with self.lock:
+            self.c.execute('''
+                SELECT o.l_id, t.name, ti.serial, o.worker, o.due, l.date
+                FROM overdue o
+                JOIN loans l ON l.id = o.l_id
+                JOIN tools t ON t.id = o.h_id
+                JOIN tool_inst ti ON ti.id = o.i_id
+                WHERE ?2 IS NULL OR ti.loc_id = ?2
+                ORDER BY o.due LIMIT ?1
+            ''', (limit, loc))
+            rows = self.c.fetchall()
+        return [{
+            "id": r[0],
+            "tool": r[1],
+            "serial": r[2],
+            "worker": r[3],
+            "date": r[5],
+            "due": r[4],
+            "hrs_overdue": round((now - dt.datetime.strptime(r[4], FMT)).total_seconds() / 3600, 2)
+        } for r in rows]
+
+    def count(self, loc: Optional[int] = None) -> int:
+        with self.lock:
+            if loc is None:
+                self.c.execute('SELECT COUNT(*) FROM overdue')
+            else:
+                self.c.execute('SELECT COUNT(*) FROM overdue o JOIN tool_inst ti ON ti.id = o.i_id WHERE ti.loc_id = ?', (loc,))
+            return self.c.fetchone()[0]
+
+    def start(self):
+        if self._t is None:
+            self._t = threading.Thread(target=self._run, name="inv-overdue", daemon=True)
+            self._t.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.tick()
+            except sqlite3.Error as e:
+                logger.error("Overdue tick err: %s", e)
+            self._stop.wait(self.every)
@@ -0,0 +1,192 @@
+import mmap
+import os
+import re
+import sqlite3
+import threading
+import logging
+from typing import Optional, Dict
+
+logger = logging.getLogger(__name__)
+
+# Almacén empaquetado de PNG de QR: un único fichero append-only (qrs.<gen>.pack)
+# más un índice (qr_uuid -> offset, len) en la tabla qr_pack de inv.db.
+# La compactación escribe una nueva generación y cambia el índice en una sola
+# transacción, así un corte a mitad de gc() nunca deja offsets apuntando mal.
+
+GC_DEAD = 0.5  # gc automático cuando más de la mitad del pack ya no es de ningún código vivo
+GC_MIN = 1 << 20  # ... y el pack pasa de 1 MiB: por debajo no compensa reescribirlo
+LEGACY_RE = re.compile(r"^qr_(?P<tool_uuid>[0-9a-f-]{36})_(?P<i_id>\d+)_(?P<uuid>[0-9a-f-]{36})\.png$")
+
+
+class QRPack:
+    def __init__(self, conn: sqlite3.Connection, pack_dir: str, lock: Optional[threading.RLock] = None):
+        self.conn, self.c = conn, conn.cursor()
+        self.dir = os.path.abspath(pack_dir)
+        os.makedirs(self.dir, exist_ok=True)
+        self._lock = lock or threading.RLock()  # el mismo lock que el resto de usuarios de conn
+        self._mm = None
+        self._mm_len = 0
+        self._init_db()
+        self.gen = self._gen()
+        self._fh = open(self.path, "ab")
+
+    def _init_db(self):
+        self.c.executescript('''
+        CREATE TABLE IF NOT EXISTS qr_pack (
+            qr_uuid TEXT PRIMARY KEY,
+            off INTEGER,
+            len INTEGER,
+            live INTEGER DEFAULT 1
+        );
+        CREATE INDEX IF NOT EXISTS idx_qr_pack_live ON qr_pack(live);
+        ''')
+        self.conn.commit()
+
+    def _gen(self) -> int:
+        self.c.execute('SELECT v FROM cfg WHERE k = "qr_pack_gen"')
+        r = self.c.fetchone()
+        return int(r[0]) if r else 0
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.dir, f"qrs.{self.gen}.pack")
+
+    def _view(self, end: int) -> Optional[mmap.mmap]:
+        # Re-mapea solo cuando el fichero creció más allá de lo mapeado
+        if self._mm is None or end > self._mm_len:
+            self._fh.flush()
+            size = os.path.getsize(self.path)
+            if size == 0:
+                return None
+            if self._mm is not None:
+                self._mm.close()
+            with open(self.path, "rb") as f:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mm_len = size
+        return self._mm
+
+    def get(self, qr_uuid: str) -> Optional[bytes]:
+        with self._lock:
+            self.c.execute('SELECT off, len FROM qr_pack WHERE qr_uuid = ? AND live = 1', (qr_uuid,))
+            r = self.c.fetchone()
+            if not r:
+                return None
+            off, n = r
+            mm = self._view(off + n)
+            if mm is None or off + n > self._mm_len:
+                return None
+            return mm[off:off + n]
+
+    def has(self, qr_uuid: str) -> bool:
+        with self._lock:
+            self.c.execute('SELECT 1 FROM qr_pack WHERE qr_uuid = ? AND live = 1', (qr_uuid,))
+            return self.c.fetchone() is not None
+
+    def put(self, qr_uuid: str, data: bytes, commit: bool = True):
+        with self._lock:
+            self._fh.seek(0, os.SEEK_END)
+            off = self._fh.tell()
+            self._fh.write(data)
+            self._fh.flush()
+            self.c.execute(
+                'INSERT OR REPLACE INTO qr_pack (qr_uuid, off, len, live) VALUES (?, ?, ?, 1)',
+                (qr_uuid, off, len(data))
+            )
+            if commit:
+                self.conn.commit()
+
+    def drop(self, qr_uuid: str):
+        # Marca como sustituido; el espacio se recupera en gc()
+        with self._lock:
+            self.c.execute('UPDATE qr_pack SET live = 0 WHERE qr_uuid = ?', (qr_uuid,))
+
+    def size(self) -> int:
+        with self._lock:
+            self._fh.flush()
+            return os.path.getsize(self.path)
+
+    def dead(self) -> float:
+        # Fracción del fichero sustituida (live = 0); gc() además quita lo que ya no está en h_qr
+        with self._lock:
+            n = self.size()
+            self.c.execute('SELECT COALESCE(SUM(len), 0) FROM qr_pack WHERE live = 1')
+            return 1 - self.c.fetchone()[0] / n if n else 0.0
+
+    def gc(self) -> Dict[str, int]:
+        with self._lock:
+            # Vivo = sigue registrado en h_qr
+            self.c.execute('''
+                UPDATE qr_pack SET live = 0
+                WHERE live = 1 AND qr_uuid NOT IN (SELECT qr_uuid FROM h_qr WHERE qr_uuid IS NOT NULL)
+            ''')
+            self.c.execute('SELECT qr_uuid, off, len FROM qr_pack WHERE live = 1 ORDER BY off')
+            rows = self.c.fetchall()
+            old_path, old_size = self.path, os.path.getsize(self.path)
+            new_gen = self.gen + 1
+            new_path = os.path.join(self.dir, f"qrs.{new_gen}.pack")
+            mm = self._view(old_size)
+            moved = []
+            with open(new_path, "wb") as f:
+                for qr_uuid, off, n in rows:
+                    moved.append((f.tell(), qr_uuid))
+                    f.write(mm[off:off + n])
+                f.flush()
+                os.fsync(f.fileno())
+            self.c.execute('DELETE FROM qr_pack WHERE live = 0')
+            self.c.executemany('UPDATE qr_pack SET off = ? WHERE qr_uuid = ?', moved)
+            self.c.execute('INSERT OR REPLACE INTO cfg (k, v) VALUES ("qr_pack_gen", ?)', (str(new_gen),))
+            self.conn.commit()
+            self._close()
+            self.gen = new_gen
+            self._fh = open(self.path, "ab")
+            os.remove(old_path)
+            new_size = os.path.getsize(self.path)
+            logger.info("QR pack gc: %d live, %d -> %d bytes", len(rows), old_size, new_size)
+            return {"live": len(rows), "before": old_size, "after": new_size}
+
+    def migrate_dir(self, qr_dir: str) -> Dict[str, int]:
+        # Importa qr_<tool_uuid>_<i_id>_<uuid>.png aún referenciados en h_qr bajo el qr_uuid actual
+        # de su inst (la clave que usan reg_qr/gen_qr) y solo entonces borra el fichero. Los que no
+        # tienen inst viva se quedan en disco.
+        stats = {"imported": 0, "orphans": 0}
+        with self._lock:
+            self.c.execute('''
+                SELECT h.id, h.img, ti.qr_uuid FROM h_qr h JOIN tool_inst ti ON ti.id = h.i_id
+                WHERE h.img IS NOT NULL AND ti.qr_uuid IS NOT NULL
+            ''')
+            refs = {os.path.basename(img): (h_id, qr_uuid) for h_id, img, qr_uuid in self.c.fetchall()}
+            done, h_ids = [], []
+            for fname in sorted(os.listdir(qr_dir)):
+                if not LEGACY_RE.match(fname):
+                    continue
+                ref = refs.get(fname)
+                if not ref:
+                    stats["orphans"] += 1
+                    continue
+                if not self.has(ref[1]):
+                    with open(os.path.join(qr_dir, fname), "rb") as f:
+                        self.put(ref[1], f.read(), commit=False)
+                    stats["imported"] += 1
+                done.append(fname)
+                h_ids.append(ref[0])
+            # h_qr pasa al qr_uuid de la inst, como haría reg_qr: gc() conserva lo que está en h_qr
+            self.c.executemany('''
+                UPDATE OR IGNORE h_qr SET qr_uuid = (SELECT ti.qr_uuid FROM tool_inst ti WHERE ti.id = h_qr.i_id),
+                    img = NULL
+                WHERE id = ?
+            ''', [(h,) for h in h_ids])
+            self.conn.commit()
+            for fname in done:
+                os.remove(os.path.join(qr_dir, fname))
+        logger.info("QR pack migrate: %s", stats)
+        return stats
+
+    def _close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm, self._mm_len = None, 0
+        self._fh.close()
+
+    def close(self):
+        with self._lock:
+            self._close()
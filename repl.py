@@ -0,0 +1,326 @@
+import os
+import sys
+import json
+import zlib
+import uuid
+import sqlite3
+import argparse
+import threading
+import logging
+from typing import Optional, Dict, List, Any, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Replicación entre talleres por ficheros de cambios (changesets), sobre el registro
+# CDC de cdc.py. Los ids enteros son locales de cada nodo, así que todo viaja por
+# clave natural: tools por tool_uuid, tool_inst por serial (qr_uuid es atributo y puede
+# cambiar con regen_qr), loans/rets por (serial, date). La ubicación de una inst viaja
+# como `loc` (nombre de locations); al aplicar se crea si no existe.
+#
+# Fichero: MAGIC + zlib(JSON {node, lo, hi, cols, rows}). Las filas se compactan: de
+# varias versiones de una misma clave solo viaja la última.
+#
+# Reglas de conflicto (una clave cambiada en los dos nodos desde el último intercambio):
+#   - tools/tool_inst: gana la versión más reciente (ts), empate -> mayor id de nodo
+#   - un borrado de tool/inst gana siempre (no se resucitan filas)
+#   - qr_uuid ya usado por otra inst local: la fila remota se descarta
+#   - loans/rets son historial: se insertan si faltan; closed solo pasa de NULL a fecha
+#   - los borrados de tools se aplican al final: en una fusión las insts de la origen ya
+#     apuntan a la destino y la cascada no se lleva su historial
+#
+# Lo aplicado desde un nodo queda en repl_in (rango de seq local) y no se le devuelve.
+
+MAGIC = b"INVCS1"
+TBLS = ("tools", "tool_inst", "loans", "rets")
+LOCAL = {"id", "h_id", "i_id", "w_id", "loc_id"}  # columnas que no viajan (w_id lo rehace Workers.link)
+
+
+def _key(tbl: str, d: Dict[str, Any]) -> Any:
+    if tbl == "tools":
+        return d["tool_uuid"]
+    if tbl == "tool_inst":
+        return d["serial"]
+    return d["serial"], d["date"]
+
+
+def read(path: str) -> Dict[str, Any]:
+    with open(path, "rb") as f:
+        b = f.read()
+    if not b.startswith(MAGIC):
+        raise ValueError(f"{path}: not a changeset")
+    return json.loads(zlib.decompress(b[len(MAGIC):]))
+
+
+class Repl:
+    def __init__(self, conn: sqlite3.Connection, lock: Optional[threading.RLock] = None):
+        self.conn, self.c = conn, conn.cursor()
+        self.lock = lock or threading.RLock()
+        self._init_db()
+        self.node = self._node()
+
+    def _init_db(self):
+        with self.lock:
+            self.c.executescript('''
+            CREATE TABLE IF NOT EXISTS repl_in (
+                node TEXT,
+                lo INTEGER,
+                hi INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS idx_repl_in ON repl_in(node, lo);
+            CREATE INDEX IF NOT EXISTS idx_loans_i_date ON loans(i_id, date);
+            CREATE INDEX IF NOT EXISTS idx_rets_i_date ON rets(i_id, date);
+            ''')
+            self.conn.commit()
+
+    def _node(self) -> str:
+        with self.lock:
+            self.c.execute('SELECT v FROM cfg WHERE k = "node_id"')
+            r = self.c.fetchone()
+            if r:
+                return r[0]
+            node = str(uuid.uuid4())
+            self.c.execute('INSERT INTO cfg (k, v) VALUES ("node_id", ?)', (node,))
+            self.conn.commit()
+            return node
+
+    def reset_node(self) -> str:
+        # Para un sitio nuevo sembrado con una copia de otro: identidad propia, y lo
+        # heredado en changes (ya presente en el origen) no se vuelve a exportar
+        with self.lock:
+            self.node = str(uuid.uuid4())
+            self.c.execute('DELETE FROM cfg WHERE k = "node_id" OR k LIKE "repl_%"')
+            self.c.execute('DELETE FROM repl_in')
+            self.c.execute('INSERT INTO cfg (k, v) VALUES ("node_id", ?)', (self.node,))
+            self.c.execute('INSERT INTO cfg (k, v) SELECT "repl_base", COALESCE(MAX(seq), 0) FROM changes')
+            self.conn.commit()
+            return self.node
+
+    def _base(self) -> int:
+        self.c.execute('SELECT v FROM cfg WHERE k = "repl_base"')
+        r = self.c.fetchone()
+        return int(r[0]) if r else 0
+
+    def _wm(self, kind: str, peer: str) -> int:
+        self.c.execute('SELECT v FROM cfg WHERE k = ?', (f"repl_{kind}:{peer}",))
+        r = self.c.fetchone()
+        return int(r[0]) if r else 0
+
+    def _set_wm(self, kind: str, peer: str, seq: int):
+        self.c.execute('INSERT OR REPLACE INTO cfg (k, v) VALUES (?, ?)', (f"repl_{kind}:{peer}", str(seq)))
+
+    def _compact(self, lo: int, peer: str) -> Tuple[int, Dict[Tuple[str, Any], tuple]]:
+        # Última versión de cada clave cambiada desde `lo`. Si esa última versión vino
+        # de `peer` (rango en repl_in) la clave no cuenta como cambio local: así un
+        # borrado recibido tapa una edición local anterior y no se le devuelve nada.
+        self.c.execute(f'''
+            SELECT tbl, op, data, ts, EXISTS (SELECT 1 FROM repl_in r WHERE r.node = ? AND c.seq BETWEEN r.lo AND r.hi)
+            FROM changes c WHERE seq > ? AND tbl IN ({",".join("?" * len(TBLS))})
+            ORDER BY seq
+        ''', (peer, lo, *TBLS))
+        rows = self.c.fetchall()
+        # i_id -> serial: las insts vivas más las que aparecen en el propio lote (borradas después)
+        self.c.execute('SELECT id, serial FROM tool_inst')
+        serial = dict(self.c.fetchall())
+        locs = None  # loc_id -> nombre, al primer uso
+        last: Dict[Tuple[str, Any], tuple] = {}
+        for tbl, op, data, ts, echo in rows:
+            d = json.loads(data)
+            if tbl == "tool_inst":
+                serial.setdefault(d["id"], d["serial"])
+                if d.get("loc_id") is not None:
+                    if locs is None:
+                        locs = dict(self.c.execute('SELECT id, name FROM locations').fetchall())
+                    d["loc"] = locs.get(d["loc_id"])
+            elif "i_id" in d:
+                s = serial.get(d["i_id"])
+                if s is None:
+                    continue  # inst borrada sin rastro: la cascada ya quitó la fila
+                d["serial"] = s
+            k = (tbl, _key(tbl, d))
+            last.pop(k, None)  # reinsertar conserva el orden del último cambio
+            last[k] = (op, ts, d, echo)
+        return len(rows), {k: v[:3] for k, v in last.items() if not v[3]}
+
+    def export(self, path: str, peer: str, since: Optional[int] = None) -> Dict[str, Any]:
+        with self.lock:
+            lo = max(self._wm("out", peer), self._base()) if since is None else since
+            n, last = self._compact(lo, peer)
+            self.c.execute('SELECT COALESCE(MAX(seq), 0) FROM changes')
+            hi = self.c.fetchone()[0]
+        # Columnas: unión ordenada de las claves de todas las filas. Las anotadas antes de una
+        # migración no traen la columna nueva (loc_id, w_id...) y no deben quitársela a las demás
+        cols: Dict[str, Dict[str, None]] = {t: {} for t in TBLS}
+        for (tbl, _), (_, _, d) in last.items():
+            cols[tbl].update((c, None) for c in d if c not in LOCAL)
+        out = {t: [] for t in TBLS}
+        for (tbl, _), (op, ts, d) in last.items():
+            out[tbl].append([op, ts] + [d.get(c) for c in cols[tbl]])
+        b = MAGIC + zlib.compress(json.dumps({
+            "node": self.node, "lo": lo, "hi": hi, "cols": {t: list(c) for t, c in cols.items()}, "rows": out
+        }, separators=(",", ":")).encode(), 6)
+        with open(path + ".part", "wb") as f:
+            f.write(b)
+        os.replace(path + ".part", path)
+        with self.lock:
+            self._set_wm("out", peer, hi)
+            self.conn.commit()
+        res = {"changes": n, "rows": sum(map(len, out.values())), "bytes": len(b), "lo": lo, "hi": hi}
+        logger.info("Repl export -> %s: %s", peer, res)
+        return res
+
+    def apply(self, path: str) -> Dict[str, Any]:
+        cs = read(path)
+        src = cs["node"]
+        res = {"node": src, "applied": 0, "conflicts": 0, "skipped": 0, "gap": False, "tools": set()}
+        if src == self.node:
+            raise ValueError("Changeset from this node")
+        with self.lock:
+            done = self._wm("in", src)
+            if cs["hi"] <= done:
+                return res  # ya aplicado
+            res["gap"] = bool(done) and cs["lo"] > done  # faltan changesets intermedios de src
+            self.c.execute('SELECT COALESCE(MAX(seq), 0) FROM changes')
+            before = self.c.fetchone()[0]
+            # Claves cambiadas aquí desde el último envío a src: (op, ts) de su última versión
+            _, last = self._compact(max(self._wm("out", src), self._base()), src)
+            mine = {k: v[:2] for k, v in last.items() if k[0] in ("tools", "tool_inst")}
+            rows = {t: [(r[0], r[1], dict(zip(cs["cols"][t], r[2:]))) for r in cs["rows"][t]] for t in TBLS}
+            steps = [("tools", [r for r in rows["tools"] if r[0] != "D"]), *((t, rows[t]) for t in TBLS[1:]),
+                     ("tools", [r for r in rows["tools"] if r[0] == "D"])]
+            try:
+                for tbl, rs in steps:
+                    for op, ts, d in rs:
+                        n = getattr(self, f"_ap_{tbl}")(op, ts, d, mine, src, res)
+                        res["applied" if n else "skipped"] += 1
+                self.c.execute('SELECT COALESCE(MAX(seq), 0) FROM changes')
+                after = self.c.fetchone()[0]
+                if after > before:
+                    self.c.execute('INSERT INTO repl_in (node, lo, hi) VALUES (?, ?, ?)', (src, before + 1, after))
+                self._set_wm("in", src, cs["hi"])
+                self.conn.commit()
+            except sqlite3.Error:
+                self.conn.rollback()
+                raise
+        res["skipped"] -= res["conflicts"]
+        logger.info("Repl apply <- %s: %s", src, {k: v for k, v in res.items() if k != "tools"})
+        return res
+
+    def _lww(self, tbl: str, key: Any, ts: str, mine: Dict, src: str, res: Dict) -> bool:
+        # True si la versión remota gana
+        op, t = mine.get((tbl, key), (None, None))
+        if op is None or op != "D" and (ts > t or (ts == t and src > self.node)):
+            return True
+        res["conflicts"] += 1
+        return False
+
+    def _upsert(self, tbl: str, key: str, d: Dict[str, Any], extra: Dict[str, str]):
+        cols = list(d)
+        names = list(extra) + cols
+        vals = ", ".join([extra[c] for c in extra] + ["?"] * len(cols))
+        upd = ", ".join(f"{c} = excluded.{c}" for c in names if c != key)
+        src = f'SELECT {vals} FROM tools WHERE tool_uuid = ?' if extra else f'SELECT {vals} WHERE 1'
+        self.c.execute(f'''
+            INSERT INTO {tbl} ({", ".join(names)}) {src}
+            ON CONFLICT({key}) DO UPDATE SET {upd}
+        ''', [d[c] for c in cols] + ([d["tool_uuid"]] if extra else []))
+
+    def _ap_tools(self, op, ts, d, mine, src, res) -> int:
+        k = d["tool_uuid"]
+        if op == "D":
+            self.c.execute('SELECT id FROM tools WHERE tool_uuid = ?', (k,))
+            r = self.c.fetchone()
+            if r:
+                res["tools"].add(r[0])
+                self.c.execute('DELETE FROM tools WHERE id = ?', (r[0],))
+            return self.c.rowcount if r else 0
+        if not self._lww("tools", k, ts, mine, src, res):
+            return 0
+        self._upsert("tools", "tool_uuid", d, {})
+        self.c.execute('SELECT id FROM tools WHERE tool_uuid = ?', (k,))
+        res["tools"].add(self.c.fetchone()[0])
+        return 1
+
+    def _ap_tool_inst(self, op, ts, d, mine, src, res) -> int:
+        k = d["serial"]
+        if op == "D":
+            self.c.execute('DELETE FROM tool_inst WHERE serial = ?', (k,))
+            return self.c.rowcount
+        if not self._lww("tool_inst", k, ts, mine, src, res):
+            return 0
+        self.c.execute('SELECT serial FROM tool_inst WHERE qr_uuid = ?', (d["qr_uuid"],))
+        r = self.c.fetchone()
+        if r and r[0] != k:
+            res["conflicts"] += 1
+            return 0
+        loc = d.pop("loc", None)
+        if loc:
+            self.c.execute('INSERT OR IGNORE INTO locations (name) VALUES (?)', (loc,))
+            d["loc_id"] = self.c.execute('SELECT id FROM locations WHERE name = ?', (loc,)).fetchone()[0]
+        self._upsert("tool_inst", "serial", d, {"h_id": "id"})
+        return self.c.rowcount
+
+    def _ap_loans(self, op, ts, d, mine, src, res) -> int:
+        self.c.execute('''
+            UPDATE loans SET closed = ? WHERE i_id = (SELECT id FROM tool_inst WHERE serial = ?)
+            AND date = ? AND closed IS NULL AND ? IS NOT NULL
+        ''', (d["closed"], d["serial"], d["date"], d["closed"]))
+        if self.c.rowcount:
+            return 1
+        self.c.execute('''
+            INSERT INTO loans (h_id, i_id, worker, date, due, closed)
+            SELECT ti.h_id, ti.id, ?, ?, ?, ? FROM tool_inst ti WHERE ti.serial = ?
+            AND NOT EXISTS (SELECT 1 FROM loans l WHERE l.i_id = ti.id AND l.date = ?)
+        ''', (d["worker"], d["date"], d["due"], d["closed"], d["serial"], d["date"]))
+        return self.c.rowcount
+
+    def _ap_rets(self, op, ts, d, mine, src, res) -> int:
+        self.c.execute('''
+            INSERT INTO rets (h_id, i_id, worker, date, notes)
+            SELECT ti.h_id, ti.id, ?, ?, ? FROM tool_inst ti WHERE ti.serial = ?
+            AND NOT EXISTS (SELECT 1 FROM rets r WHERE r.i_id = ti.id AND r.date = ?)
+        ''', (d["worker"], d["date"], d["notes"], d["serial"], d["date"]))
+        return self.c.rowcount
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    # Uso (con la app parada o en marcha; en marcha mejor desde InvApp.sync_out/sync_in):
+    #   python repl.py export --db inv.db --peer <node_id> out.invcs
+    #   python repl.py apply --db inv.db in.invcs
+    #   python repl.py node --db inv.db [--reset]      (--reset tras sembrar un sitio con una copia)
+    from cdc import ChangeLog
+    p = argparse.ArgumentParser(prog="repl.py")
+    sp = p.add_subparsers(dest="cmd", required=True)
+    e = sp.add_parser("export")
+    e.add_argument("path")
+    e.add_argument("--peer", required=True)
+    e.add_argument("--since", type=int)
+    a_ = sp.add_parser("apply")
+    a_.add_argument("path")
+    n = sp.add_parser("node")
+    n.add_argument("--reset", action="store_true")
+    for s in (e, a_, n):
+        s.add_argument("--db", default="inv.db")
+    a = p.parse_args(argv)
+    conn = sqlite3.connect(a.db)
+    conn.execute('PRAGMA foreign_keys = ON')
+    ChangeLog(conn)
+    r = Repl(conn)
+    try:
+        if a.cmd == "export":
+            print(json.dumps(r.export(a.path, a.peer, a.since)))
+        elif a.cmd == "apply":
+            res = r.apply(a.path)
+            res["tools"] = len(res["tools"])
+            print(json.dumps(res))
+        else:
+            print(r.reset_node() if a.reset else r.node)
+    except (ValueError, sqlite3.Error) as ex:
+        print(f"repl: {ex}", file=sys.stderr)
+        return 1
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
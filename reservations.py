@@ -0,0 +1,161 @@
+import sqlite3
+import threading
+import calendar
+import logging
+import datetime as dt
+from typing import Optional, Dict, List, Any, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Reservas de instancias por intervalo [start, end). Las activas están además en un
+# R*Tree (rtree_i32) de dos dimensiones: i_id (punto) y el intervalo en minutos epoch.
+# Los triggers lo mantienen en la misma transacción que la fila, así que también siguen
+# los borrados en cascada. El R*Tree da candidatos redondeados al minuto hacia fuera;
+# la comparación exacta de start/end se hace después sobre la fila.
+
+FMT = "%Y-%m-%d %H:%M:%S"
+
+SQL = {
+    "res_add": 'INSERT INTO reservations (h_id, i_id, worker, w_id, start, "end", notes) VALUES (?, ?, ?, ?, ?, ?, ?)',
+    "res_cancel": "UPDATE reservations SET status = 'cancelled' WHERE id = ? AND status = 'active'",
+    "res_clash": '''
+        SELECT x.id, x.worker, x.w_id, x.start, x."end"
+        FROM res_rt r JOIN reservations x ON x.id = r.id
+        WHERE r.i_lo <= ?1 AND r.i_hi >= ?1 AND r.t_lo <= ?2 AND r.t_hi >= ?3
+          AND x.start < ?5 AND x."end" > ?4
+        ORDER BY x.start
+    ''',
+    # Cualquier préstamo abierto bloquea, también vencido: lo que no se devolvió sigue fuera
+    "res_loaned": 'SELECT worker, due FROM loans WHERE i_id = ? AND closed IS NULL',
+    "res_inst": 'SELECT 1 FROM tool_inst WHERE id = ? AND h_id = ?',
+    "res_free": '''
+        SELECT ti.id, ti.serial, ti.status FROM tool_inst ti
+        WHERE ti.h_id = ?1 AND ti.status != 'retired'
+          AND NOT EXISTS (
+            SELECT 1 FROM res_rt r JOIN reservations x ON x.id = r.id
+            WHERE r.i_lo <= ti.id AND r.i_hi >= ti.id AND r.t_lo <= ?2 AND r.t_hi >= ?3
+              AND x.start < ?5 AND x."end" > ?4)
+          AND NOT EXISTS (
+            SELECT 1 FROM loans l WHERE l.i_id = ti.id AND l.closed IS NULL)
+        ORDER BY ti.ord
+    ''',
+    "res_tool": '''
+        SELECT x.id, x.i_id, ti.serial, x.worker, x.start, x."end", x.notes
+        FROM reservations x JOIN tool_inst ti ON ti.id = x.i_id
+        WHERE x.h_id = ? AND x.status = 'active' AND x."end" > ?
+        ORDER BY x.start LIMIT ?
+    ''',
+}
+
+# Planes admitidos por `bench.py plans` (ver PLAN_OK en inv2log.py)
+PLAN_OK = {
+    "res_clash": ("SCAN r VIRTUAL TABLE INDEX *", "USE TEMP B-TREE FOR ORDER BY"),  # pocas filas por i_id
+    "res_free": ("SCAN r VIRTUAL TABLE INDEX *",),
+    "res_tool": ("USE TEMP B-TREE FOR ORDER BY",),  # idx_res_h por (h_id, end); se ordena lo que queda
+}
+
+# Fila del R*Tree para NEW, en minutos epoch (strftime('%s') trata la fecha como UTC, igual que _mins)
+_RT = '''
+    INSERT INTO res_rt SELECT NEW.id, NEW.i_id, NEW.i_id,
+        CAST(strftime('%s', NEW.start) AS INTEGER) / 60,
+        (CAST(strftime('%s', NEW."end") AS INTEGER) + 59) / 60 - 1
+    WHERE NEW.status = 'active'
+'''
+
+
+def norm_ts(ts: str) -> Optional[str]:
+    try:
+        return dt.datetime.fromisoformat(ts.strip()).strftime(FMT)
+    except (ValueError, AttributeError):
+        return None
+
+
+def _mins(start: str, end: str) -> Tuple[int, int]:
+    # [start, end) -> [t_lo, t_hi] en minutos, cubriendo por fuera como los triggers
+    s = calendar.timegm(dt.datetime.strptime(start, FMT).timetuple())
+    e = calendar.timegm(dt.datetime.strptime(end, FMT).timetuple())
+    return s // 60, (e + 59) // 60 - 1
+
+
+class Reservations:
+    def __init__(self, conn: sqlite3.Connection, lock: Optional[threading.RLock] = None):
+        self.conn, self.c = conn, conn.cursor()
+        self.lock = lock or threading.RLock()
+        self._init_db()
+
+    def _init_db(self):
+        with self.lock:
+            self.c.executescript(f'''
+            CREATE TABLE IF NOT EXISTS reservations (
+                id INTEGER PRIMARY KEY,
+                h_id INTEGER,
+                i_id INTEGER,
+                worker TEXT,
+                w_id INTEGER REFERENCES workers (id),
+                start TEXT,
+                "end" TEXT,
+                notes TEXT,
+                status TEXT DEFAULT 'active',
+                FOREIGN KEY (h_id) REFERENCES tools (id) ON DELETE CASCADE,
+                FOREIGN KEY (i_id) REFERENCES tool_inst (id) ON DELETE CASCADE
+            );
+            CREATE INDEX IF NOT EXISTS idx_res_h ON reservations(h_id, "end");  -- también la cascada de tools
+            CREATE INDEX IF NOT EXISTS idx_res_i ON reservations(i_id);
+            CREATE VIRTUAL TABLE IF NOT EXISTS res_rt USING rtree_i32(id, i_lo, i_hi, t_lo, t_hi);
+            CREATE TRIGGER IF NOT EXISTS res_rt_i AFTER INSERT ON reservations BEGIN
+                {_RT};
+            END;
+            CREATE TRIGGER IF NOT EXISTS res_rt_u AFTER UPDATE OF i_id, start, "end", status ON reservations BEGIN
+                DELETE FROM res_rt WHERE id = OLD.id;
+                {_RT};
+            END;
+            CREATE TRIGGER IF NOT EXISTS res_rt_d AFTER DELETE ON reservations BEGIN
+                DELETE FROM res_rt WHERE id = OLD.id;
+            END;
+            ''')
+            self.conn.commit()
+
+    def clash(self, i_id: int, start: str, end: str, w_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        # Reservas activas de i_id que se solapan con [start, end); las de w_id no cuentan
+        lo, hi = _mins(start, end)
+        with self.lock:
+            self.c.execute(SQL["res_clash"], (i_id, hi, lo, start, end))
+            return [{"id": r[0], "worker": r[1], "start": r[3], "end": r[4]}
+                    for r in self.c.fetchall() if w_id is None or r[2] != w_id]
+
+    def add(self, h_id: int, i_id: int, worker: str, w_id: Optional[int], start: str, end: str,
+            notes: str = "") -> Tuple[Optional[int], str]:
+        # (id, "") o (None, motivo); sin commit: lo hace el llamador
+        with self.lock:
+            self.c.execute(SQL["res_inst"], (i_id, h_id))
+            if self.c.fetchone() is None:
+                return None, "Inst not found"
+            busy = self.clash(i_id, start, end)
+            if busy:
+                b = busy[0]
+                return None, f"Reserved by {b['worker']} {b['start'][:16]} - {b['end'][:16]}"
+            self.c.execute(SQL["res_loaned"], (i_id,))
+            r = self.c.fetchone()
+            if r:
+                late = " (overdue)" if r[1] and r[1] <= dt.datetime.now().strftime(FMT) else ""
+                return None, f"Loaned to {r[0]} until {(r[1] or '')[:16]}{late}"
+            self.c.execute(SQL["res_add"], (h_id, i_id, worker, w_id, start, end, notes))
+            return self.c.lastrowid, ""
+
+    def cancel(self, r_id: int) -> bool:
+        with self.lock:
+            self.c.execute(SQL["res_cancel"], (r_id,))
+            return self.c.rowcount > 0
+
+    def free(self, h_id: int, start: str, end: str) -> List[Dict[str, Any]]:
+        # Instancias de h_id sin reserva que se solape ni préstamo abierto (vencido o no)
+        lo, hi = _mins(start, end)
+        with self.lock:
+            self.c.execute(SQL["res_free"], (h_id, hi, lo, start, end))
+            return [{"id": r[0], "serial": r[1], "status": r[2]} for r in self.c.fetchall()]
+
+    def of_tool(self, h_id: int, since: str, limit: int = 100) -> List[Dict[str, Any]]:
+        with self.lock:
+            self.c.execute(SQL["res_tool"], (h_id, since, limit))
+            return [{"id": r[0], "i_id": r[1], "serial": r[2], "worker": r[3], "start": r[4], "end": r[5], "notes": r[6]}
+                    for r in self.c.fetchall()]
@@ -0,0 +1,43 @@
+import os
+import sys
+import sqlite3
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench import gen_db  # noqa: E402
+from inv2log import InvApp  # noqa: E402
+
+# BD pequeña generada una vez por sesión; cada test trabaja sobre su propia copia
+TINY = {"tools": 60, "insts": 4, "years": 0.1, "loans_day": 20}
+
+
+def mk_app(d: str, **kw) -> InvApp:
+    return InvApp(db=os.path.join(d, "inv.db"), img_dir=os.path.join(d, "tool_imgs"),
+                  qr_dir=os.path.join(d, "qr_codes"), arch_dir=os.path.join(d, "archive"),
+                  bk_dir=os.path.join(d, "backups"), **kw)
+
+
+def copy_db(src: str, d: str) -> str:
+    os.makedirs(d, exist_ok=True)
+    s, dst = sqlite3.connect(src), sqlite3.connect(os.path.join(d, "inv.db"))
+    s.backup(dst)
+    s.close()
+    dst.close()
+    return d
+
+
+@pytest.fixture(scope="session")
+def seed_db(tmp_path_factory) -> str:
+    d = tmp_path_factory.mktemp("seed")
+    path = str(d / "inv.db")
+    gen_db(path, seed=42, **TINY)
+    return path
+
+
+@pytest.fixture
+def app(seed_db, tmp_path):
+    a = mk_app(copy_db(seed_db, str(tmp_path / "app")))
+    yield a
+    a.conn.close()
@@ -0,0 +1,36 @@
+import os
+import sqlite3
+import datetime as dt
+
+from conftest import mk_app, copy_db
+
+
+def test_archive_keeps_w_id(app):
+    want = {tbl: app.c.execute(f'SELECT id, w_id FROM {tbl} ORDER BY id').fetchall() for tbl in ("loans", "rets")}
+    assert all(w for _, w in want["rets"])
+    tomorrow = (dt.date.today() + dt.timedelta(days=1)).isoformat()
+    moved = app.arch.run(tomorrow)
+    assert moved["loans"] and moved["rets"]
+    for tbl in ("loans", "rets"):
+        assert app.c.execute(f'SELECT id, w_id FROM {tbl}_all ORDER BY id').fetchall() == want[tbl]
+
+
+def test_old_archive_file_gets_w_id(seed_db, tmp_path):
+    # Fichero de archivo sin w_id (anterior a workers.py): se añade la columna y se enlaza por nombre
+    d = copy_db(seed_db, str(tmp_path / "app"))
+    os.makedirs(os.path.join(d, "archive"))
+    c = sqlite3.connect(os.path.join(d, "archive", "inv_2001.db"))
+    c.execute('CREATE TABLE loans (id INTEGER PRIMARY KEY, h_id INTEGER, i_id INTEGER, worker TEXT, date TEXT, due TEXT, closed TEXT)')
+    c.execute('CREATE TABLE rets (id INTEGER PRIMARY KEY, h_id INTEGER, i_id INTEGER, worker TEXT, date TEXT, notes TEXT)')
+    src = sqlite3.connect(seed_db)
+    name = src.execute('SELECT worker FROM rets LIMIT 1').fetchone()[0]
+    src.close()
+    c.executemany('INSERT INTO rets VALUES (?, 1, 1, ?, "2001-05-01 10:00:00", "")',
+                  [(10_000_001, name.upper()), (10_000_002, "Nadie Registrado")])
+    c.commit()
+    c.close()
+    a = mk_app(d)
+    w_id = a.c.execute('SELECT w_id FROM rets WHERE worker = ? LIMIT 1', (name,)).fetchone()[0]
+    assert a.c.execute('SELECT id, w_id FROM a2001.rets ORDER BY id').fetchall() == [(10_000_001, w_id), (10_000_002, None)]
+    assert a.c.execute('SELECT COUNT(*) FROM rets_all WHERE w_id = ?', (w_id,)).fetchone()[0] > 1
+    a.conn.close()
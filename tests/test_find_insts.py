@@ -0,0 +1,42 @@
+N = 2000
+
+
+def _new(app, name, qty):
+    assert app.add_tool(name, "test", qty, False)[0]
+    h_id = app.c.execute('SELECT MAX(id) FROM tools').fetchone()[0]
+    return h_id, app.get_tool(h_id).tool_uuid
+
+
+def test_ordinal_prefix(app):
+    # Lo que pide el selector al abrir ("") y con tres teclas: el número tecleado y luego los
+    # seriales que empiezan por él, por ordinal
+    h_id, tool_uuid = _new(app, "Test pick", N)
+    assert [len(app.find_insts(h_id, q, "avail")) for q in ("", "1", "12", "123")] == [20, 20, 20, 11]
+    assert [i.serial[-4:] for i in app.find_insts(h_id, "12")][:3] == ["-012", "-120", "-121"]
+    assert [i.serial for i in app.find_insts(h_id, "123")] == [f"{tool_uuid}-{k}" for k in (123, *range(1230, 1240))]
+    assert [i.serial for i in app.find_insts(h_id, "007")] == [f"{tool_uuid}-007"]
+    assert app.find_insts(h_id, "0")[-1].serial == f"{tool_uuid}-020"
+    assert app.find_insts(h_id, "9999") == []
+
+
+def test_full_serial(app):
+    h_id, tool_uuid = _new(app, "Test pick", 50)
+    assert [i.serial for i in app.find_insts(h_id, f"{tool_uuid}-04")] == [f"{tool_uuid}-{k:03d}" for k in range(40, 50)]
+
+
+def test_status_filter(app):
+    h_id, _ = _new(app, "Test pick", 30)
+    i_id = app.find_insts(h_id, "5")[0].id
+    assert app.reg_loan(h_id, i_id, "test")
+    assert [i.id for i in app.find_insts(h_id, "5", "loaned")] == [i_id]
+    assert app.find_insts(h_id, "5", "avail") == []
+
+
+def test_finds_merged(app):
+    # Las fundidas conservan el serial de su origen: se encuentran por ordinal nuevo y por su serial
+    dst, _ = _new(app, "Test pick dst", 10)
+    src, s_uuid = _new(app, "Test pick src", 5)
+    assert app.merge_tools(dst, [src])[0]
+    assert [i.serial for i in app.find_insts(dst, "", limit=50)][10:] == [f"{s_uuid}-{k:03d}" for k in range(1, 6)]
+    assert [i.serial for i in app.find_insts(dst, "13", "avail")] == [f"{s_uuid}-003"]
+    assert [i.serial for i in app.find_insts(dst, f"{s_uuid}-00", "avail")] == [f"{s_uuid}-{k:03d}" for k in range(1, 6)]
@@ -0,0 +1,24 @@
+import datetime as dt
+
+
+def _top(app, n):
+    return [r[0] for r in app.c.execute('''
+        SELECT h_id FROM rets r JOIN tools t ON t.id = r.h_id WHERE t.is_consumable = 0
+        GROUP BY h_id ORDER BY COUNT(*) DESC LIMIT ?''', (n,))]
+
+
+def test_merge_moves_archived_history(app):
+    # Lo archivado (a<año>) de las fundidas sigue en el historial completo, a nombre de dst
+    ids = _top(app, 3)
+    assert len(ids) == 3
+    tomorrow = (dt.date.today() + dt.timedelta(days=1)).isoformat()
+    assert app.arch.run(tomorrow)["rets"] and app.arch.years
+    assert app.c.execute('SELECT COUNT(*) FROM main.rets').fetchone()[0] == 0
+    n = app.c.execute('SELECT COUNT(*) FROM rets_all').fetchone()[0]
+    want = app.c.execute(f'SELECT COUNT(*) FROM rets_all WHERE h_id IN ({",".join(map(str, ids))})').fetchone()[0]
+    assert app.merge_tools(ids[0], ids[1:])[0]
+    hist = app.get_hist(limit=n + 1, all_years=True)
+    assert len(hist) == n
+    name = app.get_tool(ids[0]).name
+    assert sum(r[1] == name for r in hist) == want
+    assert app.c.execute(f'SELECT COUNT(*) FROM loans_all WHERE h_id IN ({ids[1]}, {ids[2]})').fetchone()[0] == 0
@@ -0,0 +1,21 @@
+import pytest
+
+from conftest import copy_db
+from bench import check_plans
+
+# Falla por diseño al medirla: InvApp ya creó la clave al abrir la BD
+ERR_OK = {"qr_key_add"}
+
+
+@pytest.fixture(scope="module")
+def plans(seed_db, tmp_path_factory):
+    d = copy_db(seed_db, str(tmp_path_factory.mktemp("plans")))
+    return check_plans(f"{d}/inv.db", repeat=1)
+
+
+def test_no_full_scans(plans):
+    assert {r["name"]: r["bad"] for r in plans if r["bad"]} == {}
+
+
+def test_queries_run(plans):
+    assert {r["name"]: r["err"] for r in plans if r["err"] and r["name"] not in ERR_OK} == {}
@@ -0,0 +1,46 @@
+N = 20
+
+
+def _insts(app, n):
+    assert app.add_tool("Test qr", "test", n, False)[0]
+    h_id = app.c.execute('SELECT MAX(id) FROM tools').fetchone()[0]
+    t = app.get_tool(h_id)
+    return t, [r[0] for r in app.c.execute('SELECT id FROM tool_inst WHERE h_id = ? ORDER BY ord', (h_id,))]
+
+
+def _live(app, ids):
+    q = app.qr_mgr
+    return {u: q.pack.get(u) for (u,) in app.c.execute(
+        f'SELECT qr_uuid FROM tool_inst WHERE id IN ({",".join(map(str, ids))})')}
+
+
+def test_gc_after_regen(app):
+    t, ids = _insts(app, N)
+    q = app.qr_mgr
+    for i_id in ids:
+        assert q.gen_qr(t.tool_uuid, i_id, t.name)
+    for i_id in ids[: N * 3 // 4]:
+        assert app.regen_qr(t.tool_uuid, i_id, t.name)
+        assert q.gen_qr(t.tool_uuid, i_id, t.name)
+    live = _live(app, ids)
+    assert all(live.values())
+    assert q.pack.dead() > 0.3
+    before = q.pack.size()
+    res = q.gc_qrs()
+    assert res["after"] == q.pack.size() < before and q.pack.dead() == 0
+    assert _live(app, ids) == live
+
+
+def test_gc_threshold(app, monkeypatch):
+    # Sin force solo compacta pasado GC_MIN con más de GC_DEAD sustituido; drain_qr_q lo intenta al vaciar la cola
+    t, ids = _insts(app, 4)
+    q = app.qr_mgr
+    for i_id in ids:
+        assert q.gen_qr(t.tool_uuid, i_id, t.name)
+    assert q.gc_qrs(force=False) is None
+    assert app.regen_qr(t.tool_uuid, ids[0], t.name) and q.gen_qr(t.tool_uuid, ids[0], t.name)
+    monkeypatch.setattr("inv2log.GC_MIN", 0)
+    monkeypatch.setattr("inv2log.GC_DEAD", 0.1)
+    gen = q.pack.gen
+    q.drain_qr_q()
+    assert q.pack.gen == gen + 1 and q.pack.dead() == 0
@@ -0,0 +1,134 @@
+import os
+
+import pytest
+
+from conftest import mk_app, copy_db
+from inv2log import RetData
+
+
+def state(a) -> tuple:
+    # Lo que replica repl.py, por claves naturales (los ids son locales de cada nodo)
+    c = a.conn.cursor()
+    return tuple(c.execute(q).fetchall() for q in (
+        'SELECT tool_uuid, name, resp, qty, status FROM tools ORDER BY tool_uuid',
+        'SELECT ti.serial, t.tool_uuid, ti.status, ti.qr_uuid FROM tool_inst ti JOIN tools t ON t.id = ti.h_id ORDER BY 1',
+        'SELECT ti.serial, l.date, l.closed FROM loans l JOIN tool_inst ti ON ti.id = l.i_id ORDER BY 1, 2',
+        'SELECT ti.serial, r.date FROM rets r JOIN tool_inst ti ON ti.id = r.i_id ORDER BY 1, 2',
+    ))
+
+
+def sync(src, dst, path) -> dict:
+    assert src.sync_out(path, dst.repl.node) is not None
+    res = dst.sync_in(path)
+    assert res is not None
+    return res
+
+
+@pytest.fixture
+def pair(seed_db, tmp_path):
+    # Dos sitios sembrados con la misma BD; b con identidad propia, como tras `repl.py node --reset`
+    a = mk_app(copy_db(seed_db, str(tmp_path / "a")))
+    b = mk_app(copy_db(seed_db, str(tmp_path / "b")))
+    b.repl.reset_node()
+    a.repl.reset_node()
+    yield a, b
+    a.conn.close()
+    b.conn.close()
+
+
+def _loan_ret(app, h_id, n, date):
+    ids = [r[0] for r in app.c.execute(
+        'SELECT id FROM tool_inst WHERE h_id = ? AND status = "avail" ORDER BY ord LIMIT ?', (h_id, n))]
+    for i_id in ids:
+        assert app.reg_loan(h_id, i_id, "test")
+        assert app.qr_mgr.reg_ret(RetData(h_id, i_id, "test", date))
+    return ids
+
+
+def test_sync_converges(pair, tmp_path):
+    a, b = pair
+    assert a.add_tool("Repl nueva", "test", 6, False)[0]
+    h_id = a.c.execute('SELECT id FROM tools WHERE name = "Repl nueva"').fetchone()[0]
+    _loan_ret(a, h_id, 3, "2030-01-01 10:00:00")
+    old = a.c.execute('SELECT id, name, resp FROM tools WHERE is_consumable = 0 ORDER BY id LIMIT 2').fetchall()
+    assert a.upd_tool(old[0][0], old[0][1] + " bis", old[0][2], 2, False)[0]
+    assert a.del_tool(old[1][0])[0]
+    res = sync(a, b, str(tmp_path / "a.invcs"))
+    assert res["applied"] and not res["conflicts"]
+    assert state(b) == state(a)
+    # Reaplicar el mismo fichero no cambia nada
+    assert b.sync_in(str(tmp_path / "a.invcs"))["applied"] == 0
+    assert state(b) == state(a)
+
+
+def test_sync_both_ways(pair, tmp_path):
+    a, b = pair
+    assert a.add_tool("Desde A", "test", 2, False)[0]
+    assert b.add_tool("Desde B", "test", 3, False)[0]
+    h_b = b.c.execute('SELECT id FROM tools WHERE name = "Desde B"').fetchone()[0]
+    _loan_ret(b, h_b, 2, "2030-01-02 10:00:00")
+    sync(a, b, str(tmp_path / "a.invcs"))
+    sync(b, a, str(tmp_path / "b.invcs"))
+    assert state(a) == state(b)
+    assert a.c.execute('SELECT COUNT(*) FROM tools WHERE name IN ("Desde A", "Desde B")').fetchone()[0] == 2
+
+
+def test_delete_wins_over_remote_edit(pair, tmp_path):
+    a, b = pair
+    h_id, name, resp = a.c.execute('SELECT id, name, resp FROM tools WHERE is_consumable = 0 ORDER BY id LIMIT 1').fetchone()
+    tool_uuid = a.get_tool(h_id).tool_uuid
+    assert a.del_tool(h_id)[0]
+    h_b = b.c.execute('SELECT id FROM tools WHERE tool_uuid = ?', (tool_uuid,)).fetchone()[0]
+    assert b.upd_tool(h_b, name + " editada", resp, 1, False)[0]
+    sync(b, a, str(tmp_path / "b.invcs"))
+    sync(a, b, str(tmp_path / "a.invcs"))
+    for n in (a, b):
+        assert n.c.execute('SELECT COUNT(*) FROM tools WHERE tool_uuid = ?', (tool_uuid,)).fetchone()[0] == 0
+    assert state(a) == state(b)
+
+
+def test_changeset_from_self_rejected(pair, tmp_path):
+    a, _ = pair
+    path = str(tmp_path / "self.invcs")
+    assert a.sync_out(path, "peer") is not None
+    assert os.path.exists(path) and a.sync_in(path) is None
+
+
+def _hist(app) -> tuple:
+    return tuple(app.c.execute(f'SELECT COUNT(*) FROM {t}').fetchone()[0] for t in ("tools", "tool_inst", "loans", "rets"))
+
+
+def test_merge_keeps_history(pair, tmp_path):
+    # La fusión mueve insts con sus loans/rets a dst; en el otro nodo no debe perderse nada
+    a, b = pair
+    ids = [r[0] for r in a.c.execute('''
+        SELECT h_id FROM rets r JOIN tools t ON t.id = r.h_id WHERE t.is_consumable = 0
+        GROUP BY h_id ORDER BY COUNT(*) DESC LIMIT 3''')]
+    assert len(ids) == 3
+    _loan_ret(a, ids[1], 1, "2030-01-03 10:00:00")
+    sync(a, b, str(tmp_path / "a0.invcs"))
+    before = _hist(a)
+    assert _hist(b) == before
+    d_uuid = a.get_tool(ids[0]).tool_uuid
+    q = 'SELECT COUNT(*) FROM rets r JOIN tools t ON t.id = r.h_id WHERE t.tool_uuid = ?'
+    want = a.c.execute(f'SELECT COUNT(*) FROM rets WHERE h_id IN ({",".join(map(str, ids))})').fetchone()[0]
+    assert a.merge_tools(ids[0], ids[1:])[0]
+    tools, insts, loans, rets = before
+    assert _hist(a) == (tools - 2, insts, loans, rets)
+    sync(a, b, str(tmp_path / "a1.invcs"))
+    assert _hist(b) == _hist(a)
+    assert state(b) == state(a)
+    assert [n.c.execute(q, (d_uuid,)).fetchone()[0] for n in (a, b)] == [want, want]
+
+
+def test_export_keeps_columns_missing_from_old_rows(pair, tmp_path):
+    # Una fila de changes anterior a una migración no trae la columna; las demás filas sí la exportan
+    a, b = pair
+    seq = a.cdc.head()
+    assert a.add_tool("Vieja", "test", 1, False)[0]
+    assert a.add_tool("Nueva", "taller 2", 1, False)[0]
+    a.c.execute('''UPDATE changes SET data = json_remove(data, '$.resp')
+                   WHERE seq = (SELECT MIN(seq) FROM changes WHERE seq > ? AND tbl = 'tools')''', (seq,))
+    a.conn.commit()
+    sync(a, b, str(tmp_path / "a.invcs"))
+    assert b.c.execute('SELECT resp FROM tools WHERE name = "Nueva"').fetchone() == ("taller 2",)
@@ -0,0 +1,45 @@
+import datetime as dt
+
+FMT = "%Y-%m-%d %H:%M:%S"
+
+
+def _tool(app, qty=3):
+    assert app.add_tool("Test res", "test", qty, False)[0]
+    h_id = app.c.execute('SELECT MAX(id) FROM tools').fetchone()[0]
+    return h_id, [r[0] for r in app.c.execute('SELECT id FROM tool_inst WHERE h_id = ? ORDER BY ord', (h_id,))]
+
+
+def _win(days=1, hours=4):
+    s = dt.datetime.now().replace(microsecond=0) + dt.timedelta(days=days)
+    return s.strftime(FMT), (s + dt.timedelta(hours=hours)).strftime(FMT)
+
+
+def test_overdue_loan_blocks(app):
+    # Préstamo abierto ya vencido: la inst sigue fuera, ni libre ni reservable
+    h_id, ids = _tool(app)
+    assert app.reg_loan(h_id, ids[0], "test")
+    app.c.execute('UPDATE loans SET due = ? WHERE i_id = ? AND closed IS NULL', ("2000-01-01 00:00:00", ids[0]))
+    app.conn.commit()
+    s, e = _win()
+    assert {i["id"] for i in app.free_insts(h_id, s, e)} == set(ids[1:])
+    ok, why = app.reserve(h_id, ids[0], "otro", s, e)
+    assert not ok and "overdue" in why
+    assert app.reserve(h_id, ids[1], "otro", s, e)[0]
+
+
+def test_reserve_checks_tool(app):
+    h_id, ids = _tool(app)
+    other, _ = _tool(app)
+    s, e = _win()
+    assert app.reserve(other, ids[0], "test", s, e) == (False, "Inst not found")
+    assert app.c.execute('SELECT COUNT(*) FROM reservations WHERE i_id = ?', (ids[0],)).fetchone()[0] == 0
+    assert app.reserve(h_id, ids[0], "test", s, e)[0]
+
+
+def test_clash(app):
+    h_id, ids = _tool(app)
+    s, e = _win()
+    assert app.reserve(h_id, ids[0], "uno", s, e)[0]
+    assert not app.reserve(h_id, ids[0], "dos", *_win(days=1, hours=1))[0]
+    assert app.reserve(h_id, ids[0], "dos", e, _win(days=2)[0])[0]  # [start, end): empieza donde acaba la otra
+    assert ids[0] not in {i["id"] for i in app.free_insts(h_id, s, e)}
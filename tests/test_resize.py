@@ -0,0 +1,64 @@
+N = 1000
+
+
+def _new(app, qty=0):
+    ok, _ = app.add_tool("Test resize", "test", qty, False)
+    assert ok
+    return app.c.execute('SELECT MAX(id) FROM tools').fetchone()[0]
+
+
+def _ords(app, h_id):
+    return [r[0] for r in app.c.execute('SELECT ord FROM tool_inst WHERE h_id = ? ORDER BY ord', (h_id,))]
+
+
+def test_grow_appends_ordinals(app):
+    h_id = _new(app, 3)
+    assert app.upd_tool(h_id, "Test resize", "test", N, False)[0]
+    assert _ords(app, h_id) == list(range(1, N + 1))
+    tool_uuid = app.get_tool(h_id).tool_uuid
+    serials = {r[0] for r in app.c.execute('SELECT serial FROM tool_inst WHERE h_id = ?', (h_id,))}
+    assert serials == {f"{tool_uuid}-{k:03d}" for k in range(1, N + 1)}
+
+
+def test_shrink_keeps_loaned(app):
+    # Reduce quitando las últimas libres; las prestadas se quedan aunque tengan ord alto
+    h_id = _new(app)
+    assert app.upd_tool(h_id, "Test resize", "test", N, False)[0]
+    loaned = [r[0] for r in app.c.execute(
+        'SELECT id FROM tool_inst WHERE h_id = ? ORDER BY ord DESC LIMIT 10', (h_id,))]
+    for i_id in loaned:
+        assert app.reg_loan(h_id, i_id, "test")
+    assert app.upd_tool(h_id, "Test resize", "test", N // 2, False)[0]
+    assert app.c.execute('SELECT COUNT(*), MAX(ord) FROM tool_inst WHERE h_id = ?', (h_id,)).fetchone() == (N // 2, N)
+    kept = {r[0] for r in app.c.execute('SELECT id FROM tool_inst WHERE h_id = ?', (h_id,))}
+    assert set(loaned) <= kept
+
+
+def test_shrink_below_loaned_refused(app):
+    h_id = _new(app, 20)
+    ids = [r[0] for r in app.c.execute('SELECT id FROM tool_inst WHERE h_id = ? ORDER BY ord LIMIT 10', (h_id,))]
+    for i_id in ids:
+        assert app.reg_loan(h_id, i_id, "test")
+    assert not app.upd_tool(h_id, "Test resize", "test", 5, False)[0]
+    assert app.c.execute('SELECT COUNT(*) FROM tool_inst WHERE h_id = ?', (h_id,)).fetchone()[0] == 20
+    assert app.upd_tool(h_id, "Test resize", "test", 10, False)[0]
+    assert app.c.execute(
+        'SELECT COUNT(*) FROM tool_inst WHERE h_id = ? AND status = "loaned"', (h_id,)).fetchone()[0] == 10
+
+
+def test_regrow_after_shrink_continues(app):
+    # Tras reducir, crecer sigue desde el ord más alto que quede: ningún serial se reutiliza
+    h_id = _new(app, 10)
+    last = app.c.execute('SELECT id FROM tool_inst WHERE h_id = ? AND ord = 10', (h_id,)).fetchone()[0]
+    assert app.reg_loan(h_id, last, "test")
+    assert app.upd_tool(h_id, "Test resize", "test", 2, False)[0]
+    assert _ords(app, h_id) == [1, 10]
+    assert app.upd_tool(h_id, "Test resize", "test", 4, False)[0]
+    assert _ords(app, h_id) == [1, 10, 11, 12]
+
+
+def test_del_tool_removes_insts(app):
+    h_id = _new(app, 50)
+    assert app.del_tool(h_id)[0]
+    assert app.c.execute('SELECT COUNT(*) FROM tool_inst WHERE h_id = ?', (h_id,)).fetchone()[0] == 0
+    assert app.c.execute('SELECT COUNT(*) FROM qr_q WHERE i_id NOT IN (SELECT id FROM tool_inst)').fetchone()[0] == 0
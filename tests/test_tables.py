@@ -0,0 +1,19 @@
+import uuid
+
+from inv2log import ToolTable, InstTable
+
+U = str(uuid.uuid4())
+ODD = [U, U.upper(), U.replace("-", ""), "{" + U + "}", "urn:uuid:" + U, "not-a-uuid", None]
+
+
+def test_tool_uuid_round_trips():
+    rows = [(k, v, f"T{k}", "r", 1, False, None, "avail") for k, v in enumerate(ODD)]
+    t = ToolTable(rows)
+    assert list(t.rows()) == rows
+
+
+def test_inst_uuids_round_trip():
+    rows = [(k, 1, v, f"{v}-{k:03d}", "avail", q, None) for k, (v, q) in enumerate(zip(ODD, reversed(ODD)))]
+    t = InstTable((*r, k) for k, r in enumerate(rows))
+    assert [t.row(k) for k in range(len(t))] == rows
+    assert [i.serial for i in t] == [r[3] for r in rows]
@@ -0,0 +1,31 @@
+import datetime as dt
+
+
+def _all(app, i_id, limit=7):
+    out, cur = [], None
+    while True:
+        rows, cur = app.timeline(i_id, cur, limit)
+        out += rows
+        if cur is None:
+            return out
+
+
+def test_timeline_pages_in_order(app):
+    i_id = app.c.execute('SELECT i_id FROM rets GROUP BY i_id ORDER BY COUNT(*) DESC LIMIT 1').fetchone()[0]
+    rows = _all(app, i_id)
+    keys = [(r["date"], r["id"], r["kind"]) for r in rows]
+    assert keys == sorted(set(keys), reverse=True)
+    n = app.c.execute('SELECT (SELECT COUNT(*) FROM loans WHERE i_id = ?1) + (SELECT COUNT(*) FROM rets WHERE i_id = ?1)',
+                      (i_id,)).fetchone()[0]
+    assert sum(r["kind"] in ("loan", "ret") for r in rows) == n
+
+
+def test_timeline_includes_archived(app):
+    # Quién tuvo la inst: lo archivado (a<año>) sigue saliendo, con su detalle
+    i_id = app.c.execute('SELECT i_id FROM rets GROUP BY i_id ORDER BY COUNT(*) DESC LIMIT 1').fetchone()[0]
+    before = _all(app, i_id)
+    tomorrow = (dt.date.today() + dt.timedelta(days=1)).isoformat()
+    assert app.arch.run(tomorrow)["rets"]
+    assert app.c.execute('SELECT COUNT(*) FROM main.rets WHERE i_id = ?', (i_id,)).fetchone()[0] == 0
+    assert _all(app, i_id) == before
+    assert any(r["kind"] == "ret" and r["worker"] for r in before)
@@ -0,0 +1,113 @@
+import json
+import sqlite3
+import threading
+import logging
+from typing import Optional, Dict, List, Any, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Historial de una instancia: préstamos, devoluciones, cambios (QR reemitido, serial,
+# estado, herramienta) y traslados, en orden de fecha. h_qr solo guarda el QR vigente
+# (regen_qr borra el anterior) y changes se poda, así que los cambios de tool_inst se
+# anotan en inst_edits con triggers; avail <-> loaned no, eso ya son loans/rets.
+# Cada fuente tiene índice (i_id, date): la fusión lee solo índices (date, id) en orden
+# y se para en la página; el detalle se pide después por id. El cursor es (date, id, kind)
+# de la última fila. Con all_years, loans/rets se leen de las vistas loans_all/rets_all
+# (archive.py), que bajan el filtro por i_id a cada año adjunto.
+
+KINDS = ("loan", "ret", "edit", "move")
+PAGE = 50
+TOP = ("9999", 1 << 62, "~")  # cursor de la primera página
+
+SQL = {
+    # ?1 i_id, cursor (?2 date, ?3 id, ?4 kind), ?5 límite
+    "tl_keys": '''
+        SELECT date, id, 'loan' FROM {loans}
+        WHERE i_id = ?1 AND date <= ?2 AND (date < ?2 OR (id, 'loan') < (?3, ?4))
+        UNION ALL SELECT date, id, 'ret' FROM {rets}
+        WHERE i_id = ?1 AND date <= ?2 AND (date < ?2 OR (id, 'ret') < (?3, ?4))
+        UNION ALL SELECT date, id, 'edit' FROM inst_edits
+        WHERE i_id = ?1 AND date <= ?2 AND (date < ?2 OR (id, 'edit') < (?3, ?4))
+        UNION ALL SELECT date, id, 'move' FROM transfers
+        WHERE i_id = ?1 AND date <= ?2 AND (date < ?2 OR (id, 'move') < (?3, ?4))
+        ORDER BY 1 DESC, 2 DESC, 3 DESC LIMIT ?5
+    ''',
+    "tl_loan": 'SELECT id, worker, due, closed FROM {loans} WHERE id IN (SELECT value FROM json_each(?))',
+    "tl_ret": 'SELECT id, worker, notes FROM {rets} WHERE id IN (SELECT value FROM json_each(?))',
+    "tl_edit": 'SELECT id, what, old, new FROM inst_edits WHERE id IN (SELECT value FROM json_each(?))',
+    "tl_move": '''
+        SELECT x.id, x.worker, s.name, d.name, x.notes
+        FROM transfers x LEFT JOIN locations s ON s.id = x.src LEFT JOIN locations d ON d.id = x.dst
+        WHERE x.id IN (SELECT value FROM json_each(?))
+    ''',
+}
+
+# Planes admitidos por `bench.py plans` (ver PLAN_OK en inv2log.py)
+PLAN_OK: Dict[str, tuple] = {}
+
+_EDIT = '''
+    CREATE TRIGGER IF NOT EXISTS tl_{what} AFTER UPDATE OF {col} ON tool_inst WHEN {when} BEGIN
+        INSERT INTO inst_edits (i_id, date, what, old, new)
+        VALUES (NEW.id, datetime('now', 'localtime'), '{what}', {old}, {new});
+    END;
+'''
+_EDITS = "".join(_EDIT.format(what=w, col=c, when=wh, old=o, new=n) for w, c, wh, o, n in (
+    ("qr", "qr_uuid", "OLD.qr_uuid IS NOT NEW.qr_uuid", "OLD.qr_uuid", "NEW.qr_uuid"),
+    ("serial", "serial", "OLD.serial IS NOT NEW.serial", "OLD.serial", "NEW.serial"),
+    ("status", "status", "OLD.status IS NOT NEW.status AND NOT (OLD.status IN ('avail', 'loaned') "
+                         "AND NEW.status IN ('avail', 'loaned'))", "OLD.status", "NEW.status"),
+    ("tool", "h_id", "OLD.h_id IS NOT NEW.h_id",  # nombres, no ids: la herramienta de origen puede desaparecer
+     "(SELECT name FROM tools WHERE id = OLD.h_id)", "(SELECT name FROM tools WHERE id = NEW.h_id)"),
+))
+
+
+class Timeline:
+    def __init__(self, conn: sqlite3.Connection, lock: Optional[threading.RLock] = None):
+        self.conn, self.c = conn, conn.cursor()
+        self.lock = lock or threading.RLock()
+        self._init_db()
+
+    def _init_db(self):
+        with self.lock:
+            self.c.executescript(f'''
+            CREATE TABLE IF NOT EXISTS inst_edits (
+                id INTEGER PRIMARY KEY,
+                i_id INTEGER,
+                date TEXT,
+                what TEXT,
+                old TEXT,
+                new TEXT,
+                FOREIGN KEY (i_id) REFERENCES tool_inst (id) ON DELETE CASCADE
+            );
+            CREATE INDEX IF NOT EXISTS idx_edits_i_date ON inst_edits(i_id, date);
+            CREATE INDEX IF NOT EXISTS idx_loans_i_date ON loans(i_id, date);
+            CREATE INDEX IF NOT EXISTS idx_rets_i_date ON rets(i_id, date);
+            {_EDITS}
+            ''')
+            self.conn.commit()
+
+    def page(self, i_id: int, cur: Optional[Tuple[str, int, str]] = None, limit: int = PAGE,
+             all_years: bool = False) -> Tuple[List[Dict[str, Any]], Optional[Tuple[str, int, str]]]:
+        # (filas más recientes primero, cursor de la página siguiente o None si no hay más)
+        src = {"loans": "loans_all", "rets": "rets_all"} if all_years else {"loans": "loans", "rets": "rets"}
+        with self.lock:
+            self.c.execute(SQL["tl_keys"].format(**src), (i_id, *(cur or TOP), limit))
+            keys = self.c.fetchall()
+            ids: Dict[str, List[int]] = {}
+            for _, id, k in keys:
+                ids.setdefault(k, []).append(id)
+            det: Dict[Tuple[str, int], Dict[str, Any]] = {}
+            for k, v in ids.items():
+                self.c.execute(SQL["tl_" + k].format(**src), (json.dumps(v),))
+                for r in self.c.fetchall():
+                    if k == "loan":
+                        d = {"worker": r[1], "due": r[2], "closed": r[3]}
+                    elif k == "ret":
+                        d = {"worker": r[1], "notes": r[2]}
+                    elif k == "edit":
+                        d = {"worker": None, "what": r[1], "old": r[2], "new": r[3]}
+                    else:
+                        d = {"worker": r[1], "src": r[2], "dst": r[3], "notes": r[4]}
+                    det[k, r[0]] = d
+        rows = [{"date": date, "kind": k, "id": id, **det.get((k, id), {})} for date, id, k in keys]
+        return rows, (tuple(keys[-1]) if len(keys) == limit else None)
@@ -0,0 +1,150 @@
+import sqlite3
+import threading
+import unicodedata
+import logging
+from typing import Optional, Dict, List, Any, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Registro de trabajadores. loans/rets guardan w_id (FK a workers) además del texto
+# `worker`, que se conserva tal como se escribió. La identidad es el nombre normalizado
+# (sin acentos, minúsculas, espacios simples): "José  Pérez" y "jose perez" son el mismo.
+# link() asigna w_id a las filas que no lo tienen: la migración inicial, lo que llega
+# por replicación (repl.py no transporta ids locales) y lo escrito sin pasar por InvApp.
+
+SQL = {
+    "w_get": 'SELECT id, name FROM workers WHERE norm = ?',
+    "w_add": 'INSERT INTO workers (name, norm) VALUES (?, ?)',
+    "w_find": '''
+        SELECT id, name FROM workers
+        WHERE norm >= ? AND norm < ? AND active = 1
+        ORDER BY norm LIMIT ?
+    ''',
+    "w_loans": '''
+        SELECT l.id, l.h_id, l.i_id, t.name, ti.serial, l.date, l.due
+        FROM loans l JOIN tools t ON t.id = l.h_id JOIN tool_inst ti ON ti.id = l.i_id
+        WHERE l.w_id = ? AND l.closed IS NULL
+        ORDER BY l.due
+    ''',
+    "w_hist": '''
+        SELECT l.id, t.name, ti.serial, l.date, l.closed
+        FROM loans l JOIN tools t ON t.id = l.h_id JOIN tool_inst ti ON ti.id = l.i_id
+        WHERE l.w_id = ?
+        ORDER BY l.date DESC LIMIT ?
+    ''',
+    "w_unlinked": '''
+        SELECT worker, COUNT(*) FROM (
+            SELECT worker FROM loans WHERE w_id IS NULL
+            UNION ALL SELECT worker FROM rets WHERE w_id IS NULL
+        ) GROUP BY worker
+    ''',
+}
+
+# Planes admitidos por `bench.py plans` (ver PLAN_OK en inv2log.py)
+PLAN_OK = {
+    "w_unlinked": ("SCAN (subquery*)", "USE TEMP B-TREE FOR GROUP BY"),  # las ramas van por idx_*_w (w_id IS NULL)
+}
+
+
+def norm(name: Optional[str]) -> str:
+    s = unicodedata.normalize("NFKD", name or "")
+    return " ".join("".join(c for c in s if not unicodedata.combining(c)).casefold().split())
+
+
+class Workers:
+    def __init__(self, conn: sqlite3.Connection, lock: Optional[threading.RLock] = None):
+        self.conn, self.c = conn, conn.cursor()
+        self.lock = lock or threading.RLock()
+        self._init_db()
+
+    def _init_db(self):
+        with self.lock:
+            self.c.executescript('''
+            CREATE TABLE IF NOT EXISTS workers (
+                id INTEGER PRIMARY KEY,
+                name TEXT,
+                norm TEXT UNIQUE,
+                active INTEGER DEFAULT 1
+            );
+            ''')
+            for tbl in ("loans", "rets"):
+                cols = [r[1] for r in self.c.execute(f'PRAGMA table_info({tbl})').fetchall()]
+                if 'w_id' not in cols:
+                    self.c.execute(f'ALTER TABLE {tbl} ADD COLUMN w_id INTEGER REFERENCES workers (id)')
+            self.c.executescript('''
+            CREATE INDEX IF NOT EXISTS idx_loans_w ON loans(w_id, date);
+            CREATE INDEX IF NOT EXISTS idx_loans_w_open ON loans(w_id, due) WHERE closed IS NULL;
+            CREATE INDEX IF NOT EXISTS idx_rets_w ON rets(w_id, date);
+            ''')
+            self.conn.commit()
+            # Migración inicial y filas escritas sin w_id por otro proceso (repl.py, cargas directas)
+            res = self.link()
+            if res["loans"] or res["rets"]:
+                logger.info("Workers linked: %s", res)
+
+    def get_or_add(self, name: str) -> Tuple[Optional[int], str]:
+        # (id, nombre registrado); sin commit: va en la transacción del préstamo/devolución
+        n = norm(name)
+        if not n:
+            return None, name
+        with self.lock:
+            r = self.c.execute(SQL["w_get"], (n,)).fetchone()
+            if r:
+                return r[0], r[1]
+            name = " ".join(name.split())
+            self.c.execute(SQL["w_add"], (name, n))
+            return self.c.lastrowid, name
+
+    def link(self) -> Dict[str, int]:
+        # w_id para las filas que no lo tienen; nombre nuevo = la grafía más usada de su grupo
+        with self.lock:
+            groups: Dict[str, Dict[str, int]] = {}
+            for w, cnt in self.c.execute(SQL["w_unlinked"]).fetchall():
+                n = norm(w)
+                if n:
+                    groups.setdefault(n, {})[w] = cnt
+            if not groups:
+                return {"workers": 0, "loans": 0, "rets": 0}
+            m, added = [], 0
+            for n, spellings in groups.items():
+                r = self.c.execute(SQL["w_get"], (n,)).fetchone()
+                if r:
+                    w_id = r[0]
+                else:
+                    self.c.execute(SQL["w_add"], (" ".join(max(spellings, key=spellings.get).split()), n))
+                    w_id, added = self.c.lastrowid, added + 1
+                m += [(w, w_id) for w in spellings]
+            try:
+                self.c.execute('CREATE TEMP TABLE IF NOT EXISTS w_map (worker TEXT PRIMARY KEY, w_id INTEGER)')
+                self.c.execute('DELETE FROM temp.w_map')
+                self.c.executemany('INSERT INTO temp.w_map VALUES (?, ?)', m)
+                res = {"workers": added}
+                for tbl in ("loans", "rets"):
+                    self.c.execute(f'''
+                        UPDATE {tbl} SET w_id = (SELECT w_id FROM temp.w_map m WHERE m.worker = {tbl}.worker)
+                        WHERE w_id IS NULL AND worker IN (SELECT worker FROM temp.w_map)
+                    ''')
+                    res[tbl] = self.c.rowcount
+                self.c.execute('DELETE FROM temp.w_map')
+                self.conn.commit()
+            except sqlite3.Error:
+                self.conn.rollback()
+                raise
+            return res
+
+    def find(self, prefix: str, limit: int = 20) -> List[Dict[str, Any]]:
+        p = norm(prefix)
+        with self.lock:
+            self.c.execute(SQL["w_find"], (p, p[:-1] + chr(ord(p[-1]) + 1) if p else "\U0010ffff", limit))
+            return [{"id": r[0], "name": r[1]} for r in self.c.fetchall()]
+
+    def open_loans(self, w_id: int) -> List[Dict[str, Any]]:
+        with self.lock:
+            self.c.execute(SQL["w_loans"], (w_id,))
+            return [{"id": r[0], "h_id": r[1], "i_id": r[2], "tool": r[3], "serial": r[4], "date": r[5], "due": r[6]}
+                    for r in self.c.fetchall()]
+
+    def hist(self, w_id: int, limit: int = 50) -> List[Dict[str, Any]]:
+        with self.lock:
+            self.c.execute(SQL["w_hist"], (w_id, limit))
+            return [{"id": r[0], "tool": r[1], "serial": r[2], "date": r[3], "closed": r[4]} for r in self.c.fetchall()]